@@ -1,9 +1,54 @@
 import streamlit as st
 import anthropic
 from datetime import datetime
-import os
 import time
-import base64
+import logging
+import uuid
+import hashlib
+import functools
+from collections import Counter
+
+from client_pool import ClientRegistry, format_pool_stats, key_fingerprint
+from batch_reports import REPORT_TYPES, BatchRunner, ReportBatch, report_prompt
+from conversation_store import ConversationMessages, ConversationStore, open_conversation
+from growth import compute_caseload_growth, growth_prompt_section, scores_version, student_rows
+from history import HistoryManager
+from image_pipeline import ImagePipeline, format_image_report
+from portfolio_store import PortfolioExtractor, PortfolioStore, portfolio_prompt_section, sample_label
+from prewarm import PromptPrewarmer
+from profiler import ScriptProfiler, format_run_rows
+from prompt_builder import (PromptAsset, build_system_blocks, estimate_tokens, format_usage, no_data_system_blocks,
+                            usage_from_event)
+from rate_limiter import RateLimitScheduler
+from response_cache import ResponseCache, response_key
+from retrieval import conversation_query, open_retriever
+from router import AUTO_MODEL, MAX_OUTPUT_TOKENS as MAX_OUTPUT_TOKENS_BY_MODEL, ModelRouter, classify_turn
+from roster import Roster, RosterIndex
+from settings import get_setting
+from stream_renderer import StreamRenderer, format_render_stats
+from stream_worker import TRUNCATION_MARKER, StreamCancelled, StreamWorkers
+from student_store import age_on, open_student_store
+from telemetry import REQUEST_LOG_PATH, RequestLogWriter, percentile_summary, read_records, records_frame, utc_now
+from warmup import WarmUp, import_modules
+
+logger = logging.getLogger(__name__)
+
+# Teacher signed in to the dashboard
+TEACHER_NAME = "Jerry Henley"
+
+SUBJECT_TITLES = {"reading": "Reading", "mathematics": "Mathematics"}
+GENDERS = {"M": "Male", "F": "Female"}
+
+# "5" -> "5th", "K" -> "K"
+def ordinal_grade(grade):
+    if not str(grade).isdigit():
+        return grade
+    number = int(grade)
+    suffix = "th" if 10 <= number % 100 <= 20 else {1: "st", 2: "nd", 3: "rd"}.get(number % 10, "th")
+    return f"{number}{suffix}"
+
+# Start of this full-page script run, for the per-turn timing shown under the chat
+page_started = time.perf_counter()
 
 # App title and configuration
 st.set_page_config(
@@ -12,6 +57,33 @@ st.set_page_config(
     layout="wide",  # Use wide layout for split screen
 )
 
+# Opt-in profiling (PROFILE setting, or ?profile=1 in the URL where PROFILE_URL_OPT_IN allows it): times
+# each section of every script run, with tracemalloc allocations per section, and shows the breakdown in
+# an overlay at the bottom of the page. The opt-in is checked on every page run: opting out (dropping
+# ?profile=1 from the URL) stops the profiler and its share of tracemalloc straight away instead of when
+# the session ends, and opting back in starts a fresh one.
+profiling = get_setting("PROFILE", False) or (
+    get_setting("PROFILE_URL_OPT_IN", False) and st.query_params.get("profile") == "1")
+if "profiler" not in st.session_state or (profiling and not st.session_state.profiler.enabled):
+    st.session_state.profiler = ScriptProfiler(enabled=profiling, trace_memory=get_setting("PROFILE_MEMORY", True))
+elif not profiling and st.session_state.profiler.enabled:
+    st.session_state.profiler.stop()
+
+profiler = st.session_state.profiler
+profiler.start_run("page")
+profiler.step("styles")
+
+# Times a fragment as its own run when it reruns alone (reads the profiler at call time, since
+# fragment reruns don't re-execute the code above)
+def profiled(name):
+    def decorate(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with st.session_state.profiler.run(name):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
 # Authentication removed for public access
 if "authenticated" not in st.session_state:
     st.session_state.authenticated = True
@@ -110,13 +182,174 @@ st.markdown("""
 
 # Header is now handled in the columns above
 
-# Initialize Anthropic client
-def initialize_client():
+profiler.step("setup")
+
+REQUEST_LOG_BACKUPS = get_setting("REQUEST_LOG_BACKUPS", 5)
+
+# One record per API request (latency, tokens, errors), appended to the request log by a background thread
+@st.cache_resource
+def get_request_log():
+    return RequestLogWriter(path=get_setting("REQUEST_LOG_PATH", REQUEST_LOG_PATH),
+                            max_bytes=get_setting("REQUEST_LOG_MAX_BYTES", 10 * 1024 * 1024),
+                            backups=REQUEST_LOG_BACKUPS)
+
+request_log = get_request_log()
+
+# Warm-up stage for this server process, started once the functions it calls are defined (below)
+@st.cache_resource
+def get_warm_up():
+    return WarmUp()
+
+warm_up = get_warm_up()
+
+# API admission control, shared by every session in this server process
+@st.cache_resource
+def get_rate_scheduler():
+    return RateLimitScheduler(
+        limits={
+            "requests": get_setting("RATE_LIMIT_RPM", 50),
+            "input_tokens": get_setting("RATE_LIMIT_INPUT_TPM", 40000),
+            "output_tokens": get_setting("RATE_LIMIT_OUTPUT_TPM", 16000),
+        },
+        max_retries=get_setting("RATE_LIMIT_MAX_RETRIES", 4),
+    )
+
+rate_scheduler = get_rate_scheduler()
+
+# Speculative prompt-cache writes for the student a teacher has just opened, shared by all sessions
+PREWARM_ENABLED = get_setting("PREWARM", True)
+
+@st.cache_resource
+def get_prewarmer():
+    return PromptPrewarmer(rate_scheduler, tokens_per_hour=get_setting("PREWARM_TOKENS_PER_HOUR", 1_000_000),
+                           headroom=get_setting("PREWARM_HEADROOM", 0.25))
+
+prewarmer = get_prewarmer()
+
+# Routing mode ("Auto" in the model dropdown): model, thinking budget and output cap chosen per turn
+@st.cache_resource
+def get_model_router():
+    return ModelRouter(overload_cooldown=get_setting("ROUTER_OVERLOAD_COOLDOWN", 30.0))
+
+model_router = get_model_router()
+
+# Prewarm the cached prompt prefix for the selected student and model, once per change of either
+# (a session starting counts as one). Skipped while a turn is streaming; that request warms the cache itself.
+def prewarm_prompt_cache():
+    target = (st.session_state.selected_student, st.session_state.selected_model)
+    if not PREWARM_ENABLED or st.session_state.get("prewarmed_for") == target or st.session_state.is_streaming:
+        return
+    st.session_state.prewarmed_for = target
+    # In routing mode, warm the model a first question (usually a lookup) would be routed to
+    model = (model_router.route("lookup")["model"] if st.session_state.selected_model == AUTO_MODEL
+             else st.session_state.selected_model)
+    st.session_state.last_prewarm = prewarmer.prewarm(st.session_state.client, model, get_system_blocks(),
+                                                      session_id=st.session_state.session_id)
+
+# Admin view (?view=admin): latency and usage percentiles from the request log, per model and per hour
+def render_admin_view():
+    st.title("Request telemetry")
+    request_log.flush(timeout=1.0)
+    frame = records_frame(read_records(request_log.path, REQUEST_LOG_BACKUPS))
+    if frame.empty:
+        st.info("No requests logged yet.")
+        return
+    st.caption(f"{len(frame):,} requests from {frame['ts'].min():%Y-%m-%d %H:%M} to {frame['ts'].max():%Y-%m-%d %H:%M} UTC"
+               + (f" | {request_log.dropped:,} records dropped" if request_log.dropped else ""))
+    st.subheader("Per model")
+    st.dataframe(percentile_summary(frame, "model"), hide_index=True)
+    st.subheader("Per model and hour")
+    hourly = percentile_summary(frame, ["model", "hour"])
+    st.line_chart(hourly, x="hour", y="TTFT s p90", color="model")
+    st.dataframe(hourly.sort_values(["hour", "model"], ascending=[False, True]), hide_index=True)
+    errors = frame[frame["error"]]
+    if not errors.empty:
+        st.subheader("Errors")
+        st.dataframe(errors.groupby(["model", "error_class"]).size().rename("requests").reset_index(),
+                     hide_index=True)
+    if "phase" in frame:
+        st.subheader("Cold start vs steady state")
+        st.caption("first: the first API request after a server start | warming: sent while the warm-up "
+                   "was still running | steady: everything after")
+        st.dataframe(percentile_summary(frame[~frame["cached_response"]].fillna({"phase": "unknown"}), "phase"),
+                     hide_index=True)
+    if "route" in frame and frame["route"].notna().any():
+        st.subheader("Routing")
+        st.caption("Routed turns per kind of turn and model; fallbacks are turns moved off an overloaded model")
+        routed = frame[frame["route"].notna()]
+        summary = percentile_summary(routed, ["route", "model"])
+        summary.insert(3, "fallbacks", summary.merge(
+            routed[routed["fallback_from"].notna()].groupby(["route", "model"]).size().rename("fallbacks").reset_index(),
+            how="left", on=["route", "model"])["fallbacks"].fillna(0).astype(int))
+        st.dataframe(summary, hide_index=True)
+        st.dataframe(model_router.stats(), hide_index=True)
+    render_warm_up_report()
+    render_prewarm_report()
+
+# How many speculative prompt-cache prewarms were sent, skipped and later used, in this server process
+def render_prewarm_report():
+    stats = prewarmer.stats()
+    st.subheader("Prompt-cache prewarm")
+    used_rate = stats.pop("used_rate")
+    spent = stats.pop("budget_spent")
+    st.caption(f"{stats.get('used', 0):,} of {stats.get('sent', 0):,} prewarms used"
+               + (f" ({used_rate:.0%} of those resolved)" if used_rate is not None else "")
+               + f" | budget {prewarmer.tokens_per_hour:,} tokens/hour per organization, spent: "
+               + (", ".join(f"{org} {tokens:,}" for org, tokens in spent.items()) or "none"))
+    st.dataframe([{"outcome": outcome, "count": count} for outcome, count in sorted(stats.items())], hide_index=True)
+
+# Warm-up steps and page-run times for this server process
+def render_warm_up_report():
+    report = warm_up.report()
+    st.subheader("This server process")
+    first_page, steady_page = report["first_page_seconds"], report["steady_page_seconds"]
+    st.caption(f"Started {datetime.fromtimestamp(report['process_started']):%Y-%m-%d %H:%M:%S} | "
+               + (f"warm-up {report['warm_up_seconds']:.2f} s" if report["warm_up_seconds"] is not None
+                  else "warm-up running or not started")
+               + (f" | first page run {first_page * 1000:.0f} ms" if first_page is not None else "")
+               + (f" | steady page run p50 {steady_page * 1000:.0f} ms" if steady_page is not None else "")
+               + f" | {report['requests']:,} API requests")
+    if report["steps"]:
+        st.dataframe([{"step": step["step"], "ms": round(step["seconds"] * 1000, 1), "error": step["error"]}
+                      for step in report["steps"]], hide_index=True)
+    st.caption(format_pool_stats(client_registry.stats()))
+
+def secrets_api_key():
     # Try to get API key from secrets, but handle the case where secrets.toml doesn't exist
     try:
-        api_key = st.secrets.get("ANTHROPIC_API_KEY", None)
+        return st.secrets.get("ANTHROPIC_API_KEY", None)
     except FileNotFoundError:
-        api_key = None
+        return None
+
+# One pooled client per API key for the whole server process. Connections for the configured key
+# are opened by the warm-up.
+@st.cache_resource
+def get_client_registry():
+    return ClientRegistry(
+        max_connections=get_setting("HTTP_MAX_CONNECTIONS", 100),
+        max_keepalive_connections=get_setting("HTTP_MAX_KEEPALIVE", 20),
+        keepalive_expiry=get_setting("HTTP_KEEPALIVE_SECONDS", 60.0),
+        connect_timeout=get_setting("HTTP_CONNECT_TIMEOUT", 5.0),
+        read_timeout=get_setting("HTTP_READ_TIMEOUT", 600.0),
+    )
+
+client_registry = get_client_registry()
+
+# The admin view shows telemetry for every session, so ?view=admin only opens it where the ADMIN_VIEW setting
+# is on, for a user signed in through Streamlit authentication whose email is in ADMIN_USERS (comma-separated)
+def is_admin():
+    if not get_setting("ADMIN_VIEW", False) or not st.user.get("is_logged_in"):
+        return False
+    admins = {email.strip().lower() for email in get_setting("ADMIN_USERS", "").split(",") if email.strip()}
+    return (st.user.get("email") or "").lower() in admins
+
+if st.query_params.get("view") == "admin" and is_admin():
+    render_admin_view()
+    st.stop()
+
+# Initialize Anthropic client
+def initialize_client():
+    api_key = secrets_api_key()
     
     # If no API key found in secrets or secrets file doesn't exist, prompt user
     if api_key is None:
@@ -125,39 +358,245 @@ def initialize_client():
             st.warning("Please enter your Anthropic API key to continue.")
             st.stop()
         
-    return anthropic.Anthropic(api_key=api_key)
+    return client_registry.get(api_key)
 
-# Initialize session state for message history and system prompt
-if "messages" not in st.session_state:
-    st.session_state.messages = []
+# Background workers that generate responses, shared by the whole server process
+@st.cache_resource
+def get_stream_workers():
+    return StreamWorkers(max_workers=get_setting("STREAM_WORKERS", 32))
 
-# Load system prompt from file 
-def load_system_prompt():
-    system_prompt_path = os.path.join(os.path.dirname(__file__), "system_prompt.txt")
-    try:
-        with open(system_prompt_path, "r") as f:
-            system_prompt = f.read().strip()
-        
-        return system_prompt
-    except FileNotFoundError:
-        return "You are a helpful AI assistant that provides clear, concise answers."
+stream_workers = get_stream_workers()
+
+# Hidden first message that asks for the session greeting
+GREETING_PROMPT = "Please introduce yourself according to your system instructions."
+
+# Conversations and uploaded images persisted under .wittly/, shared by all sessions
+@st.cache_resource
+def get_conversation_store():
+    return ConversationStore(hidden_messages=[GREETING_PROMPT])
+
+conversation_store = get_conversation_store()
+
+# Student work samples under .wittly/portfolio/, with text and thumbnails extracted in the background
+PORTFOLIO_TOP_K = get_setting("PORTFOLIO_TOP_K", 4)
+PORTFOLIO_TOKEN_BUDGET = get_setting("PORTFOLIO_TOKEN_BUDGET", 1500)
+
+@st.cache_resource
+def get_portfolio_store():
+    return PortfolioStore()
+
+portfolio_store = get_portfolio_store()
+
+@st.cache_resource
+def get_portfolio_extractor():
+    extractor = PortfolioExtractor(portfolio_store, max_workers=get_setting("PORTFOLIO_WORKERS", 2))
+    # Finish anything a previous server process was still extracting
+    extractor.resume()
+    return extractor
 
-# Get system prompt with current date
-def get_system_prompt_with_date():
-    base_prompt = load_system_prompt()
-    current_date = datetime.now().strftime("%A, %B %d, %Y")
-    return f"{base_prompt}\n\nToday's Date: {current_date}"
+portfolio_extractor = get_portfolio_extractor()
 
-if "system_prompt" not in st.session_state:
-    st.session_state.system_prompt = get_system_prompt_with_date()
+# The student's work samples and the passages from them matching `query`, as an uncached prompt section.
+# Only this session owner's own uploads: anything else would let one visitor's files speak in another's prompts.
+def portfolio_sections(roster_id, query):
+    owner = st.session_state.owner
+    section = portfolio_prompt_section(portfolio_store.samples(owner, roster_id),
+                                       portfolio_store.search(owner, roster_id, query, limit=PORTFOLIO_TOP_K),
+                                       token_budget=PORTFOLIO_TOKEN_BUDGET)
+    return [section] if section else []
+
+# system_prompt.txt, read once per process and shared by all sessions; edits are picked up by mtime
+@st.cache_resource
+def get_prompt_asset():
+    return PromptAsset(check_interval=get_setting("PROMPT_RELOAD_INTERVAL", 2.0))
+
+prompt_asset = get_prompt_asset()
+prompt_asset.refresh()
+
+# Parse the student data in system_prompt.txt into the local store once per prompt version
+@st.cache_resource(max_entries=2)
+def get_student_store(prompt_version):
+    return open_student_store()
+
+student_store = get_student_store(prompt_asset.version)
+
+# Chunk and index the student data sections once per store version (persisted under .wittly/)
+@st.cache_resource(max_entries=2)
+def get_retriever(store_version):
+    return open_retriever({student_id: student_store.prompt_section_rows(student_id)
+                           for student_id in student_store.student_ids()})
+
+# ROI, trend and aim-line analytics for the whole caseload, shared by all sessions and
+# recomputed only when the progress-monitoring scores change
+@st.cache_data(show_spinner=False)
+def caseload_growth(growth_version):
+    return compute_caseload_growth(student_store)
+
+def student_growth(student_id):
+    growth, phases, trend = caseload_growth(scores_version(student_store))
+    return student_rows(growth, student_id), student_rows(phases, student_id), student_rows(trend, student_id)
+
+# "full" sends every data section (cached); "retrieval" sends only the sections relevant to the conversation
+PROMPT_MODE = get_setting("PROMPT_MODE", "full")
+RETRIEVAL_TOP_K = get_setting("RETRIEVAL_TOP_K", 6)
+RETRIEVAL_TOKEN_BUDGET = get_setting("RETRIEVAL_TOKEN_BUDGET", 3000)
+
+# Build the system prompt as cacheable content blocks; the date goes after the cached prefix.
+# Student data comes from the store rather than the raw JSON pasted into the prompt file.
+def get_system_blocks():
+    student_name = st.session_state.get("selected_student")
+    student = student_store.find_student(student_name) if student_name else None
+    work_samples = portfolio_sections(st.session_state.get("selected_roster_id"),
+                                      conversation_query(st.session_state.messages)) if student_name else []
+    if student is None:
+        return no_data_system_blocks(prompt_asset.text, student_name=student_name, context_sections=work_samples)
+    
+    # The computed growth summary goes with the data sections in both modes; it is small and always relevant
+    growth_section = growth_prompt_section(student_growth(student["student_id"])[0])
+    growth_sections = [growth_section] if growth_section else []
+    
+    if PROMPT_MODE == "retrieval":
+        query = conversation_query(st.session_state.messages)
+        data_sections = get_retriever(student_store.version()).select_sections(
+            student["student_id"], query, top_k=RETRIEVAL_TOP_K, token_budget=RETRIEVAL_TOKEN_BUDGET)
+        st.session_state.last_retrieval = {
+            "sections": len(data_sections),
+            "tokens": sum(estimate_tokens(body) for _, body in data_sections),
+        }
+        return build_system_blocks(prompt_asset.text,
+                                   student_name=student_name,
+                                   data_sections=data_sections + growth_sections,
+                                   cache_data=False,
+                                   context_sections=work_samples)
+    
+    return student_system_blocks(student_name, student, growth_sections, work_samples)
+
+# Full-mode system blocks for any student (not just the selected one), as used by batch reports.
+# Every student's blocks start with the same guidance block, so they share its cache entry.
+def student_system_blocks(student_name, student=None, growth_sections=None, work_samples=None):
+    student = student or student_store.find_student(student_name)
+    if student is None:
+        return no_data_system_blocks(prompt_asset.text, student_name=student_name, context_sections=work_samples)
+    if growth_sections is None:
+        growth_section = growth_prompt_section(student_growth(student["student_id"])[0])
+        growth_sections = [growth_section] if growth_section else []
+    return build_system_blocks(prompt_asset.text,
+                               student_name=student_name,
+                               data_sections=student_store.prompt_sections(student["student_id"]) + growth_sections,
+                               context_sections=work_samples)
 
 if "client" not in st.session_state:
     st.session_state.client = initialize_client()
+else:
+    # The registry may have replaced (and will close) an evicted client for this key
+    st.session_state.client = client_registry.get(st.session_state.client.api_key)
 
-# Create a three-column layout: student list, chat, and data
-student_list_col, chat_col, data_col = st.columns([0.15, 0.45, 0.40])  # Students, chat, data
+# Who the conversations and work samples created in this session belong to: the signed-in user when
+# Streamlit authentication is configured ([auth] in secrets), otherwise an owner token kept in the URL
+# next to the session id, together with the fingerprint of the API key in use. Without sign-in a copied
+# URL carries access with it, but nobody else's conversations are listed or opened.
+def session_owner():
+    if st.user.get("is_logged_in"):
+        identity = f"user:{st.user.get('email') or st.user.get('sub')}"
+    else:
+        token = st.query_params.get("owner")
+        if not token:
+            token = uuid.uuid4().hex
+            st.query_params["owner"] = token
+        identity = f"browser:{token}:{key_fingerprint(st.session_state.client.api_key)}"
+    return hashlib.sha256(identity.encode("utf-8")).hexdigest()[:16]
+
+if "owner" not in st.session_state:
+    st.session_state.owner = session_owner()
+
+# A conversation still in the workers' memory carries its owner; otherwise the store has it
+def owns_conversation(session_id):
+    if stream_workers.has_session(session_id):
+        messages = stream_workers.session(session_id)["messages"]
+        if isinstance(messages, ConversationMessages):
+            return messages.owner == st.session_state.owner
+    return conversation_store.owner(session_id) == st.session_state.owner
+
+# The session id is kept in the URL and doubles as the conversation id, so a refreshed page picks its
+# conversation (and any response still being generated) back up from the workers' session state, and
+# from the conversation store once the workers have forgotten it (e.g. after a server restart)
+if "session_id" not in st.session_state:
+    session_id = st.query_params.get("session")
+    if session_id and owns_conversation(session_id):
+        st.session_state.conversation_started = True
+    else:
+        session_id = uuid.uuid4().hex
+        st.query_params["session"] = session_id
+    st.session_state.session_id = session_id
+
+# Token budget for everything sent per turn (system prompt + conversation history)
+INPUT_TOKEN_BUDGET = get_setting("INPUT_TOKEN_BUDGET", 60000)
+
+worker_session = stream_workers.session(st.session_state.session_id)
+if not isinstance(worker_session["messages"], ConversationMessages):
+    # Only the messages that could still be sent are loaded; older ones are read back from the store when
+    # the chat scrolls back to them, and images stay in the blob store
+    worker_session["messages"] = open_conversation(conversation_store, st.session_state.session_id,
+                                                   owner=st.session_state.owner, token_budget=INPUT_TOKEN_BUDGET)
+
+# Initialize session state for message history and system prompt
+if "messages" not in st.session_state:
+    st.session_state.messages = worker_session["messages"]
+
+if "history_manager" not in st.session_state:
+    if "history_manager" not in worker_session:
+        worker_session["history_manager"] = HistoryManager(
+            token_budget=INPUT_TOKEN_BUDGET,
+            keep_recent=get_setting("HISTORY_KEEP_RECENT", 6),
+            summary_model=get_setting("SUMMARY_MODEL", "claude-3-5-haiku-20241022"),
+        )
+    st.session_state.history_manager = worker_session["history_manager"]
+
+MAX_OUTPUT_TOKENS = 4000
+
+# A turn is deterministic when every user message so far is app-generated, so the same system prompt,
+# model and day always produce an equivalent answer
+def is_deterministic_turn(messages):
+    return all(message["role"] != "user" or message["content"] == GREETING_PROMPT for message in messages)
+
+RESPONSE_CACHE_ENABLED = get_setting("RESPONSE_CACHE", True)
+
+@st.cache_resource
+def get_response_cache():
+    return ResponseCache(ttl_seconds=get_setting("RESPONSE_CACHE_TTL", 86400),
+                         max_entries=get_setting("RESPONSE_CACHE_MAX_ENTRIES", 500))
 
-# Add additional CSS to make tabs fit better
+response_cache = get_response_cache()
+
+# Session defaults shared by the fragments below
+if "selected_model" not in st.session_state:
+    st.session_state.selected_model = "claude-3-7-sonnet-20250219"
+
+# Display current student list with Michael selected
+if "selected_student" not in st.session_state:
+    st.session_state.selected_student = "Michael Faraday"
+
+# New messages are indexed under the student being discussed
+st.session_state.messages.student = st.session_state.selected_student
+
+# Add a state for tracking if we're currently streaming a response
+# (true from the moment a message is sent until its response has finished)
+if "is_streaming" not in st.session_state:
+    resumed_job = stream_workers.active_job(st.session_state.session_id)
+    st.session_state.is_streaming = resumed_job is not None
+    # Id of the background job answering the current turn (None until it is started)
+    st.session_state.response_job = resumed_job.job_id if resumed_job else None
+
+# Initialize the input state
+if "current_input" not in st.session_state:
+    st.session_state.current_input = ""
+
+if "run_timings" not in st.session_state:
+    st.session_state.run_timings = {}
+
+profiler.step("page styles")
+
+# All page styles in one injection; it runs on full-page runs only and fragment reruns leave it in place
 st.markdown("""
 <style>
     /* Make tab container take full width */
@@ -166,7 +605,7 @@ st.markdown("""
         display: flex;
         justify-content: space-between;
     }
-    
+
     /* Make tabs take equal width */
     .stTabs [data-baseweb="tab"] {
         flex-grow: 1;
@@ -176,362 +615,1129 @@ st.markdown("""
         text-overflow: ellipsis;
         white-space: nowrap;
     }
+
+    /* Ensure Add New Student button stays black */
+    [data-testid="stButton"] button {
+        background-color: #333333 !important;
+        color: white !important;
+    }
+
+    /* Hide the default sidebar */
+    [data-testid="stSidebar"] {
+        display: none;
+    }
+
+    /* Fixed-position container at the bottom but only for the chat column */
+    .fixed-bottom {
+        position: fixed;
+        bottom: 0;
+        left: 15%;  /* Adjust for student list column */
+        width: 45%;  /* Match the chat column width */
+        background-color: #f5f5f5;
+        padding: 0;
+        z-index: 999;
+        display: flex;
+        border-top: 1px solid #ddd;
+    }
+
+    .input-container {
+        display: flex;
+        align-items: flex-end;
+        margin-bottom: 20px;
+    }
+    .input-box {
+        flex-grow: 1;
+        width: 100%;
+    }
+    /* Remove default label space */
+    .input-box label {
+        display: none !important;
+    }
+    /* Style the text area */
+    .stTextArea textarea {
+        resize: vertical;
+        min-height: 60px;
+        border-radius: 10px;
+    }
+    /* Style the form submit button - black and white theme */
+    .stForm [data-testid="stFormSubmitButton"] button {
+        border-radius: 4px;
+        background-color: #333333 !important;
+        color: white !important;
+        border: none;
+        transition: background-color 0.3s ease;
+    }
+
+    /* Hover state for the button */
+    .stForm [data-testid="stFormSubmitButton"] button:hover {
+        background-color: #000000 !important;
+    }
+
+    /* Style the file uploader */
+    [data-testid="stFileUploader"] {
+        margin-top: 5px;
+    }
+
+    /* Make the file uploader more compact */
+    [data-testid="stFileUploader"] > div:first-child {
+        padding: 0.5rem !important;
+    }
+
+    /* Style the upload button */
+    [data-testid="stFileUploader"] button {
+        background-color: #f0f0f0 !important;
+        color: #333333 !important;
+        border-radius: 4px;
+        padding: 0.2rem 0.5rem !important;
+        font-size: 0.8rem !important;
+    }
+
+    /* Image display in chat */
+    .stImage img {
+        border-radius: 8px;
+        max-height: 300px;
+        margin: 10px 0;
+    }
+
+    /* Style the tabs in the data column */
+    .stTabs [data-baseweb="tab-list"] {
+        gap: 2px;
+    }
+    .stTabs [data-baseweb="tab"] {
+        height: 32px;
+        border-radius: 5px 5px 0 0;
+        padding: 5px 10px;
+        background-color: #f5f5f5;
+        font-size: 0.85rem;
+    }
+    .stTabs [aria-selected="true"] {
+        background-color: white;
+        border-top: 2px solid #333333;
+    }
+
+    /* Style student list */
+    [data-testid="stVerticalBlock"] > div:nth-child(1) [data-testid="stMarkdownContainer"] h2 {
+        margin-top: 0;
+        padding-top: 0;
+        font-size: 1.3rem;
+    }
 </style>
 """, unsafe_allow_html=True)
 
-# Chat column content
-with chat_col:
-    # Model selection
-    if "selected_model" not in st.session_state:
-        st.session_state.selected_model = "claude-3-7-sonnet-20250219"
-
-    # Create columns for header and model selection
-    header_col, dropdown_col = st.columns([3, 1])
+# Shared by all sessions, so a worksheet photo uploaded by several teachers is processed once
+@st.cache_resource
+def get_image_pipeline():
+    return ImagePipeline(max_long_edge=get_setting("IMAGE_MAX_LONG_EDGE", 1568),
+                         jpeg_quality=get_setting("IMAGE_JPEG_QUALITY", 85),
+                         disk_bytes=get_setting("IMAGE_CACHE_MB", 200) * 1024 * 1024)
 
-    with header_col:
-        # App header with smaller font sizes
-        st.markdown("""
-            
-        """, unsafe_allow_html=True)
+image_pipeline = get_image_pipeline()
 
-    with dropdown_col:
-        st.session_state.selected_model = st.selectbox(
-            "Model",
-            ["claude-3-7-sonnet-20250219", "claude-3-5-sonnet-20241022", "claude-3-opus-20240229"],
-            format_func=lambda x: "Claude 3.7 Sonnet" if x == "claude-3-7-sonnet-20250219" 
-                        else "Claude 3.5 Sonnet" if x == "claude-3-5-sonnet-20241022"
-                        else "Claude 3 Opus",
-            label_visibility="collapsed"
-        )
-    
-# Student list column
-with student_list_col:
-    st.markdown("## My Students")
-    
-    # Add New Student button (with custom styling to ensure it remains black)
-    st.markdown("""
-        <style>
-        /* Ensure Add New Student button stays black */
-        [data-testid="stButton"] button {
-            background-color: #333333 !important;
-            color: white !important;
-        }
-        </style>
-    """, unsafe_allow_html=True)
-    st.button("+ Add New Student", use_container_width=True)
-    
-    st.markdown("---")
-    
-    # Display current student list with Michael selected
-    if "selected_student" not in st.session_state:
-        st.session_state.selected_student = "Michael Faraday"
-    
-    # Define student list with their status (alphabetical)
-    students = [
-        {"name": "Aiden Patel", "grade": "4th", "selected": False},
-        {"name": "Charlotte Brown", "grade": "3rd", "selected": False},
-        {"name": "Emma Chen", "grade": "5th", "selected": False},
-        {"name": "Isabella Garcia", "grade": "3rd", "selected": False},
-        {"name": "Lucas Nguyen", "grade": "4th", "selected": False},
-        {"name": "Michael Faraday", "grade": "5th", "selected": True},
-        {"name": "Noah Kim", "grade": "3rd", "selected": False},
-        {"name": "Olivia Washington", "grade": "5th", "selected": False}
-    ]
+# Function to handle the conversation 
+def handle_send():
+    user_input = st.session_state.current_input
+    has_image = False
     
-    # Create student list buttons with selected state styling
-    st.markdown("""
-        <style>
-        .student-selected {
-            background-color: #f0f0f0;
-            padding: 10px;
-            border-radius: 5px;
-            border-left: 5px solid #333333;
-            margin-bottom: 8px;
-            font-weight: bold;
-        }
-        .student-unselected {
-            background-color: white;
-            padding: 10px;
-            border-radius: 5px;
-            border-left: 5px solid transparent;
-            margin-bottom: 8px;
-            font-weight: normal;
-        }
-        </style>
-    """, unsafe_allow_html=True)
+    # Check if there's an uploaded image in session state
+    if "uploaded_image" in st.session_state and st.session_state.uploaded_image is not None:
+        has_image = True
     
-    # Create a styled button for each student
-    for student in students:
-        is_selected = st.session_state.selected_student == student["name"]
-        student_class = "student-selected" if is_selected else "student-unselected"
+    if user_input or has_image:  # Process if there's text input or an image
+        # Set streaming flag
+        st.session_state.is_streaming = True
+        # Clear input
+        st.session_state.current_input = ""
         
-        st.markdown(f"""
-        <div class="{student_class}">
-            {student["name"]}<br>
-            <small style="color: #666;">{student["grade"]} Grade</small>
-        </div>
-        """, unsafe_allow_html=True)
+        # Create message content
+        if has_image:
+            # For messages with images, we need to create a message with both text and image.
+            # The upload is downscaled/re-encoded once; repeat uploads reuse the cached result and its data.
+            # The message only references the stored image; its data is read back when it is sent to the API.
+            image = st.session_state.uploaded_image
+            processed = image_pipeline.process(image.getvalue(), image.type)
+            st.session_state.last_image_report = format_image_report(processed)
+            logger.info("Image upload: %s", st.session_state.last_image_report)
+            
+            # Create content blocks for the message (text and image)
+            message_content = [
+                {
+                    "type": "text",
+                    "text": user_input if user_input else "What do you see in this image?"
+                },
+                conversation_store.image_block(processed["media_type"], processed["data"])
+            ]
+            
+            # Add the message with image to history
+            st.session_state.messages.append({"role": "user", "content": message_content})
+            
+            # Clear the uploaded image from session state
+            st.session_state.uploaded_image = None
+        else:
+            # For text-only messages, add as before
+            st.session_state.messages.append({"role": "user", "content": user_input})
+
+# Send button callback: runs before the chat fragment reruns, so the new message is already in the
+# history when it is drawn and no extra rerun is needed
+def handle_submit():
+    if st.session_state.is_streaming:
+        return
+    st.session_state.current_input = st.session_state.user_input_field
     
-# Add data column with tabs
-with data_col:
-    # Create tabs for different data sections
-    tabs = st.tabs(["Details", "Screener", "Progress", "Observations", "Portfolio"])
+    # Handle uploaded image
+    if st.session_state.get("chat_image_upload") is not None:
+        # Save uploaded image to memory
+        st.session_state.uploaded_image = st.session_state.chat_image_upload
     
-    # Student Details tab
-    with tabs[0]:
-        st.markdown("### Student Information")
-        st.markdown("""
-        **Name:** Michael Faraday  
-        **Grade:** 5th Grade  
-        **Age:** 10  
-        **DOB:** 2013-11-02  
-        **Teacher:** Jerry Henley  
-        """)
-        
-        st.markdown("### Demographic Information")
-        demo_data = {
-            "Gender": "Male",
-            "Special Education": "Yes",
-            "English Language Learner": "No",
-            "Economically Disadvantaged": "Yes"
-        }
-        st.table(demo_data)
+    handle_send()
+
+# Generate one response on a worker thread. Runs outside the script run, so it takes everything it
+# needs as arguments and must not touch st.* or session state; the UI follows it through `job`.
+def generate_response(job, client, system_blocks, api_messages, input_estimate, messages, cache_key, route=None):
+    usage = job.usage
+    job.route = route
+    thinking_budget = route["thinking_budget"] if route else 1024
+    max_tokens = route["max_tokens"] if route else MAX_OUTPUT_TOKENS
+    fallback_from = None
+    # Timings for the request log: admission by the scheduler, then first streamed token
+    ticket = None
+    admitted = None
+    first_token = None
+    error_class = None
+    try:
+        if job.cancelled:
+            raise StreamCancelled()
         
-    # Academic Screener tab
-    with tabs[1]:
-        st.markdown("### Classworks Universal Academic Assessment")
+        # Every session's calls go through the shared scheduler: wait for a slot in this model's
+        # request/token budgets, and on a 429/529 back off and retry instead of failing
+        ticket = rate_scheduler.ticket(job.session_id, job.model,
+                                       input_tokens=input_estimate, output_tokens=max_tokens)
+        while True:
+            job.admit(rate_scheduler, ticket)
+            admitted = time.time()
+            job.status = "streaming"
+            fallback = None
+            try:
+                # Make a streaming request
+                # The scheduler owns retries for chat turns, so the SDK's own retry loop is turned off
+                options = {"thinking": {"type": "enabled", "budget_tokens": thinking_budget}} if thinking_budget else {}
+                with client.with_options(max_retries=0).messages.stream(
+                    model=job.model,
+                    max_tokens=max_tokens,
+                    system=system_blocks,
+                    messages=api_messages,
+                    **options
+                ) as stream:
+                    # Lets the Stop button close the HTTP stream from the UI thread
+                    job.attach_stream(stream.close)
+                    try:
+                        for chunk in stream:
+                            if job.cancelled:
+                                break
+                            usage_from_event(chunk, usage)
+                            if chunk.type == "content_block_delta" and first_token is None:
+                                # Thinking deltas count: the model has started generating
+                                first_token = time.time()
+                            if chunk.type == "content_block_delta" and hasattr(chunk.delta, "text"):
+                                job.append(chunk.delta.text)
+                            # Thinking deltas are not shown
+                    finally:
+                        job.detach_stream()
+                break
+            except Exception as e:
+                # Reading from a stream closed by Stop fails; that is the expected way out
+                if job.cancelled:
+                    break
+                if not isinstance(e, anthropic.APIStatusError):
+                    raise
+                # In routing mode an overloaded model hands the turn to the next model its policy allows
+                if route and e.status_code == 529 and not job.text:
+                    fallback = model_router.fallback(route)
+                if fallback is None:
+                    # Retry only if nothing has been shown yet
+                    if job.text or not rate_scheduler.can_retry(ticket, e):
+                        raise
+                    delay = rate_scheduler.backoff(ticket, e)
+                    logger.info("Rate limited (%s), retrying in %.1fs", e.status_code, delay)
+            finally:
+                if job.cancelled:
+                    # The final usage event never arrives for a stopped stream; estimate what was generated
+                    usage["output_tokens"] = max(usage.get("output_tokens", 0), estimate_tokens(job.text))
+                rate_scheduler.release(ticket,
+                                       input_tokens=usage.get("input_tokens", 0) + usage.get("cache_creation_input_tokens", 0),
+                                       output_tokens=usage.get("output_tokens", 0))
+            if fallback is not None:
+                logger.info("%s overloaded, falling back to %s", job.model, fallback["model"])
+                fallback_from = fallback_from or job.model
+                route = job.route = fallback
+                job.model = route["model"]
+                thinking_budget = route["thinking_budget"]
+                max_tokens = route["max_tokens"]
+                ticket = rate_scheduler.ticket(job.session_id, job.model,
+                                               input_tokens=input_estimate, output_tokens=max_tokens)
         
-        # Reading section
-        st.markdown("## Reading Assessment")
+        full_response = job.text
+        if job.cancelled:
+            raise StreamCancelled()
+        if cache_key and usage.get("stop_reason") == "end_turn" and full_response:
+            response_cache.put(cache_key, job.model, full_response, usage)
+        logger.info("Prompt cache usage (%s): %s", job.model, usage)
         
-        # Fall Reading
-        st.markdown("### Fall Reading Assessment (September 2023)")
-        st.markdown("**Overall Reading: Score 270, Percentile 2, Grade Level Equivalent: 2nd**")
-        fall_reading_data = {
-            "Domain": ["Word Analysis", "Reading", "Grammar/Usage/Mechanics"],
-            "Score": [200, 290, 320],
-            "Grade Level Equivalent": ["K", "2nd", "2nd"]
-        }
-        st.dataframe(fall_reading_data)
-        
-        # Winter Reading
-        st.markdown("### Winter Reading Assessment (December 2023)")
-        st.markdown("**Overall Reading: Score 370, Percentile 24, Grade Level Equivalent: 4th**")
-        winter_reading_data = {
-            "Domain": ["Word Analysis", "Reading", "Grammar/Usage/Mechanics"],
-            "Score": [430, 330, 400],
-            "Grade Level Equivalent": ["5th", "3rd", "4th"]
-        }
-        st.dataframe(winter_reading_data)
+        # Add the full response to history
+        messages.append({"role": "assistant", "content": full_response})
+        job.finish()
+    except StreamCancelled:
+        # Keep what was generated, marked as cut off; the history needs an assistant turn either way
+        usage["stopped"] = True
+        usage["tokens_saved"] = max(0, max_tokens - usage.get("output_tokens", 0))
+        logger.info("Response stopped (%s): ~%d output tokens generated, up to %d saved",
+                    job.model, usage.get("output_tokens", 0), usage["tokens_saved"])
+        messages.append({"role": "assistant", "content": (job.text + TRUNCATION_MARKER).lstrip()})
+        job.finish()
+    except anthropic.RateLimitError as e:
+        error_class = type(e).__name__
+        # Only reached once the scheduler's retries are used up
+        messages.append({
+            "role": "assistant", 
+            "content": "I'm sorry, the API rate limit has been exceeded. Please wait a minute before sending another message."
+        })
+        job.finish(error="Rate limit exceeded. Please wait a minute before trying again.")
+    except Exception as e:
+        error_class = type(e).__name__
+        messages.append({
+            "role": "assistant", 
+            "content": f"I'm sorry, an error occurred: {str(e)}"
+        })
+        job.finish(error=f"An error occurred: {str(e)}")
+    finally:
+        prewarmer.note_request_finished(client, job.model, system_blocks, usage)
+        if route and job.status == "done" and admitted:
+            # Latency the router learns from: admission to the end of a complete answer
+            model_router.observe(route["route"], job.model, job.finished - admitted)
+        log_request(job.session_id, job.model, usage, job.created, job.finished,
+                    thinking_budget=thinking_budget, admitted=admitted, first_token=first_token,
+                    retries=ticket.attempts if ticket else 0, error_class=error_class, max_tokens=max_tokens,
+                    route=route["route"] if route else None, fallback_from=fallback_from)
+
+# Append one record to the request log. Times are time.time() values: queue wait runs from the turn
+# being submitted to the scheduler admitting the request that streamed, TTFT from then to the first delta.
+def log_request(session_id, model, usage, created, finished, thinking_budget=None, admitted=None,
+                first_token=None, retries=0, error_class=None, cached_response=False, max_tokens=MAX_OUTPUT_TOKENS,
+                route=None, fallback_from=None):
+    finished = finished or time.time()
+    # Cache replays never reach the API, so they don't count towards the cold-start requests
+    phase = None if cached_response else warm_up.request_phase()
+    streamed_seconds = finished - first_token if first_token else None
+    request_log.write({
+        "ts": utc_now(),
+        "session_id": session_id,
+        "model": model,
+        "thinking_budget": thinking_budget,
+        "max_tokens": max_tokens,
+        "queue_wait_s": round(admitted - created, 4) if admitted else None,
+        "ttft_s": round(first_token - admitted, 4) if first_token and admitted else None,
+        "duration_s": round(finished - created, 4),
+        "input_tokens": usage.get("input_tokens", 0),
+        "output_tokens": usage.get("output_tokens", 0),
+        "cache_read_input_tokens": usage.get("cache_read_input_tokens", 0),
+        "cache_creation_input_tokens": usage.get("cache_creation_input_tokens", 0),
+        "output_tokens_per_s": round(usage.get("output_tokens", 0) / streamed_seconds, 2)
+                               if streamed_seconds else None,
+        "stop_reason": usage.get("stop_reason"),
+        "stopped": usage.get("stopped", False),
+        "tokens_saved": usage.get("tokens_saved"),
+        "retries": retries,
+        "cached_response": cached_response,
+        "error_class": error_class,
+        "phase": phase,
+        # Routing mode only: the kind of turn, and the overloaded model it fell back from
+        "route": route,
+        "fallback_from": fallback_from,
+    })
+
+# Start the response to the latest message: replay it from the response cache if possible,
+# otherwise hand it to a background worker and return right away
+def start_response():
+    try:
+        # Stable guidance and student data are cached; date is appended uncached
+        system_blocks = get_system_blocks()
         
-        # Math section
-        st.markdown("## Mathematics Assessment")
+        # Prepare messages for the API call, trimmed/summarized to fit the context budget
+        system_tokens = sum(estimate_tokens(block["text"]) for block in system_blocks)
+        api_messages = st.session_state.history_manager.build_messages(
+            st.session_state.messages, system_tokens=system_tokens, client=st.session_state.client,
+            earlier=st.session_state.messages.earlier)
+        api_messages = conversation_store.resolve_images(api_messages)
         
-        # Fall Math
-        st.markdown("### Fall Mathematics Assessment (September 2023)")
-        st.markdown("**Overall Mathematics: Score 380, Percentile 24, Grade Level Equivalent: 4th**")
-        fall_math_data = {
-            "Domain": ["Geometry", "Algebra", "Measurement", "Mathematical Processes", "Statistics and Probability"],
-            "Score": [390, 370, 370, 370, 390],
-            "Grade Level Equivalent": ["4th", "4th", "4th", "4th", "4th"]
-        }
-        st.dataframe(fall_math_data)
+        # In routing mode the model, thinking budget and output cap depend on the kind of turn
+        route = None
+        model = st.session_state.selected_model
+        if model == AUTO_MODEL:
+            route = model_router.route("greeting" if is_deterministic_turn(st.session_state.messages)
+                                       else classify_turn(st.session_state.messages[-1]))
+            model = route["model"]
+        st.session_state.last_route = route
         
-        # Winter Math
-        st.markdown("### Winter Mathematics Assessment (December 2023)")
-        st.markdown("**Overall Mathematics: Score 370, Percentile 16, Grade Level Equivalent: 4th**")
-        winter_math_data = {
-            "Domain": ["Mathematical Processes", "Measurement", "Statistics and Probability", "Algebra", "Geometry"],
-            "Score": [200, 400, 200, 360, 400],
-            "Grade Level Equivalent": ["K", "4th", "K", "3rd", "4th"]
-        }
-        st.dataframe(winter_math_data)
+        # Deterministic turns (the greeting) are answered from the response cache when possible
+        cache_key = None
+        cached = None
+        if RESPONSE_CACHE_ENABLED and is_deterministic_turn(st.session_state.messages):
+            cache_key = response_key(model, system_blocks, api_messages)
+            cached = response_cache.get(cache_key)
+        st.session_state.last_response_cached = cached is not None
         
-        st.markdown("### Instructional Recommendations")
-        st.markdown("""
-        - **Reading**: Tier 2 intervention needed; focus on reading comprehension strategies
-        - **Mathematical Processes**: Tier 3 intervention needed; significant focus required
-        - **Statistics and Probability**: Tier 3 intervention needed; targeted support required
-        - **Algebra**: Tier 2 intervention needed; focus on algebraic concepts
-        - **Grammar/Usage/Mechanics**: Continue Tier 2 intervention with current strategies
-        """)
+        if cached is None:
+            # Bind everything from session state here; the worker thread can't read it
+            client = st.session_state.client
+            messages = st.session_state.messages
+            input_estimate = system_tokens + st.session_state.history_manager.last_usage["history"]
+            prewarmer.note_request_started(client, model, system_blocks)
+            job = stream_workers.submit(
+                st.session_state.session_id, model,
+                lambda job: generate_response(job, client, system_blocks, api_messages,
+                                              input_estimate, messages, cache_key, route))
+            st.session_state.response_job = job.job_id
+            return
         
-    # Progress Monitoring tab
-    with tabs[2]:
-        st.markdown("## Grade 1 Mathematics - Mathematical Processes")
+        # Replay through the renderer so a cache hit looks like any other response, just instant
+        replay_started = time.time()
+        with st.chat_message("assistant", avatar="🤖"):
+            renderer = StreamRenderer(st.container())
+        for start in range(0, len(cached["text"]), 64):
+            renderer.add(cached["text"][start:start + 64])
+        st.session_state.last_render_stats = renderer.finish()
+        st.session_state.last_usage = {}
+        st.session_state.messages.append({"role": "assistant", "content": cached["text"]})
+        # Logged with zero tokens: nothing was sent to the API
+        log_request(st.session_state.session_id, model,
+                    {"stop_reason": cached["usage"].get("stop_reason")}, replay_started, time.time(),
+                    cached_response=True, route=route["route"] if route else None)
+    except Exception as e:
+        st.error(f"An error occurred: {str(e)}")
+        st.session_state.messages.append({
+            "role": "assistant", 
+            "content": f"I'm sorry, an error occurred: {str(e)}"
+        })
+    st.session_state.is_streaming = False
+
+# The background job for this turn has finished: its message is already in the history
+def finish_response(job):
+    st.session_state.is_streaming = False
+    st.session_state.response_job = None
+    st.session_state.last_usage = job.usage
+    st.session_state.last_stream_error = job.error
+    # The model may have changed on an overload fallback
+    st.session_state.last_route = job.route
+
+STREAM_POLL_INTERVAL = get_setting("STREAM_POLL_INTERVAL", 0.25)
+
+# Shows the response being generated in the background, redrawing on a timer instead of holding the
+# script thread. Only called while a response is in progress; when it finishes, the page reruns once
+# so the response moves into the history (and this fragment's timer stops). Finished markdown blocks are
+# appended to `blocks`, which lives outside the fragment and keeps them across its reruns, so each poll
+# only sends the blocks finished since the last one plus the unfinished last block.
+@st.fragment(run_every=STREAM_POLL_INTERVAL)
+@profiled("live response")
+def live_response_fragment(blocks):
+    job = worker_session["job"]
+    if job is None or job.job_id != st.session_state.response_job:
+        return
+    if job.done:
+        finish_response(job)
+        st.rerun()
+
+    if job.status in ("queued", "waiting") and job.wait:
+        position, seconds = job.wait
+        st.info(f"Wittly is busy right now. You're #{position} in line; about {seconds:.0f}s to go.")
+    elif not job.text:
+        st.markdown("_Thinking…_")
+    else:
+        renderer = StreamRenderer(blocks, tail=st.empty(), committed=st.session_state.live_committed)
+        renderer.add(job.text)
+        renderer.flush()
+        st.session_state.live_committed = renderer.committed
+        stats = renderer.stats
+        totals = st.session_state.setdefault("live_render_stats", {})
+        if totals.get("job_id") != job.job_id:
+            totals.clear()
+            totals.update({"job_id": job.job_id, "frames": 0, "bytes_sent": 0, "render_seconds": 0.0})
+        for name in ("frames", "bytes_sent", "render_seconds"):
+            totals[name] += stats[name]
+        totals["chars"] = stats["chars"]
+        st.session_state.last_render_stats = totals
+
+# Function to handle enter key press (no longer used)
+def handle_key_press():
+    if not st.session_state.is_streaming and st.session_state.current_input:
+        handle_send()
+
+# Per-teacher roster, persisted under .wittly/ and seeded with the demo caseload on first run
+@st.cache_resource
+def get_roster():
+    roster = Roster()
+    roster.seed(TEACHER_NAME)
+    # Work samples filed by student name before they were filed by roster_id go to the student with that name,
+    # where only one student has it
+    students = roster.teacher_students(TEACHER_NAME)
+    names = Counter(student["full_name"] for student in students)
+    portfolio_store.adopt_named_samples({student["full_name"]: student["roster_id"] for student in students
+                                         if names[student["full_name"]] == 1})
+    return roster
+
+roster = get_roster()
+
+ROSTER_PAGE_SIZE = get_setting("ROSTER_PAGE_SIZE", 25)
+ROSTER_TIERS = [1, 2, 3]
+YES_NO = {"Any": None, "Yes": True, "No": False}
+
+# Search index over a teacher's whole roster, shared by all sessions until the roster changes
+@st.cache_resource(max_entries=50, show_spinner=False)
+def roster_index(teacher, roster_version):
+    return RosterIndex(roster.teacher_students(teacher))
+
+@st.cache_data(max_entries=500, show_spinner=False)
+def roster_page(teacher, roster_version, query, grades, special_education, english_language_learner, tiers, page):
+    return roster_index(teacher, roster_version).page(
+        query, grades=grades, special_education=special_education,
+        english_language_learner=english_language_learner, tiers=tiers,
+        page=page, page_size=ROSTER_PAGE_SIZE)
+
+# The roster row everything per-student is keyed on. Until one is picked, the first row with the selected
+# student's name stands for it.
+if st.session_state.get("selected_roster_id") is None:
+    st.session_state.selected_roster_id = next(
+        (student["roster_id"] for student in roster_index(TEACHER_NAME, roster.version(TEACHER_NAME)).students
+         if student["full_name"] == st.session_state.selected_student), None)
+
+def reset_roster_page():
+    st.session_state.roster_page = 0
+
+def change_roster_page(step):
+    st.session_state.roster_page += step
+
+def handle_add_student():
+    first_name = st.session_state.new_student_first.strip()
+    last_name = st.session_state.new_student_last.strip()
+    if not first_name or not last_name:
+        return
+    roster.add_students(TEACHER_NAME, [{
+        "first_name": first_name,
+        "last_name": last_name,
+        "grade": st.session_state.new_student_grade,
+        "special_education": st.session_state.new_student_sped,
+        "english_language_learner": st.session_state.new_student_ell,
+        "tier": st.session_state.new_student_tier,
+    }])
+
+# Student list column
+@st.fragment
+@profiled("student list")
+def student_list_fragment():
+    profiler.step("add student form")
+    st.markdown("## My Students")
+
+    with st.popover("+ Add New Student", use_container_width=True):
+        with st.form("add_student_form", clear_on_submit=True, border=False):
+            st.text_input("First name", key="new_student_first")
+            st.text_input("Last name", key="new_student_last")
+            st.selectbox("Grade", list(range(0, 13)), index=3, key="new_student_grade",
+                         format_func=lambda grade: "K" if grade == 0 else ordinal_grade(grade))
+            st.selectbox("Tier", [None] + ROSTER_TIERS, key="new_student_tier",
+                         format_func=lambda tier: "Not set" if tier is None else f"Tier {tier}")
+            st.checkbox("Special education", key="new_student_sped")
+            st.checkbox("English language learner", key="new_student_ell")
+            st.form_submit_button("Add", on_click=handle_add_student)
+
+    profiler.step("search and filters")
+    if "roster_page" not in st.session_state:
+        st.session_state.roster_page = 0
+
+    query = st.text_input("Search students", key="roster_query", placeholder="Search students",
+                          label_visibility="collapsed", on_change=reset_roster_page)
+    with st.expander("Filters"):
+        grades = st.multiselect("Grade", list(range(0, 13)), key="roster_grades", on_change=reset_roster_page,
+                                format_func=lambda grade: "K" if grade == 0 else ordinal_grade(grade))
+        sped = st.selectbox("Special education", list(YES_NO), key="roster_sped", on_change=reset_roster_page)
+        ell = st.selectbox("English language learner", list(YES_NO), key="roster_ell", on_change=reset_roster_page)
+        tiers = st.multiselect("Tier", ROSTER_TIERS, key="roster_tiers", on_change=reset_roster_page,
+                               format_func=lambda tier: f"Tier {tier}")
+
+    st.markdown("---")
+
+    profiler.step("roster page")
+    students, total = roster_page(TEACHER_NAME, roster.version(TEACHER_NAME), query,
+                                  tuple(grades), YES_NO[sped], YES_NO[ell], tuple(tiers),
+                                  st.session_state.roster_page)
+    if not students:
+        st.caption("No students match.")
+        return
+
+    # One radio for the whole page rather than an element per student. Options are roster ids, so two
+    # students with the same name are still separate rows.
+    students_by_id = {student["roster_id"]: student for student in students}
+    roster_ids = list(students_by_id)
+    selected_id = st.session_state.selected_roster_id
+    selected = st.radio(
+        "Students", roster_ids,
+        index=roster_ids.index(selected_id) if selected_id in students_by_id else None,
+        format_func=lambda roster_id: (f"{students_by_id[roster_id]['full_name']} · "
+                                       f"{'K' if students_by_id[roster_id]['grade'] == 0 else ordinal_grade(students_by_id[roster_id]['grade'])}"),
+        label_visibility="collapsed", key=f"roster_select_{st.session_state.roster_page}")
+    if selected is not None and selected != selected_id:
+        # The chat and data panel depend on the selected student, so rerun the whole page
+        st.session_state.selected_roster_id = selected
+        st.session_state.selected_student = students_by_id[selected]["full_name"]
+        st.rerun()
+
+    first = st.session_state.roster_page * ROSTER_PAGE_SIZE
+    st.caption(f"{first + 1}–{first + len(students)} of {total}")
+    if total > ROSTER_PAGE_SIZE:
+        previous_col, next_col = st.columns(2)
+        previous_col.button("‹", key="roster_previous", disabled=first == 0, use_container_width=True,
+                            on_click=change_roster_page, args=(-1,))
+        next_col.button("›", key="roster_next", disabled=first + ROSTER_PAGE_SIZE >= total,
+                        use_container_width=True, on_click=change_roster_page, args=(1,))
+
+# Batch reports: the same artifact for every student matching the roster search and filters, generated
+# in the background. "pool" sends one request per student over BATCH_WORKERS workers; "batches" submits
+# them all to the Message Batches API (half price, results usually within the hour).
+BATCH_MODE = get_setting("BATCH_MODE", "pool")
+BATCH_MAX_STUDENTS = get_setting("BATCH_MAX_STUDENTS", 200)
+BATCH_POLL_INTERVAL = get_setting("BATCH_POLL_INTERVAL", 1.0)
+
+def log_batch_result(batch, item):
+    log_request(f"batch-{batch.batch_id}", item["model"], item["usage"], item["started"],
+                item["started"] + item["seconds"], thinking_budget=item["thinking_budget"] or None,
+                admitted=item["admitted"], retries=item["retries"], error_class=item["error_class"],
+                max_tokens=item["max_tokens"], route=item["route"])
+
+@st.cache_resource
+def get_batch_runner():
+    return BatchRunner(rate_scheduler, max_workers=get_setting("BATCH_WORKERS", 4), on_result=log_batch_result)
+
+batch_runner = get_batch_runner()
+
+# Every student matching the current search and filters, across all roster pages
+def batch_students():
+    students, _ = roster_index(TEACHER_NAME, roster.version(TEACHER_NAME)).page(
+        st.session_state.get("roster_query", ""), grades=st.session_state.get("roster_grades"),
+        special_education=YES_NO[st.session_state.get("roster_sped", "Any")],
+        english_language_learner=YES_NO[st.session_state.get("roster_ell", "Any")],
+        tiers=st.session_state.get("roster_tiers"), page=0, page_size=BATCH_MAX_STUDENTS)
+    return students
+
+def batch_items(report_type, students):
+    report = REPORT_TYPES[report_type]
+    # In routing mode the report type picks the model; the whole batch uses one so the prefix cache is shared
+    route = None
+    model = st.session_state.get("selected_model", "claude-3-7-sonnet-20250219")
+    thinking_budget = 0
+    max_tokens = report["max_tokens"]
+    if model == AUTO_MODEL:
+        decision = model_router.route(report["route"])
+        route, model, thinking_budget = report["route"], decision["model"], decision["thinking_budget"]
+        if thinking_budget:
+            max_tokens = max(max_tokens, thinking_budget + 1024)
+    # Never more than the model accepts, or every request in the batch would be rejected
+    max_tokens = min(max_tokens, MAX_OUTPUT_TOKENS_BY_MODEL.get(model, max_tokens))
+    items = []
+    for student in students:
+        prompt = report_prompt(report_type, student, TEACHER_NAME)
+        system = student_system_blocks(student["full_name"], work_samples=portfolio_sections(student["roster_id"], prompt))
+        items.append({
+            "student": student, "system": system, "prompt": prompt, "model": model, "route": route,
+            "thinking_budget": thinking_budget, "max_tokens": max_tokens,
+            "input_estimate": sum(estimate_tokens(block["text"]) for block in system) + estimate_tokens(prompt),
+        })
+    return items
+
+def start_batch(report_type, students):
+    batch = ReportBatch(report_type, batch_items(report_type, students), mode=BATCH_MODE)
+    batch_runner.submit(st.session_state.client, batch)
+    st.session_state.batch_id = batch.batch_id
+
+def batch_status_rows(batch):
+    return [{
+        "Student": item["student"]["full_name"],
+        "Status": item["status"],
+        "Seconds": round(item["seconds"], 1) if item["seconds"] is not None else None,
+        "Cached tokens": item["usage"].get("cache_read_input_tokens"),
+        "Error": item["error"],
+    } for item in batch.items]
+
+# Progress of a running batch, redrawn on a timer; reruns the page once when the batch is done
+@st.fragment(run_every=BATCH_POLL_INTERVAL)
+def batch_progress_fragment():
+    batch = batch_runner.get(st.session_state.get("batch_id"))
+    if batch is None:
+        return
+    if batch.done:
+        st.rerun()
+    counts = batch.counts()
+    finished = counts["done"] + counts["error"]
+    if batch.mode == "batches" and batch.api_counts:
+        finished = sum(count for name, count in batch.api_counts.items() if name != "processing")
+    st.progress(finished / len(batch.items), text=f"{finished} of {len(batch.items)} reports")
+    st.button("Cancel", key="cancel_batch", on_click=batch.cancel)
+    st.dataframe(batch_status_rows(batch), hide_index=True, use_container_width=True, height=200)
+
+@st.fragment
+@profiled("batch reports")
+def batch_report_fragment():
+    with st.expander("Batch reports"):
+        batch = batch_runner.get(st.session_state.get("batch_id"))
+        running = batch is not None and not batch.done
+        report_type = st.selectbox("Report", list(REPORT_TYPES), key="batch_report_type", disabled=running,
+                                   format_func=lambda report_type: REPORT_TYPES[report_type]["label"])
+        students = batch_students()
+        st.caption(f"One report for each of the {len(students)} students matching the search and filters")
+        if st.button("Generate", key="start_batch", disabled=running or not students, use_container_width=True):
+            start_batch(report_type, students)
+            st.rerun()
+
+        if running:
+            batch_progress_fragment()
+        elif batch is not None:
+            counts = batch.counts()
+            st.caption(f"{counts['done']} of {len(batch.items)} {REPORT_TYPES[batch.report_type]['label'].lower()} "
+                       f"generated in {batch.finished - batch.created:.0f}s")
+            if counts["error"]:
+                st.dataframe([row for row in batch_status_rows(batch) if row["Status"] == "error"],
+                             hide_index=True, use_container_width=True)
+            st.download_button("Download reports", batch.bundle(), file_name=f"wittly-{batch.report_type.replace(' ', '-')}"
+                               f"-{datetime.fromtimestamp(batch.created):%Y%m%d-%H%M}.zip",
+                               mime="application/zip", key="download_batch", use_container_width=True)
+
+# Tab content is built from the store once per student and cached across sessions;
+# store_version keys the cache to the data it was built from
+@st.cache_data(show_spinner=False)
+def details_tab_data(student_name, store_version):
+    student = student_store.find_student(student_name)
+    if student is None:
+        return None
+    return {
+        "info": f"""
+        **Name:** {student["full_name"]}  
+        **Grade:** {ordinal_grade(student["grade"])} Grade  
+        **Age:** {age_on(student["birthdate"])}  
+        **DOB:** {student["birthdate"]}  
+        **Teacher:** {TEACHER_NAME}  
+        """,
+        "demographics": {
+            "Gender": GENDERS.get(student["gender"], student["gender"]),
+            "Special Education": "Yes" if student["special_education"] else "No",
+            "English Language Learner": "Yes" if student["english_language_learner"] else "No",
+            "Economically Disadvantaged": "Yes" if student["economically_disadvantaged"] else "No"
+        },
+    }
+
+@st.cache_data(show_spinner=False)
+def screener_tab_data(student_name, store_version):
+    student = student_store.find_student(student_name)
+    if student is None:
+        return []
+    sections = []
+    for result in student_store.screener_results(student["student_id"]):
+        subject = SUBJECT_TITLES[result["subject"]]
+        test_date = datetime.fromisoformat(result["test_date"]).strftime("%B %Y")
+        domains = student_store.screener_domains(student["student_id"], result["subject"], result["season"])
+        sections.append({
+            "subject": subject,
+            "heading": f"{result['season'].title()} {subject} Assessment ({test_date})",
+            "overall": (f"**Overall {subject}: Score {result['overall_score']}, "
+                        f"Percentile {result['percentile_rank']}, "
+                        f"Grade Level Equivalent: {ordinal_grade(result['gle'])}**"),
+            "table": {
+                "Domain": [domain["domain"] for domain in domains],
+                "Score": [domain["scaled_score"] for domain in domains],
+                "Grade Level Equivalent": [ordinal_grade(domain["gle"]) for domain in domains]
+            },
+        })
+    return sections
+
+@st.cache_data(show_spinner=False)
+def progress_tab_data(student_name, store_version, growth_version):
+    student = student_store.find_student(student_name)
+    pm_summary = student_store.progress_summary(student["student_id"]) if student else None
+    if pm_summary is None:
+        return None
+    growth, phases, trend = student_growth(student["student_id"])
+    growth = student_rows(growth, student["student_id"], pm_summary["subject"]).iloc[0]
+    trend = student_rows(trend, student["student_id"], pm_summary["subject"])
+    
+    # Weeks in chronological order; skipped weeks are listed but left out of the chart and the fit
+    progress_dates = []
+    progress_scores = []
+    for period in student_store.progress_periods(student["student_id"], pm_summary["subject"]):
+        if period["status"] == "Assigned":
+            continue
+        week_start = datetime.fromisoformat(period["week_start"])
+        label = f"{week_start:%b} {week_start.day}"
+        if period["status"] == "Skipped":
+            progress_dates.append(f"{label} (Skip)")
+            progress_scores.append(0)
+        else:
+            progress_dates.append(label)
+            progress_scores.append(period["scaled_score"])
+    
+    def roi(value):
+        return "n/a" if value != value else f"{value:.2f}"
+    
+    return {
+        "title": f"Grade {pm_summary['level']} {SUBJECT_TITLES[pm_summary['subject']]} - {pm_summary['domain']}",
+        "chart": trend.set_index("week")[["scaled_score", "trend", "aim"]].rename(
+            columns={"scaled_score": "Score", "trend": "Trend", "aim": "Aim line"}),
+        "progress": {"Date": progress_dates, "Score": progress_scores},
+        "growth": {
+            "Metric": ["Current Rate of Improvement (ROI)", "Expected ROI", "Aggressive ROI",
+                       f"Target ({growth['roi_target'].title()})", "Trend vs. Aim Line"],
+            "Value": [roi(growth["current_roi"]), roi(growth["moderate_roi"]), roi(growth["aggressive_roi"]),
+                      growth["roi_result"].title(),
+                      "n/a" if growth["aim_gap"] != growth["aim_gap"] else f"{growth['aim_gap']:+.1f} points"]
+        },
+        "flag": growth["tier_flag"],
+        "phases": len(phases[phases["subject"] == pm_summary["subject"]]),
+    }
+
+# Work-samples table rows, cached until a sample is added or finishes extracting
+@st.cache_data(show_spinner=False)
+def portfolio_tab_data(roster_id, owner, portfolio_version):
+    return portfolio_store.samples(owner, roster_id)
+
+def render_details_tab(student_name, store_version):
+    details = details_tab_data(student_name, store_version)
+    if details is None:
+        st.info(f"No data on file for {student_name}.")
+        return
+    st.markdown("### Student Information")
+    st.markdown(details["info"])
+    
+    st.markdown("### Demographic Information")
+    st.table(details["demographics"])
+
+# The recommendations, skill focus areas and observations below are written text, not data from the store,
+# and they are about the student whose records are in the prompt file; nobody else has any on file yet
+NOTES_STUDENT = "Michael Faraday"
+
+def render_screener_tab(student_name, store_version):
+    st.markdown("### Classworks Universal Academic Assessment")
+    
+    sections = screener_tab_data(student_name, store_version)
+    if not sections:
+        st.info(f"No screener results on file for {student_name}.")
+        return
+    current_subject = None
+    for section in sections:
+        # One section per subject, one table per season
+        if section["subject"] != current_subject:
+            current_subject = section["subject"]
+            st.markdown(f"## {current_subject} Assessment")
+        st.markdown(f"### {section['heading']}")
+        st.markdown(section["overall"])
+        st.dataframe(section["table"])
+    
+    if student_name != NOTES_STUDENT:
+        return
+    st.markdown("### Instructional Recommendations")
+    st.markdown("""
+    - **Reading**: Tier 2 intervention needed; focus on reading comprehension strategies
+    - **Mathematical Processes**: Tier 3 intervention needed; significant focus required
+    - **Statistics and Probability**: Tier 3 intervention needed; targeted support required
+    - **Algebra**: Tier 2 intervention needed; focus on algebraic concepts
+    - **Grammar/Usage/Mechanics**: Continue Tier 2 intervention with current strategies
+    """)
+
+def render_progress_tab(student_name, store_version):
+    progress = progress_tab_data(student_name, store_version, scores_version(student_store))
+    if progress is None:
+        st.info(f"No progress monitoring data on file for {student_name}.")
+    else:
+        st.markdown(f"## {progress['title']}")
         st.markdown("### Weekly Progress Monitoring")
         
-        # Reordering dates chronologically and corresponding scores
-        progress_dates = ["Mar 21", "Mar 25", "Mar 31 (Skip)", "Apr 8", "Apr 15", 
-                         "Apr 22", "May 1", "May 10", "May 12 (Skip)", 
-                         "May 19 (Skip)", "May 30", "Jun 2 (Skip)"]
-        progress_scores = [77, 62, 0, 85, 69, 69, 69, 85, 0, 0, 100, 0]
-        
-        # Create a chart-friendly version (removing skips)
-        chart_dates = ["Mar 21", "Mar 25", "Apr 8", "Apr 15", "Apr 22", "May 1", "May 10", "May 30"]
-        chart_scores = [77, 62, 85, 69, 69, 69, 85, 100]
-        
-        # Creating a dictionary for the chart
-        chart_data = {"Score": chart_scores}
-        
         # Display the chart with the title
-        st.line_chart(chart_data)
+        st.line_chart(progress["chart"])
         
         st.markdown("**Weekly Assessments (Chronological Order):**")
-        progress_data = {
-            "Date": progress_dates,
-            "Score": progress_scores,
-        }
-        st.dataframe(progress_data)
+        st.dataframe(progress["progress"])
         
         st.markdown("### Growth Analysis")
-        growth_data = {
-            "Metric": ["Current Rate of Improvement (ROI)", "Expected ROI", "Aggressive ROI"],
-            "Value": ["-1.71543", "1.5", "2.0"]
-        }
-        st.dataframe(growth_data)
-        
-        st.markdown("### Skill Focus Areas")
-        st.markdown("""
-        - Create, describe, and record a variety of patterns
-        - Identify and describe the rule for a pattern
-        - Identify the mathematics in everyday situations
-        - Relate informal language to mathematical language and symbols
-        - Apply problem-solving strategies (guessing/checking, pattern recognition)
-        """)
-        
-        st.markdown("### Intervention Recommendation")
-        st.markdown("""
-        - **Status**: Below expected growth targets
-        - **Action Needed**: Adjust current intervention approach
-        - **Target Skills**: Mathematical processes, pattern recognition
-        - **Recommended Frequency**: Daily 30-minute sessions
-        - **Approach**: Use manipulatives and concrete examples to demonstrate concepts
-        """)
-        
-    # Observations tab
-    with tabs[3]:
-        st.markdown("### Teacher Observations")
-        st.markdown("""
-        - Struggles with reading comprehension but excels in word analysis
-        - Strong mathematical reasoning but inconsistent performance
-        - Enjoys hands-on activities and group work
-        - Difficulty maintaining focus during long reading tasks
-        - Shows special interest in science-related topics
-        - Participates actively in class discussions when confident about the material
-        """)
-        
-        st.markdown("### Engagement & Learning Style")
-        st.markdown("""
-        - Visual learner who benefits from diagrams and graphic organizers
-        - Responds well to 1:1 instruction
-        - Needs frequent breaks during extended reading tasks
-        - More engaged with digital learning tools than traditional workbooks
-        - Performs better in morning sessions than afternoon
-        """)
-        
-        st.markdown("### Behavior Notes")
-        st.markdown("""
-        - Generally well-behaved but occasionally frustrated during reading tasks
-        - Works well with peers in structured group activities
-        - Shows anxiety when asked to read aloud in class
-        - Needs consistent redirections during independent work
-        - Uses positive coping strategies when provided with clear expectations
-        """)
-        
-    # Portfolio tab
-    with tabs[4]:
-        st.markdown("## Student Work Portfolio")
-        
-        # Table of student work samples
-        st.markdown("### Work Samples")
-        
-        # Create a dataframe for the sample works
-        import pandas as pd
-        
-        # Create sample data
-        data = {
-            "Subject": ["Writing", "Writing", "Math", "Math", "Science", "Art", "Social Studies"],
-            "Date Uploaded": ["Feb 15, 2025", "Jan 22, 2025", "Mar 05, 2025", "Feb 28, 2025", "Feb 10, 2025", "Mar 01, 2025", "Jan 15, 2025"],
-            "Assignment Name": ["My Space Adventure", "Book Report: Charlotte's Web", "Pattern Recognition Assessment", "Word Problems", "Solar System Model", "Self-Portrait", "Native American Cultures"],
-            "Grade": ["B-", "C+", "C", "D+", "A-", "B+", "B-"],
-            "View": ["View", "View", "View", "View", "View", "View", "View"]
-        }
-        
-        # Create DataFrame
-        df = pd.DataFrame(data)
-        
-        # Display table with formatting
+        st.dataframe(progress["growth"])
+        st.caption(progress["flag"] + (f" (ROI is for the latest of {progress['phases']} intervention phases.)"
+                                       if progress["phases"] > 1 else ""))
+    
+    if student_name != NOTES_STUDENT:
+        return
+    st.markdown("### Skill Focus Areas")
+    st.markdown("""
+    - Create, describe, and record a variety of patterns
+    - Identify and describe the rule for a pattern
+    - Identify the mathematics in everyday situations
+    - Relate informal language to mathematical language and symbols
+    - Apply problem-solving strategies (guessing/checking, pattern recognition)
+    """)
+    
+    st.markdown("### Intervention Recommendation")
+    st.markdown("""
+    - **Status**: Below expected growth targets
+    - **Action Needed**: Adjust current intervention approach
+    - **Target Skills**: Mathematical processes, pattern recognition
+    - **Recommended Frequency**: Daily 30-minute sessions
+    - **Approach**: Use manipulatives and concrete examples to demonstrate concepts
+    """)
+
+def render_observations_tab(student_name, store_version):
+    st.markdown("### Teacher Observations")
+    if student_name != NOTES_STUDENT:
+        st.info(f"No observations on file for {student_name}.")
+        return
+    st.markdown("""
+    - Struggles with reading comprehension but excels in word analysis
+    - Strong mathematical reasoning but inconsistent performance
+    - Enjoys hands-on activities and group work
+    - Difficulty maintaining focus during long reading tasks
+    - Shows special interest in science-related topics
+    - Participates actively in class discussions when confident about the material
+    """)
+    
+    st.markdown("### Engagement & Learning Style")
+    st.markdown("""
+    - Visual learner who benefits from diagrams and graphic organizers
+    - Responds well to 1:1 instruction
+    - Needs frequent breaks during extended reading tasks
+    - More engaged with digital learning tools than traditional workbooks
+    - Performs better in morning sessions than afternoon
+    """)
+    
+    st.markdown("### Behavior Notes")
+    st.markdown("""
+    - Generally well-behaved but occasionally frustrated during reading tasks
+    - Works well with peers in structured group activities
+    - Shows anxiety when asked to read aloud in class
+    - Needs consistent redirections during independent work
+    - Uses positive coping strategies when provided with clear expectations
+    """)
+
+PORTFOLIO_CATEGORIES = ["Writing", "Math", "Science", "Art", "Social Studies", "Other"]
+PORTFOLIO_STATUS = {"pending": "Queued", "extracting": "Extracting…", "ready": "Ready", "failed": "No text"}
+
+# Files are streamed to the portfolio store in chunks and filed under the student; new content is
+# queued for text and thumbnail extraction, content already stored is reused as is
+def handle_portfolio_upload(roster_id, student_name):
+    added = duplicates = 0
+    for upload in st.session_state.portfolio_files or []:
+        upload.seek(0)
+        _, file_id, new_file = portfolio_store.add_sample(
+            st.session_state.owner, roster_id, student_name, st.session_state.portfolio_category, upload.name, upload,
+            title=st.session_state.portfolio_title.strip() or None)
+        if new_file:
+            portfolio_extractor.submit(file_id)
+            added += 1
+        else:
+            duplicates += 1
+    st.session_state.portfolio_upload_result = (added, duplicates)
+
+def format_file_size(size):
+    return f"{size / 1024:.0f} KB" if size < 1024 * 1024 else f"{size / 1024 / 1024:.1f} MB"
+
+PORTFOLIO_POLL_INTERVAL = get_setting("PORTFOLIO_POLL_INTERVAL", 1.0)
+
+# Shown while samples are being extracted; reruns the page once they are all done so the table updates
+@st.fragment(run_every=PORTFOLIO_POLL_INTERVAL)
+def portfolio_extraction_fragment():
+    pending = portfolio_extractor.pending()
+    if not pending:
+        st.rerun()
+    st.caption(f"Extracting text from {pending} file(s)…")
+
+def render_portfolio_tab(student_name, store_version):
+    st.markdown("## Student Work Portfolio")
+    
+    # Table of student work samples
+    st.markdown("### Work Samples")
+    # Samples are filed under the selected roster row, so students who share a name keep separate portfolios
+    roster_id = st.session_state.selected_roster_id
+    samples = portfolio_tab_data(roster_id, st.session_state.owner, portfolio_store.version(st.session_state.owner))
+    if samples:
         st.dataframe(
-            df,
-            column_config={
-                "Subject": st.column_config.TextColumn("Subject"),
-                "Date Uploaded": st.column_config.TextColumn("Date Uploaded"),
-                "Assignment Name": st.column_config.TextColumn("Assignment Name"),
-                "Grade": st.column_config.TextColumn("Grade"),
-                "View": st.column_config.LinkColumn("Action")
-            },
+            [{
+                "Sample": sample_label(sample["sample_id"]),
+                "Subject": sample["category"],
+                "Date Uploaded": datetime.fromtimestamp(sample["uploaded"]).strftime("%b %d, %Y"),
+                "Assignment Name": sample["title"],
+                "Size": format_file_size(sample["size"]),
+                "Status": PORTFOLIO_STATUS[sample["status"]],
+            } for sample in samples],
             hide_index=True,
         )
+        if any(sample["status"] in ("pending", "extracting") for sample in samples):
+            portfolio_extraction_fragment()
         
-        # Upload section
-        st.markdown("### Upload New Work Sample")
-        
-        # Category selection
-        st.selectbox("Category", ["Writing", "Math", "Science", "Art", "Social Studies", "Other"])
-        
-        # File uploader
-        st.file_uploader("Select file to upload", type=["pdf", "doc", "docx", "jpg", "png"])
-        
-        # Submit button
-        st.button("Upload to Portfolio")
+        sample = st.selectbox("View sample", samples, key=f"portfolio_view_{roster_id}",
+                              format_func=lambda sample: f"{sample_label(sample['sample_id'])} · {sample['title']}")
+        if sample["thumbnail"]:
+            st.image(portfolio_store.thumbnail_path(sample["file_id"]))
+        if sample["text_chars"]:
+            with st.expander("Extracted text"):
+                st.text(portfolio_store.passage_text(sample["file_id"]))
+        with open(portfolio_store.file_path(sample["file_id"]), "rb") as f:
+            st.download_button("Download original", f.read(), file_name=sample["filename"],
+                               mime=sample["media_type"], key=f"portfolio_download_{sample['sample_id']}")
+    else:
+        st.caption(f"No work samples for {student_name} yet.")
+    
+    # Upload section
+    st.markdown("### Upload New Work Sample")
+    with st.form("portfolio_upload_form", clear_on_submit=True, border=False):
+        st.selectbox("Category", PORTFOLIO_CATEGORIES, key="portfolio_category")
+        st.text_input("Assignment name", key="portfolio_title", placeholder="Defaults to the file name")
+        st.file_uploader("Select file to upload", type=["pdf", "doc", "docx", "jpg", "png"],
+                         accept_multiple_files=True, key="portfolio_files")
+        st.form_submit_button("Upload to Portfolio", on_click=handle_portfolio_upload, args=(roster_id, student_name))
+    if "portfolio_upload_result" in st.session_state:
+        added, duplicates = st.session_state.pop("portfolio_upload_result")
+        if added:
+            st.success(f"Uploaded {added} file(s); text and thumbnails are being extracted.")
+        if duplicates:
+            st.info(f"{duplicates} file(s) were already stored and were filed without uploading again.")
+
+DATA_TABS = {
+    "Details": render_details_tab,
+    "Screener": render_screener_tab,
+    "Progress": render_progress_tab,
+    "Observations": render_observations_tab,
+    "Portfolio": render_portfolio_tab,
+}
+
+# Add data column with tabs
+@st.fragment
+@profiled("data panel")
+def data_panel_fragment():
+    # Stateful tabs: switching tabs reruns only this fragment, and only the open tab is built and sent
+    tabs = st.tabs(list(DATA_TABS), key="data_tab", on_change="rerun")
+    store_version = student_store.version()
+    
+    for tab, (tab_name, render_tab) in zip(tabs, DATA_TABS.items()):
+        if tab.open:
+            with tab, profiler.section(f"{tab_name} tab"):
+                render_tab(st.session_state.selected_student, store_version)
+
+MODEL_NAMES = {
+    "claude-3-7-sonnet-20250219": "Claude 3.7 Sonnet",
+    "claude-3-5-sonnet-20241022": "Claude 3.5 Sonnet",
+    "claude-3-opus-20240229": "Claude 3 Opus",
+    "claude-3-5-haiku-20241022": "Claude 3.5 Haiku",
+    AUTO_MODEL: "Auto",
+}
+
+# Messages drawn per page of the chat history
+CHAT_PAGE_SIZE = get_setting("CHAT_PAGE_SIZE", 20)
+
+def show_earlier_messages():
+    st.session_state.history_window += CHAT_PAGE_SIZE
+
+# Session state that belongs to one conversation; switching conversations starts it over
+CONVERSATION_STATE = ["session_id", "messages", "history_manager", "conversation_started", "is_streaming",
+                      "response_job", "history_window", "earlier_messages", "last_usage", "last_render_stats",
+                      "last_response_cached", "last_stream_error", "last_image_report", "last_route"]
+
+def open_conversation_page(session_id):
+    for key in CONVERSATION_STATE:
+        st.session_state.pop(key, None)
+    if session_id is None:
+        st.query_params.pop("session", None)
+    else:
+        st.query_params["session"] = session_id
+
+# This session owner's recent conversations about the selected student, newest first. Opening one reruns
+# the whole page (not just the chat fragment) so everything is rebuilt for it.
+def render_conversation_list():
+    if st.button("New conversation", key="new_conversation", use_container_width=True):
+        open_conversation_page(None)
+        st.rerun()
+    conversations = [conversation for conversation in
+                     conversation_store.conversations(st.session_state.owner, st.session_state.selected_student,
+                                                      limit=11)
+                     if conversation["conversation_id"] != st.session_state.session_id][:10]
+    for conversation in conversations:
+        updated = datetime.fromtimestamp(conversation["updated"]).strftime("%b %d, %I:%M %p")
+        if st.button(f"{conversation['title']} · {updated} · {conversation['message_count']} messages",
+                     key=f"conversation_{conversation['conversation_id']}", use_container_width=True):
+            open_conversation_page(conversation["conversation_id"])
+            st.rerun()
+    if not conversations:
+        st.caption(f"No earlier conversations about {st.session_state.selected_student}.")
+
+# Chat column: only this fragment reruns when a message is sent or the model is changed
+@st.fragment
+@profiled("chat")
+def chat_fragment():
+    fragment_started = time.perf_counter()
+    profiler.step("header")
+
+    # Create columns for header and model selection
+    header_col, dropdown_col = st.columns([3, 1])
+
+    with header_col:
+        # App header with smaller font sizes
+        st.markdown("""
+
+        """, unsafe_allow_html=True)
+        with st.popover("Conversations", disabled=st.session_state.is_streaming):
+            render_conversation_list()
+
+    with dropdown_col:
+        st.session_state.selected_model = st.selectbox(
+            "Model",
+            ["claude-3-7-sonnet-20250219", "claude-3-5-sonnet-20241022", "claude-3-opus-20240229", AUTO_MODEL],
+            format_func=lambda x: MODEL_NAMES.get(x, x),
+            label_visibility="collapsed",
+            help="Auto picks the fastest model suited to each message, with a matching thinking budget and length limit"
+        )
+
+    profiler.step("history")
 
-# Continue within chat_col to put the chat UI only in the left column
-with chat_col:
     # Auto-start conversation if it's a new session
     if "conversation_started" not in st.session_state:
         st.session_state.conversation_started = True
-        
+
         # Set up for Wittly's initial greeting
         try:
-            # Refresh system prompt with current date 
-            st.session_state.system_prompt = get_system_prompt_with_date()
-            
             # Add a hidden user message to trigger the conversation
             st.session_state.messages.append({
                 "role": "user", 
-                "content": "Please introduce yourself according to your system instructions."
+                "content": GREETING_PROMPT
             })
-            
-            # Set the streaming flag to true to initiate streaming on next rerun
+
+            # Set the streaming flag so the greeting streams further down this same run
             st.session_state.is_streaming = True
-            
-            # Force a rerun to start streaming the response
-            st.rerun()
         except Exception as e:
             st.error(f"An error occurred starting the conversation: {str(e)}")
 
-    # Hide the default sidebar
-    st.markdown("""
-        <style>
-        [data-testid="stSidebar"] {
-            display: none;
-        }
-        </style>
-    """, unsafe_allow_html=True)
+    # Only the most recent page of the history is drawn; earlier pages are shown on request, reading the
+    # messages a reopened conversation left in the store back as they are needed
+    history_window = st.session_state.setdefault("history_window", CHAT_PAGE_SIZE)
+    earlier_messages = st.session_state.setdefault("earlier_messages", [])
+    missing = history_window - len(earlier_messages) - len(st.session_state.messages)
+    if missing > 0:
+        earlier_messages[:0] = st.session_state.messages.earlier_page(len(earlier_messages), missing)
+    unread = st.session_state.messages.earlier - len(earlier_messages)
 
     # Skip showing the initial prompt message
-    messages_to_display = [msg for i, msg in enumerate(st.session_state.messages) if 
-                         not (i == 0 and 
-                              msg["role"] == "user" and 
-                              msg["content"] == "Please introduce yourself according to your system instructions.")]
+    messages_to_display = [msg for msg in earlier_messages + st.session_state.messages
+                           if not (msg["role"] == "user" and msg["content"] == GREETING_PROMPT)]
+
+    shown_from = max(0, len(messages_to_display) - history_window)
+    hidden_count = shown_from + unread
+    if hidden_count:
+        st.button(f"Show {min(hidden_count, CHAT_PAGE_SIZE)} earlier messages ({hidden_count} hidden)",
+                  key="show_earlier_messages", on_click=show_earlier_messages)
 
     # Display message history
-    for message in messages_to_display:
+    for message in messages_to_display[shown_from:]:
         with st.container():
             role = message["role"]
             content = message["content"]
-            
+
             if role == "user":
                 # Check if content is a list (multi-modal message with image)
                 if isinstance(content, list):
@@ -541,10 +1747,14 @@ with chat_col:
                             if block["type"] == "text":
                                 st.write(block["text"])
                             elif block["type"] == "image":
-                                # Display the image
-                                image_data = block["source"]["data"]
-                                image_type = block["source"]["media_type"]
-                                st.image(f"data:{image_type};base64,{image_data}", use_container_width=True)
+                                # Display the image, straight from the blob store
+                                if block["source"]["type"] == "blob":
+                                    st.image(conversation_store.blob_path(block["source"]["blob_id"]),
+                                             use_container_width=True)
+                                else:
+                                    image_data = block["source"]["data"]
+                                    image_type = block["source"]["media_type"]
+                                    st.image(f"data:{image_type};base64,{image_data}", use_container_width=True)
                 else:
                     # Plain text message
                     st.markdown(f"""
@@ -559,259 +1769,43 @@ with chat_col:
                 with st.chat_message("assistant", avatar="🤖"):
                     st.markdown(content)
 
-# Add a state for tracking if we're currently streaming a response
-if "is_streaming" not in st.session_state:
-    st.session_state.is_streaming = False
+    profiler.step("response")
 
-# Function to handle the conversation 
-def handle_send():
-    user_input = st.session_state.current_input
-    has_image = False
-    
-    # Check if there's an uploaded image in session state
-    if "uploaded_image" in st.session_state and st.session_state.uploaded_image is not None:
-        has_image = True
-    
-    if user_input or has_image:  # Process if there's text input or an image
-        # Set streaming flag
-        st.session_state.is_streaming = True
-        # Clear input
-        st.session_state.current_input = ""
-        
-        # Create message content
-        if has_image:
-            # For messages with images, we need to create a message with both text and image
-            image = st.session_state.uploaded_image
-            
-            # Create content blocks for the message (text and image)
-            message_content = [
-                {
-                    "type": "text",
-                    "text": user_input if user_input else "What do you see in this image?"
-                },
-                {
-                    "type": "image",
-                    "source": {
-                        "type": "base64", 
-                        "media_type": f"image/{image.type.split('/')[-1]}", 
-                        "data": base64.b64encode(image.getvalue()).decode("utf-8")
-                    }
-                }
-            ]
-            
-            # Add the message with image to history
-            st.session_state.messages.append({"role": "user", "content": message_content})
-            
-            # Clear the uploaded image from session state
-            st.session_state.uploaded_image = None
+    # Start the response to a newly sent message, then follow it until it has finished
+    if st.session_state.is_streaming and st.session_state.response_job is None:
+        start_response()
+    job = worker_session["job"]
+    if st.session_state.response_job and job is not None and job.job_id == st.session_state.response_job:
+        if job.done:
+            finish_response(job)
         else:
-            # For text-only messages, add as before
-            st.session_state.messages.append({"role": "user", "content": user_input})
-        
-        # Rerun to show the user message immediately
-        st.rerun()
+            st.button("■ Stop", key="stop_response", on_click=job.cancel, help="Stop generating this response")
+            # A page run starts the live response over in a fresh container
+            st.session_state.live_committed = 0
+            with st.chat_message("assistant", avatar="🤖"):
+                live_response_fragment(st.container())
+    if st.session_state.get("last_stream_error"):
+        st.error(st.session_state.pop("last_stream_error"))
 
-# Function to handle streaming response
-def stream_response():
-    # We need to make sure to display this in the chat column
-    with chat_col:
-        # Create a chat message with the robot avatar for streaming
-        with st.chat_message("assistant", avatar="🤖"):
-            streaming_placeholder = st.empty()
-            full_response = ""
-        
-        try:
-            # Get fresh system prompt with current date
-            system_prompt_with_date = get_system_prompt_with_date()
-            
-            # Prepare messages for the API call
-            api_messages = []
-            for msg in st.session_state.messages:
-                # Handle different message formats (text-only vs multi-modal)
-                if isinstance(msg["content"], list):
-                    # This is a multi-modal message with image
-                    api_messages.append({"role": msg["role"], "content": msg["content"]})
-                else:
-                    # This is a text-only message
-                    api_messages.append({"role": msg["role"], "content": msg["content"]})
-            
-            # Make a streaming request
-            with st.session_state.client.messages.stream(
-                model=st.session_state.selected_model,
-                max_tokens=4000,
-                system=system_prompt_with_date,
-                messages=api_messages,
-                thinking={"type": "enabled", "budget_tokens": 1024}
-            ) as stream:
-                # Display the response as it comes in
-                for chunk in stream:
-                    if chunk.type == "content_block_delta" and hasattr(chunk.delta, "text"):
-                        full_response += chunk.delta.text
-                        streaming_placeholder.markdown(full_response)
-                    # Handle thinking chunks separately (if we want to display them)
-                    elif chunk.type == "thinking_delta":
-                        # Skip thinking chunks for now - we could display them if needed
-                        pass
-            
-            # Add the full response to history
-            st.session_state.messages.append({
-                "role": "assistant", 
-                "content": full_response
-            })
-        except anthropic.RateLimitError:
-            st.error("Rate limit exceeded. Please wait a minute before trying again.")
-            st.session_state.messages.append({
-                "role": "assistant", 
-                "content": "I'm sorry, the API rate limit has been exceeded. Please wait a minute before sending another message."
-            })
-        except Exception as e:
-            st.error(f"An error occurred: {str(e)}")
-            st.session_state.messages.append({
-                "role": "assistant", 
-                "content": f"I'm sorry, an error occurred: {str(e)}"
-            })
-    
-    # Reset streaming flag
-    st.session_state.is_streaming = False
-    st.rerun()
-
-# No "New Conversation" button at the top anymore
+    # Warm the prompt cache for a newly opened student before the first question is sent
+    prewarm_prompt_cache()
 
-# Process streaming if needed
-if st.session_state.is_streaming:
-    stream_response()
-
-# Continue in the chat column for the input area
-with chat_col:
-    # Initialize the input state
-    if "current_input" not in st.session_state:
-        st.session_state.current_input = ""
-    
-    # Create a fixed-position container at the bottom but only for the chat column
-    st.markdown("""
-        <style>
-        .fixed-bottom {
-            position: fixed;
-            bottom: 0;
-            left: 15%;  /* Adjust for student list column */
-            width: 45%;  /* Match the chat column width */
-            background-color: #f5f5f5;
-            padding: 0;
-            z-index: 999;
-            display: flex;
-            border-top: 1px solid #ddd;
-        }
-        </style>
-    """, unsafe_allow_html=True)
-    
     # Add spacing to ensure content isn't hidden behind the fixed input box
     if len(st.session_state.messages) > 0:
         st.markdown("<div style='margin-bottom: 20px;'></div>", unsafe_allow_html=True)
-    
-    # Create a container for the input area
-    input_container = st.container()
 
-# Custom CSS to style the input area - putting inside the chat column
-with chat_col:
-    st.markdown("""
-        <style>
-        .input-container {
-            display: flex;
-            align-items: flex-end;
-            margin-bottom: 20px;
-        }
-        .input-box {
-            flex-grow: 1;
-            width: 100%;
-        }
-        /* Remove default label space */
-        .input-box label {
-            display: none !important;
-        }
-        /* Style the text area */
-        .stTextArea textarea {
-            resize: vertical;
-            min-height: 60px;
-            border-radius: 10px;
-        }
-        /* Style the form submit button - black and white theme */
-        .stForm [data-testid="stFormSubmitButton"] button {
-            border-radius: 4px;
-            background-color: #333333 !important;
-            color: white !important;
-            border: none;
-            transition: background-color 0.3s ease;
-        }
-        
-        /* Hover state for the button */
-        .stForm [data-testid="stFormSubmitButton"] button:hover {
-            background-color: #000000 !important;
-        }
-        
-        /* Style the file uploader */
-        [data-testid="stFileUploader"] {
-            margin-top: 5px;
-        }
-        
-        /* Make the file uploader more compact */
-        [data-testid="stFileUploader"] > div:first-child {
-            padding: 0.5rem !important;
-        }
-        
-        /* Style the upload button */
-        [data-testid="stFileUploader"] button {
-            background-color: #f0f0f0 !important;
-            color: #333333 !important;
-            border-radius: 4px;
-            padding: 0.2rem 0.5rem !important;
-            font-size: 0.8rem !important;
-        }
-        
-        /* Image display in chat */
-        .stImage img {
-            border-radius: 8px;
-            max-height: 300px;
-            margin: 10px 0;
-        }
-        
-        /* Style the tabs in the data column */
-        .stTabs [data-baseweb="tab-list"] {
-            gap: 2px;
-        }
-        .stTabs [data-baseweb="tab"] {
-            height: 32px;
-            border-radius: 5px 5px 0 0;
-            padding: 5px 10px;
-            background-color: #f5f5f5;
-            font-size: 0.85rem;
-        }
-        .stTabs [aria-selected="true"] {
-            background-color: white;
-            border-top: 2px solid #333333;
-        }
-        
-        /* Style student list */
-        [data-testid="stVerticalBlock"] > div:nth-child(1) [data-testid="stMarkdownContainer"] h2 {
-            margin-top: 0;
-            padding-top: 0;
-            font-size: 1.3rem;
-        }
-        </style>
-    """, unsafe_allow_html=True)
+    profiler.step("input form")
 
-# Function to handle enter key press (no longer used)
-def handle_key_press():
-    if not st.session_state.is_streaming and st.session_state.current_input:
-        handle_send()
+    # Create a container for the input area
+    input_container = st.container()
 
-with chat_col:
     with input_container:
         # Create a two-column layout with custom CSS
         st.markdown('<div class="input-container">', unsafe_allow_html=True)
-        
+
         # Input field column
         st.markdown('<div class="input-box">', unsafe_allow_html=True)
-        
+
         # Create a form to enable proper Enter key handling
         with st.form(key="message_form", clear_on_submit=True):
             # Use text_area instead of text_input for multi-line support
@@ -821,40 +1815,119 @@ with chat_col:
                 placeholder="Ask Wittly something...",
                 value=st.session_state.current_input,
                 height=70)  # Smaller fixed height for the text area
-            
+
             # Add image upload functionality with custom styling and preview
             col1, col2 = st.columns([3, 1])
             with col1:
                 uploaded_image = st.file_uploader("Upload an image for Claude to analyze", 
                                                 type=["jpg", "jpeg", "png"], 
+                                                key="chat_image_upload",
                                                 label_visibility="collapsed")
-                
+
                 # Display image preview if uploaded
                 if uploaded_image is not None:
                     # Calculate a small preview size
                     preview_width = 150
                     st.image(uploaded_image, width=preview_width, caption="Image preview")
-                
-            # Show the form's submit button
-            submit_button = st.form_submit_button("Send")
-            
-            # Handle form submission
-            if submit_button and not st.session_state.is_streaming:
-                st.session_state.current_input = user_input
-                
-                # Handle uploaded image
-                if uploaded_image is not None:
-                    # Save uploaded image to memory
-                    st.session_state.uploaded_image = uploaded_image
-                
-                if user_input or uploaded_image is not None:
-                    handle_send()
-        
+
+            # Show the form's submit button; the message is handled in its callback
+            st.form_submit_button("Send", on_click=handle_submit)
+
         st.markdown('</div>', unsafe_allow_html=True)
-        
+
         # End the input-container div
         st.markdown('</div>', unsafe_allow_html=True)
 
-# Display minimal footer information in the chat column
+    profiler.step("footer")
+
+    # Display minimal footer information in the chat column
+    st.caption(f"Session started: {datetime.now().strftime('%Y-%m-%d %H:%M')} | API key is kept in server memory only")
+    if st.session_state.get("last_response_cached"):
+        st.caption("Last response replayed from the response cache (no API call)")
+    elif st.session_state.get("last_usage"):
+        st.caption(format_usage(st.session_state.last_usage))
+    route = st.session_state.get("last_route")
+    if route and not st.session_state.is_streaming:
+        st.caption(f"Routed as {route['route']}: {MODEL_NAMES.get(route['model'], route['model'])}, "
+                   + (f"thinking {route['thinking_budget']:,} tokens, " if route["thinking_budget"] else "no thinking, ")
+                   + f"up to {route['max_tokens']:,} output tokens"
+                   + (f" (after {len(route['tried']) - 1} overloaded model(s))" if len(route["tried"]) > 1 else ""))
+    if st.session_state.get("last_usage", {}).get("stopped"):
+        st.caption(f"Response stopped early: up to {st.session_state.last_usage['tokens_saved']:,} output tokens saved")
+    context_usage = st.session_state.history_manager.last_usage
+    if context_usage["history"]:
+        used_tokens = context_usage["system"] + context_usage["history"]
+        st.progress(min(1.0, used_tokens / context_usage["budget"]),
+                    text=f"Context: ~{used_tokens:,} of {context_usage['budget']:,} tokens "
+                         f"(system ~{context_usage['system']:,}, conversation ~{context_usage['history']:,}"
+                         + (f", {context_usage['dropped']} older messages summarized or dropped)" if context_usage["dropped"] else ")"))
+    if st.session_state.get("last_image_report"):
+        st.caption(st.session_state.last_image_report)
+    if st.session_state.get("last_render_stats"):
+        st.caption(format_render_stats(st.session_state.last_render_stats))
+    if st.session_state.get("last_retrieval"):
+        retrieval = st.session_state.last_retrieval
+        st.caption(f"Student data sent: {retrieval['sections']} relevant sections (~{retrieval['tokens']:,} tokens)")
+
+    # Script execution time; streaming happens on a worker thread, outside the script run
+    timings = st.session_state.run_timings
+    timings["chat"] = (time.perf_counter() - fragment_started) * 1000
+    st.caption(f"Script time: last full page run {timings.get('page', 0):.0f} ms | "
+               f"last chat run {timings['chat']:.0f} ms")
+
+# Warm everything a first interaction would otherwise wait for, once per process in the background
+def warm_up_steps():
+    store_version = student_store.version()
+    growth_version = scores_version(student_store)
+    student_names = [row["full_name"] for row in student_store.query("SELECT full_name FROM students")]
+    api_key = secrets_api_key()
+    steps = [
+        # Chart and image codecs are imported on first use (the Progress tab, the first upload)
+        ("imports", lambda: import_modules(["altair", "PIL.JpegImagePlugin", "PIL.PngImagePlugin"])),
+        ("caseload growth", lambda: caseload_growth(growth_version)),
+        ("data tabs", lambda: [(details_tab_data(name, store_version), screener_tab_data(name, store_version),
+                                progress_tab_data(name, store_version, growth_version))
+                               for name in student_names]),
+        ("roster index", lambda: roster_index(TEACHER_NAME, roster.version(TEACHER_NAME))),
+    ]
+    if PROMPT_MODE == "retrieval":
+        steps.append(("retrieval index", lambda: get_retriever(store_version)))
+    if api_key:
+        steps.append(("API connections", lambda: client_registry.warm_up(
+            api_key, connections=get_setting("HTTP_WARM_CONNECTIONS", 2))))
+    return steps
+
+if not warm_up.started and get_setting("WARM_UP", True):
+    warm_up.start(warm_up_steps())
+
+profiler.step("layout")
+
+# Create a three-column layout: student list, chat, and data
+student_list_col, chat_col, data_col = st.columns([0.15, 0.45, 0.40])  # Students, chat, data
+
+with student_list_col:
+    student_list_fragment()
+    batch_report_fragment()
+
 with chat_col:
-    st.caption(f"Session started: {datetime.now().strftime('%Y-%m-%d %H:%M')} | API key is used only for this session")
+    chat_fragment()
+
+with data_col:
+    data_panel_fragment()
+
+st.session_state.run_timings["page"] = (time.perf_counter() - page_started) * 1000
+warm_up.record_page_run(time.perf_counter() - page_started)
+
+# Profiler overlay: this page run, plus any fragment reruns since the page was last drawn
+page_profile = profiler.finish_run()
+if page_profile:
+    with st.expander("Profiler", expanded=False):
+        runs = list(profiler.runs)[::-1]
+        run = st.selectbox("Run", runs, index=runs.index(page_profile),
+                           format_func=lambda run: f"{run['name']} at {datetime.fromtimestamp(run['finished']):%H:%M:%S} "
+                                                   f"({run['rows'][0]['seconds'] * 1000:.0f} ms)")
+        st.dataframe(format_run_rows(run, profiler.trace_memory), hide_index=True, use_container_width=True)
+        if profiler.trace_memory:
+            st.caption("Memory is traced process-wide, so other sessions' allocations can show up in these numbers.")
+        st.download_button("Download flame graph data", profiler.collapsed_stacks(), file_name="wittly-profile.folded",
+                           mime="text/plain", help="Collapsed stacks (self time in µs) for flamegraph.pl or speedscope")
@@ -0,0 +1,292 @@
+import csv
+import io
+import logging
+import re
+import threading
+import time
+import uuid
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from rate_limiter import is_retryable
+
+logger = logging.getLogger(__name__)
+
+# The artifacts a teacher can generate for every student at once. `route` is the kind of turn the
+# model router uses for it in routing mode.
+REPORT_TYPES = {
+    "progress summary": {
+        "label": "Progress summaries (conferences)",
+        "route": "lookup",
+        "max_tokens": 1200,
+        "instructions": ("Write a one-page progress summary about {name} for a parent-teacher conference: "
+                         "current performance in reading and math, growth since the start of the year, "
+                         "whether they are on track for their goals, and two or three next steps. "
+                         "Use short headed sections. Base it only on the data on file; say so where data is missing."),
+    },
+    "parent letter": {
+        "label": "Parent letters",
+        "route": "parent email",
+        "max_tokens": 1500,
+        "instructions": ("Write a warm, plain-language letter to {name}'s parents or guardians about their progress "
+                         "this term: strengths first, then areas of focus, what we are doing in class and one or two "
+                         "things they can do at home. Avoid jargon and test abbreviations. Sign it from {teacher}."),
+    },
+    "iep present levels": {
+        "label": "IEP present levels drafts",
+        "route": "iep draft",
+        "max_tokens": 3000,
+        "instructions": ("Draft the Present Levels of Academic Achievement and Functional Performance (PLAAFP) "
+                         "section of {name}'s IEP: strengths, current performance with the most recent scores, "
+                         "how the needs affect progress in the general curriculum, and baseline data for goals. "
+                         "Mark it as a draft for the IEP team to review."),
+    },
+}
+
+# How long to wait between Message Batches status checks
+BATCH_POLL_SECONDS = 5.0
+
+
+def report_prompt(report_type, student, teacher):
+    details = [f"Grade {'K' if student.get('grade') == 0 else student.get('grade')}"]
+    if student.get("special_education"):
+        details.append("receives special education services")
+    if student.get("english_language_learner"):
+        details.append("English language learner")
+    if student.get("tier"):
+        details.append(f"Tier {student['tier']} intervention")
+    return (REPORT_TYPES[report_type]["instructions"].format(name=student["full_name"], teacher=teacher)
+            + f"\n\nRoster details for {student['full_name']}: {', '.join(details)}.")
+
+
+def file_slug(name):
+    return re.sub(r"[^a-z0-9]+", "-", name.lower()).strip("-") or "student"
+
+
+# One report per student, generated in the background. Items are dicts with student, system (the
+# student's system blocks, sharing the cached guidance prefix), prompt, model, thinking_budget and
+# max_tokens; status per item goes queued -> waiting -> running -> done | error.
+class ReportBatch:
+    def __init__(self, report_type, items, mode="pool"):
+        self.batch_id = uuid.uuid4().hex[:12]
+        self.report_type = report_type
+        self.mode = mode
+        self.items = items
+        for item in items:
+            item.update(status="queued", text="", usage={}, error=None, error_class=None, retries=0,
+                        started=None, admitted=None, seconds=None)
+        self.created = time.time()
+        self.finished = None
+        # Message Batches mode: the API's batch id and request counts while it is processing
+        self.api_batch_id = None
+        self.api_counts = None
+        self._cancelled = threading.Event()
+
+    @property
+    def done(self):
+        return self.finished is not None
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def counts(self):
+        counts = {"queued": 0, "waiting": 0, "running": 0, "done": 0, "error": 0}
+        for item in self.items:
+            counts[item["status"]] += 1
+        return counts
+
+    def usage_totals(self):
+        totals = {}
+        for item in self.items:
+            for name in ("input_tokens", "output_tokens", "cache_read_input_tokens", "cache_creation_input_tokens"):
+                totals[name] = totals.get(name, 0) + (item["usage"].get(name) or 0)
+        return totals
+
+    # A zip with one Markdown file per student and summary.csv (status, model, tokens, time per student)
+    def bundle(self):
+        buffer = io.BytesIO()
+        summary = io.StringIO()
+        writer = csv.writer(summary)
+        writer.writerow(["student", "file", "status", "model", "seconds", "input_tokens", "output_tokens",
+                         "cache_read_input_tokens", "cache_creation_input_tokens", "error"])
+        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as bundle:
+            for item in self.items:
+                name = item["student"]["full_name"]
+                filename = f"{file_slug(name)}.md" if item["status"] == "done" else ""
+                if filename:
+                    bundle.writestr(filename, f"# {REPORT_TYPES[self.report_type]['label']}: {name}\n\n{item['text']}\n")
+                usage = item["usage"]
+                writer.writerow([name, filename, item["status"], item["model"],
+                                 round(item["seconds"], 2) if item["seconds"] is not None else "",
+                                 usage.get("input_tokens", ""), usage.get("output_tokens", ""),
+                                 usage.get("cache_read_input_tokens", ""), usage.get("cache_creation_input_tokens", ""),
+                                 item["error"] or ""])
+            bundle.writestr("summary.csv", summary.getvalue())
+        return buffer.getvalue()
+
+
+# Raised from the scheduler's wait callback to give up a queued request when its batch is cancelled
+class BatchCancelled(Exception):
+    pass
+
+
+def message_params(item):
+    params = {"model": item["model"], "max_tokens": item["max_tokens"], "system": item["system"],
+              "messages": [{"role": "user", "content": item["prompt"]}]}
+    if item["thinking_budget"]:
+        params["thinking"] = {"type": "enabled", "budget_tokens": item["thinking_budget"]}
+    return params
+
+
+def response_text(message):
+    return "".join(block.text for block in message.content if block.type == "text")
+
+
+# Runs report batches for the whole process. "pool" mode sends one request per student over a bounded
+# worker pool, admitted by the shared rate-limit scheduler (each batch queues as one fair-queueing
+# session, so chat turns keep their share); throughput grows with max_workers up to the rate limits.
+# The first student runs alone so the shared guidance prefix is in the prompt cache before the rest
+# start. "batches" mode submits everything to the Message Batches API instead and polls for the results.
+# on_result(batch, item) is called from the worker thread as each student's report finishes.
+class BatchRunner:
+    def __init__(self, scheduler, max_workers=4, keep_batches=20, poll_seconds=BATCH_POLL_SECONDS, on_result=None):
+        self.scheduler = scheduler
+        self.on_result = on_result
+        self.max_workers = max_workers
+        self.poll_seconds = poll_seconds
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="batch")
+        self.keep_batches = keep_batches
+        self._batches = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, batch_id):
+        with self._lock:
+            return self._batches.get(batch_id)
+
+    def submit(self, client, batch):
+        with self._lock:
+            self._batches[batch.batch_id] = batch
+            while len(self._batches) > self.keep_batches:
+                self._batches.popitem(last=False)
+        target = self.run_api_batch if batch.mode == "batches" else self.run_pool
+        threading.Thread(target=target, args=(client, batch), name=f"batch-{batch.batch_id}", daemon=True).start()
+        return batch
+
+    def run_pool(self, client, batch):
+        try:
+            first, rest = batch.items[:1], batch.items[1:]
+            for item in first:
+                self.generate(client, batch, item)
+            list(self.executor.map(lambda item: self.generate(client, batch, item), rest))
+        finally:
+            batch.finished = time.time()
+            logger.info("Report batch %s finished: %s", batch.batch_id, batch.counts())
+
+    # Never raises, so one failing student can't stop the pool's map over the rest
+    def generate(self, client, batch, item):
+        if batch.cancelled:
+            item.update(status="error", error="Cancelled")
+            return
+        item["started"] = time.time()
+        try:
+            self.request(client, batch, item)
+        except Exception as e:
+            logger.exception("Report for %s failed", item["student"]["full_name"])
+            item.update(status="error", error=str(e), error_class=type(e).__name__)
+        item["seconds"] = time.time() - item["started"]
+        self.report(batch, item)
+
+    def request(self, client, batch, item):
+        ticket = self.scheduler.ticket(f"batch-{batch.batch_id}", item["model"],
+                                       input_tokens=item["input_estimate"], output_tokens=item["max_tokens"])
+        def stop_if_cancelled(position, seconds):
+            if batch.cancelled:
+                raise BatchCancelled()
+
+        try:
+            while True:
+                item["status"] = "waiting"
+                try:
+                    self.scheduler.acquire(ticket, on_wait=stop_if_cancelled)
+                except BatchCancelled:
+                    item.update(status="error", error="Cancelled")
+                    return
+                # The batch may have been cancelled just as this item was admitted
+                if batch.cancelled:
+                    self.scheduler.release(ticket)
+                    item.update(status="error", error="Cancelled")
+                    return
+                item.update(status="running", admitted=time.time())
+                usage = {}
+                try:
+                    message = client.with_options(max_retries=0).messages.create(**message_params(item))
+                    usage = message.usage.model_dump()
+                    item.update(status="done", text=response_text(message), usage=usage)
+                    return
+                except Exception as e:
+                    if is_retryable(e) and self.scheduler.can_retry(ticket, e) and not batch.cancelled:
+                        self.scheduler.backoff(ticket, e)
+                        continue
+                    logger.warning("Report for %s failed: %s", item["student"]["full_name"], e)
+                    item.update(status="error", error=str(e), error_class=type(e).__name__)
+                    return
+                finally:
+                    self.scheduler.release(ticket, input_tokens=(usage.get("input_tokens") or 0)
+                                           + (usage.get("cache_creation_input_tokens") or 0),
+                                           output_tokens=usage.get("output_tokens") or 0)
+        finally:
+            item["retries"] = ticket.attempts
+
+    def report(self, batch, item):
+        if self.on_result is None:
+            return
+        try:
+            self.on_result(batch, item)
+        except Exception as e:
+            logger.warning("Report batch result callback failed: %s", e)
+
+    def run_api_batch(self, client, batch):
+        started = time.time()
+        try:
+            for item in batch.items:
+                item.update(status="waiting", started=started)
+            api_batch = client.messages.batches.create(requests=[
+                {"custom_id": f"student-{index}", "params": message_params(item)}
+                for index, item in enumerate(batch.items)])
+            batch.api_batch_id = api_batch.id
+            for item in batch.items:
+                item["status"] = "running"
+            while api_batch.processing_status != "ended":
+                if batch.cancelled and api_batch.processing_status == "in_progress":
+                    client.messages.batches.cancel(api_batch.id)
+                time.sleep(self.poll_seconds)
+                api_batch = client.messages.batches.retrieve(api_batch.id)
+                batch.api_counts = api_batch.request_counts.model_dump()
+            for response in client.messages.batches.results(api_batch.id):
+                item = batch.items[int(response.custom_id.split("-")[1])]
+                if response.result.type == "succeeded":
+                    item.update(status="done", text=response_text(response.result.message),
+                                usage=response.result.message.usage.model_dump())
+                else:
+                    error = getattr(response.result, "error", None)
+                    item.update(status="error", error=str(getattr(error, "error", None) or response.result.type),
+                                error_class=response.result.type)
+        except Exception as e:
+            logger.warning("Report batch %s failed: %s", batch.batch_id, e)
+            for item in batch.items:
+                if item["status"] != "done":
+                    item.update(status="error", error=str(e), error_class=type(e).__name__)
+        finally:
+            for item in batch.items:
+                item["seconds"] = time.time() - started
+                if item["status"] != "done" and not item["error"]:
+                    item.update(status="error", error="No result returned")
+                self.report(batch, item)
+            batch.finished = time.time()
+            logger.info("Report batch %s (Message Batches %s) finished: %s", batch.batch_id, batch.api_batch_id,
+                        batch.counts())
@@ -0,0 +1,213 @@
+import argparse
+import gc
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from importlib.metadata import version
+
+from bench.fake_api import FakeAPIConfig, FakeMessagesAPI
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+QUESTIONS = [
+    "How is Michael doing in math?",
+    "What interventions would you suggest for his computation goals?",
+    "Summarize his reading progress since January.",
+    "Draft a short note to his parents about this quarter.",
+    "Which of his scores are below the aim line?",
+]
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(APP_PATH), check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def median_ms(samples):
+    return round(statistics.median(samples) * 1000, 2) if samples else None
+
+
+# One simulated browser session driving app.py through AppTest. Polls like the browser's fragment
+# timer while a response is streaming.
+class BenchSession:
+    def __init__(self, poll_interval=0.25, timeout=60):
+        from streamlit.testing.v1 import AppTest
+        self.app = AppTest.from_file(APP_PATH, default_timeout=timeout)
+        self.app.secrets["ANTHROPIC_API_KEY"] = "bench"
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+
+    def run(self):
+        started = time.perf_counter()
+        self.app.run()
+        if self.app.exception:
+            raise RuntimeError(f"app.py raised: {self.app.exception[0].value}")
+        return time.perf_counter() - started
+
+    def wait_for_response(self):
+        deadline = time.monotonic() + self.timeout
+        polls = 0
+        while self.app.session_state["is_streaming"]:
+            if time.monotonic() > deadline:
+                raise TimeoutError("Response did not finish in time")
+            time.sleep(self.poll_interval)
+            self.run()
+            polls += 1
+        return polls
+
+    def start(self):
+        started = time.perf_counter()
+        self.run()
+        self.wait_for_response()
+        return time.perf_counter() - started
+
+    # Send one message and follow its response to the end
+    def turn(self, text):
+        self.app.text_area(key="user_input_field").input(text)
+        next(button for button in self.app.button if button.label == "Send").click()
+        started = time.perf_counter()
+        send_seconds = self.run()
+        polls = self.wait_for_response()
+        state = self.app.session_state
+        return {
+            "turn_seconds": time.perf_counter() - started,
+            "send_run_seconds": send_seconds,
+            "polls": polls,
+            "render": dict(state["last_render_stats"]) if "last_render_stats" in state else {},
+            "usage": dict(state["last_usage"]) if "last_usage" in state else {},
+            "messages": len(state["messages"]),
+            "response_chars": len(str(state["messages"][-1]["content"])),
+        }
+
+
+def traced_bytes():
+    gc.collect()
+    return tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+
+
+# Drive one conversation up to the longest length, measuring at each checkpoint length: idle rerun time,
+# turn latency, render throughput and payload sizes, plus traced memory for the session when tracemalloc
+# is on (it slows everything down, so timings and memory come from separate conversations)
+def run_conversation(server, lengths, reruns, poll_interval):
+    baseline = traced_bytes()
+    session = BenchSession(poll_interval=poll_interval)
+    greeting_seconds = session.start()
+    results = []
+    turns = []
+    for number in range(1, max(lengths) + 1):
+        requests_before = len(server.requests)
+        turn = session.turn(QUESTIONS[(number - 1) % len(QUESTIONS)])
+        streamed = [request for request in server.requests[requests_before:] if request["stream"]]
+        turn["request_bytes"] = streamed[-1]["bytes"] if streamed else None
+        turn["summary_requests"] = sum(1 for request in server.requests[requests_before:] if not request["stream"])
+        turns.append(turn)
+        if number not in lengths:
+            continue
+        rerun_samples = [session.run() for _ in range(reruns)] or [0.0]
+        window = turns[-min(len(turns), 3):]
+        render = turn["render"]
+        results.append({
+            "turns": number,
+            "messages": turn["messages"],
+            "rerun_ms": median_ms(rerun_samples),
+            "rerun_max_ms": round(max(rerun_samples) * 1000, 2),
+            "turn_ms": median_ms([entry["turn_seconds"] for entry in window]),
+            "send_run_ms": median_ms([entry["send_run_seconds"] for entry in window]),
+            "polls_per_turn": statistics.median(entry["polls"] for entry in window),
+            "render_chars": render.get("chars"),
+            "render_frames": render.get("frames"),
+            "render_ms": round(render.get("render_seconds", 0.0) * 1000, 2),
+            "render_chars_per_s": round(render["chars"] / render["render_seconds"])
+                                  if render.get("render_seconds") else None,
+            "stream_chars_per_s": round(turn["response_chars"] / turn["turn_seconds"]),
+            "browser_bytes_per_turn": render.get("bytes_sent"),
+            "api_request_bytes": turn["request_bytes"],
+            "summary_requests": turn["summary_requests"],
+            "session_memory_bytes": traced_bytes() - baseline if tracemalloc.is_tracing() else None,
+        })
+    return greeting_seconds, results
+
+
+# python -m bench.benchmark --lengths 1,5,10 --output bench.json (from the repository root)
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark app.py offline against a fake streaming Messages API")
+    parser.add_argument("--lengths", default="1,5,10", help="conversation lengths (turns) to report, comma separated")
+    parser.add_argument("--reruns", type=int, default=5, help="idle reruns timed at each length")
+    parser.add_argument("--poll-interval", type=float, default=0.25, help="seconds between polls while streaming")
+    parser.add_argument("--ttft", type=float, default=0.2)
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--chunk-tokens", type=int, default=3)
+    parser.add_argument("--output-tokens", type=int, default=300)
+    parser.add_argument("--thinking-tokens", type=int, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=529)
+    parser.add_argument("--retry-after", type=float, default=None)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--no-memory", action="store_true", help="skip the tracemalloc pass for session memory")
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    args = parser.parse_args()
+    lengths = sorted({int(length) for length in args.lengths.split(",")})
+
+    config = FakeAPIConfig(ttft=args.ttft, tokens_per_second=args.tokens_per_second, chunk_tokens=args.chunk_tokens,
+                           output_tokens=args.output_tokens, thinking_tokens=args.thinking_tokens,
+                           error_rate=args.error_rate, error_status=args.error_status,
+                           retry_after=args.retry_after, seed=args.seed)
+    server = FakeMessagesAPI(config).start()
+    # Set before app.py first runs: the pooled client and the request log are created once per process
+    os.environ["ANTHROPIC_BASE_URL"] = server.base_url
+    os.environ.setdefault("RESPONSE_CACHE", "false")
+    os.environ.setdefault("REQUEST_LOG_PATH", os.path.join(tempfile.mkdtemp(prefix="wittly-bench-"), "requests.jsonl"))
+
+    try:
+        # The first session pays for imports and process-wide caches; measure that separately
+        cold_started = time.perf_counter()
+        BenchSession(poll_interval=args.poll_interval).start()
+        cold_seconds = time.perf_counter() - cold_started
+        greeting_seconds, results = run_conversation(server, lengths, args.reruns, args.poll_interval)
+        if not args.no_memory:
+            tracemalloc.start()
+            try:
+                _, memory_results = run_conversation(server, lengths, 0, args.poll_interval)
+            finally:
+                tracemalloc.stop()
+            for result, memory_result in zip(results, memory_results):
+                result["session_memory_bytes"] = memory_result["session_memory_bytes"]
+    finally:
+        server.stop()
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "streamlit": version("streamlit"),
+            "anthropic": version("anthropic"),
+            "fake_api": config.as_dict(),
+            "poll_interval": args.poll_interval,
+        },
+        "cold_start_ms": round(cold_seconds * 1000, 2),
+        "greeting_ms": round(greeting_seconds * 1000, 2),
+        "results": results,
+        "api": {"requests": len(server.requests), **server.counters},
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,297 @@
+import argparse
+import json
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Roughly four characters per token, as in prompt_builder.estimate_tokens
+CHARS_PER_TOKEN = 4
+
+FILLER = ("Michael's reading fluency is up four words correct per minute since January, "
+          "but his math computation scores are still below the aim line. ")
+
+
+def filler_text(tokens, phrase=FILLER):
+    length = tokens * CHARS_PER_TOKEN
+    return (phrase * (length // len(phrase) + 1))[:length]
+
+
+# How the fake endpoint behaves. Times are seconds; error_rate is the chance that a request fails
+# with error_status before any output is streamed.
+class FakeAPIConfig:
+    def __init__(self, ttft=0.3, tokens_per_second=80.0, chunk_tokens=3, output_tokens=300,
+                 thinking_tokens=0, error_rate=0.0, error_status=529, retry_after=None,
+                 input_tokens=100, cache_read_tokens=3000, seed=None):
+        self.ttft = ttft
+        self.tokens_per_second = tokens_per_second
+        self.chunk_tokens = chunk_tokens
+        self.output_tokens = output_tokens
+        self.thinking_tokens = thinking_tokens
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.retry_after = retry_after
+        self.input_tokens = input_tokens
+        self.cache_read_tokens = cache_read_tokens
+        self.random = random.Random(seed)
+
+    def as_dict(self):
+        return {name: value for name, value in vars(self).items() if name != "random"}
+
+
+class FakeMessagesHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        path = self.path.split("?")[0]
+        if path.startswith("/v1/messages/batches/"):
+            batch_id, _, rest = path[len("/v1/messages/batches/"):].partition("/")
+            batch = self.server.batches.get(batch_id)
+            if batch is None:
+                self.send_json(404, {"type": "error", "error": {"type": "not_found_error", "message": "No such batch"}})
+            elif rest == "results":
+                self.send_jsonl(batch.results())
+            else:
+                self.send_json(200, batch.as_dict(self.server.base_url))
+            return
+        # Connection warm-up probes: any response keeps the connection open
+        self.send_json(404, {"type": "error", "error": {"type": "not_found_error", "message": "Not found"}})
+
+    def do_POST(self):
+        raw = self.rfile.read(int(self.headers.get("content-length", 0)))
+        body = json.loads(raw or b"{}")
+        server = self.server
+        config = server.config
+
+        if self.path.split("?")[0] == "/v1/messages/batches":
+            batch = server.create_batch(body["requests"])
+            self.send_json(200, batch.as_dict(server.base_url))
+            return
+        server.record(self.path, len(raw), body)
+
+        if config.error_rate and config.random.random() < config.error_rate:
+            error_type = {429: "rate_limit_error", 529: "overloaded_error"}.get(config.error_status, "api_error")
+            headers = {"retry-after": str(config.retry_after)} if config.retry_after is not None else {}
+            server.count("errors")
+            self.send_json(config.error_status, {"type": "error", "error": {"type": error_type, "message": "Injected"}},
+                           headers)
+            return
+
+        if self.path.endswith("/count_tokens"):
+            self.send_json(200, {"input_tokens": config.input_tokens})
+            return
+
+        text = filler_text(config.output_tokens)
+        usage = {"input_tokens": config.input_tokens, "output_tokens": 1,
+                 "cache_read_input_tokens": config.cache_read_tokens, "cache_creation_input_tokens": 0}
+        message = {"id": f"msg_{uuid.uuid4().hex[:24]}", "type": "message", "role": "assistant",
+                   "model": body.get("model"), "content": [], "stop_reason": None, "stop_sequence": None,
+                   "usage": usage}
+
+        if not body.get("stream"):
+            time.sleep(config.ttft)
+            summary = text[:min(len(text), body.get("max_tokens", 1024) * CHARS_PER_TOKEN)]
+            self.send_json(200, dict(message, content=[{"type": "text", "text": summary}], stop_reason="end_turn",
+                                     usage=dict(usage, output_tokens=len(summary) // CHARS_PER_TOKEN)))
+            return
+
+        self.send_response(200)
+        self.send_header("content-type", "text/event-stream")
+        self.send_header("transfer-encoding", "chunked")
+        self.end_headers()
+        try:
+            self.send_event("message_start", {"type": "message_start", "message": message})
+            time.sleep(config.ttft)
+            index = 0
+            if config.thinking_tokens and body.get("thinking"):
+                self.stream_block(index, "thinking", filler_text(config.thinking_tokens, "Checking the scores. "), config)
+                index += 1
+            self.stream_block(index, "text", text, config)
+            self.send_event("message_delta", {"type": "message_delta",
+                                              "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                                              "usage": {"output_tokens": config.output_tokens + config.thinking_tokens}})
+            self.send_event("message_stop", {"type": "message_stop"})
+            self.wfile.write(b"0\r\n\r\n")
+            self.wfile.flush()
+            server.count("completed")
+        except (BrokenPipeError, ConnectionResetError):
+            # The client closed the stream (e.g. the Stop button)
+            server.count("disconnected")
+
+    def stream_block(self, index, block_type, text, config):
+        delta_type, field = ("thinking_delta", "thinking") if block_type == "thinking" else ("text_delta", "text")
+        start = {"type": "thinking", "thinking": "", "signature": ""} if block_type == "thinking" else {"type": "text", "text": ""}
+        self.send_event("content_block_start", {"type": "content_block_start", "index": index, "content_block": start})
+        chunk_chars = max(1, config.chunk_tokens * CHARS_PER_TOKEN)
+        delay = config.chunk_tokens / config.tokens_per_second if config.tokens_per_second else 0.0
+        for position in range(0, len(text), chunk_chars):
+            self.send_event("content_block_delta", {"type": "content_block_delta", "index": index,
+                                                    "delta": {"type": delta_type, field: text[position:position + chunk_chars]}})
+            time.sleep(delay)
+        self.send_event("content_block_stop", {"type": "content_block_stop", "index": index})
+
+    def send_event(self, name, data):
+        chunk = f"event: {name}\ndata: {json.dumps(data)}\n\n".encode()
+        self.wfile.write(b"%x\r\n%s\r\n" % (len(chunk), chunk))
+        self.wfile.flush()
+
+    def send_jsonl(self, lines):
+        payload = "".join(json.dumps(line) + "\n" for line in lines).encode()
+        self.send_response(200)
+        self.send_header("content-type", "application/binary")
+        self.send_header("content-length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_json(self, status, data, headers=None):
+        payload = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+
+def timestamp(seconds):
+    return datetime.fromtimestamp(seconds, timezone.utc).isoformat().replace("+00:00", "Z") if seconds else None
+
+
+# A Message Batch being worked through by the fake server: each request takes as long as a streamed
+# response would, `concurrency` at a time, and fails with error_rate like the streaming endpoint
+class FakeBatch:
+    def __init__(self, server, requests, concurrency=4):
+        self.id = f"msgbatch_{uuid.uuid4().hex[:24]}"
+        self.created = time.time()
+        self.ended = None
+        self.requests = requests
+        self._results = {}
+        self._lock = threading.Lock()
+        self._server = server
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+        threading.Thread(target=self.process, daemon=True).start()
+
+    def process(self):
+        list(self._executor.map(self.answer, self.requests))
+        self._executor.shutdown()
+        self.ended = time.time()
+
+    def answer(self, request):
+        config = self._server.config
+        params = request["params"]
+        self._server.record("/v1/messages/batches", len(json.dumps(params)), params)
+        output_tokens = min(config.output_tokens, params.get("max_tokens", config.output_tokens))
+        time.sleep(config.ttft + (output_tokens / config.tokens_per_second if config.tokens_per_second else 0.0))
+        if config.error_rate and config.random.random() < config.error_rate:
+            result = {"type": "errored", "error": {"type": "error", "error": {"type": "api_error", "message": "Injected"}}}
+        else:
+            result = {"type": "succeeded", "message": {
+                "id": f"msg_{uuid.uuid4().hex[:24]}", "type": "message", "role": "assistant", "model": params.get("model"),
+                "content": [{"type": "text", "text": filler_text(output_tokens)}], "stop_reason": "end_turn",
+                "stop_sequence": None,
+                "usage": {"input_tokens": config.input_tokens, "output_tokens": output_tokens,
+                          "cache_read_input_tokens": config.cache_read_tokens, "cache_creation_input_tokens": 0}}}
+        with self._lock:
+            self._results[request["custom_id"]] = result
+
+    def results(self):
+        with self._lock:
+            return [{"custom_id": custom_id, "result": result} for custom_id, result in self._results.items()]
+
+    def as_dict(self, base_url):
+        with self._lock:
+            succeeded = sum(1 for result in self._results.values() if result["type"] == "succeeded")
+            errored = len(self._results) - succeeded
+        ended = self.ended is not None
+        return {
+            "id": self.id, "type": "message_batch",
+            "processing_status": "ended" if ended else "in_progress",
+            # Like the real API, per-request outcomes are only reported once the whole batch has ended
+            "request_counts": {"processing": 0 if ended else len(self.requests), "succeeded": succeeded if ended else 0,
+                               "errored": errored if ended else 0, "canceled": 0, "expired": 0},
+            "created_at": timestamp(self.created), "ended_at": timestamp(self.ended),
+            "expires_at": timestamp(self.created + 86400), "archived_at": None, "cancel_initiated_at": None,
+            "results_url": f"{base_url}/v1/messages/batches/{self.id}/results" if ended else None,
+        }
+
+
+# A local stand-in for the Messages API (POST /v1/messages, streaming or not, and the Message Batches
+# endpoints), serving on a background thread. Point the app at it with ANTHROPIC_BASE_URL=server.base_url.
+# It records the size of every request body.
+class FakeMessagesAPI(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, config=None, host="127.0.0.1", port=0):
+        super().__init__((host, port), FakeMessagesHandler)
+        self.config = config or FakeAPIConfig()
+        self.requests = []
+        self.batches = {}
+        self.counters = {"completed": 0, "errors": 0, "disconnected": 0}
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def record(self, path, size, body):
+        with self._lock:
+            messages = body.get("messages", [])
+            self.requests.append({"path": path, "bytes": size, "stream": bool(body.get("stream")),
+                                  "messages": len(messages),
+                                  "images": sum(1 for message in messages if isinstance(message["content"], list)
+                                                for block in message["content"] if block.get("type") == "image")})
+
+    def create_batch(self, requests):
+        batch = FakeBatch(self, requests)
+        with self._lock:
+            self.batches[batch.id] = batch
+        return batch
+
+    def count(self, name):
+        with self._lock:
+            self.counters[name] += 1
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-messages-api", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve a fake streaming Anthropic Messages API for local testing")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--ttft", type=float, default=0.3, help="seconds before the first token")
+    parser.add_argument("--tokens-per-second", type=float, default=80.0)
+    parser.add_argument("--chunk-tokens", type=int, default=3, help="tokens per content_block_delta")
+    parser.add_argument("--output-tokens", type=int, default=300)
+    parser.add_argument("--thinking-tokens", type=int, default=0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=529)
+    parser.add_argument("--retry-after", type=float, default=None)
+    args = parser.parse_args()
+    config = FakeAPIConfig(ttft=args.ttft, tokens_per_second=args.tokens_per_second, chunk_tokens=args.chunk_tokens,
+                           output_tokens=args.output_tokens, thinking_tokens=args.thinking_tokens,
+                           error_rate=args.error_rate, error_status=args.error_status, retry_after=args.retry_after)
+    server = FakeMessagesAPI(config, port=args.port)
+    print(f"Fake Messages API on {server.base_url} (set ANTHROPIC_BASE_URL to use it)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,444 @@
+import argparse
+import asyncio
+import io
+import json
+import os
+import platform
+import random
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from datetime import datetime, timezone
+from importlib.metadata import version
+
+import requests
+import websockets
+from PIL import Image
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+
+from bench.benchmark import APP_PATH, QUESTIONS, git_commit
+from bench.fake_api import FakeAPIConfig, FakeMessagesAPI
+
+DATA_TABS = ["Details", "Screener", "Progress", "Observations", "Portfolio"]
+
+# Rerun kinds: "load" is the first page run, "full" a whole-page rerun, "fragment" a rerun of one fragment
+# after a widget change, and "auto" the live response fragment polling on its timer while a response streams
+USER_RERUNS = ("load", "full", "fragment")
+
+CLOCK_TICKS = os.sysconf("SC_CLK_TCK") if hasattr(os, "sysconf") else 100
+
+
+def percentiles(samples, scale=1000.0):
+    if not samples:
+        return {"count": 0}
+    ordered = sorted(samples)
+    pick = lambda fraction: ordered[min(len(ordered) - 1, int(fraction * len(ordered)))] * scale
+    return {"count": len(ordered), "p50": round(pick(0.5), 1), "p90": round(pick(0.9), 1),
+            "p99": round(pick(0.99), 1), "max": round(ordered[-1] * scale, 1)}
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+# CPU seconds and resident memory of the server process, from /proc (Linux)
+def process_usage(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/status") as f:
+            rss_kb = next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+    except (OSError, StopIteration):
+        return None, None
+    return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS, rss_kb * 1024
+
+
+def sample_image(width=2400, height=1800):
+    image = Image.new("RGB", (width, height))
+    image.putdata([(x * 255 // width, y * 255 // height, 128) for y in range(height) for x in range(width)])
+    output = io.BytesIO()
+    image.save(output, format="JPEG", quality=92)
+    return output.getvalue()
+
+
+# Everything one load level measured, across its sessions
+class LevelStats:
+    def __init__(self):
+        self.reruns = {}
+        self.responses = []
+        self.messages = 0
+        self.bytes = 0
+        self.errors = []
+
+    def record(self, kind, seconds):
+        self.reruns.setdefault(kind, []).append(seconds)
+
+
+# One simulated browser tab, speaking Streamlit's websocket protocol: BackMsg rerun requests out,
+# ForwardMsg deltas in. It keeps widget state like the frontend does and runs fragment auto-rerun timers.
+class LoadSession:
+    def __init__(self, base_url, stats, timeout=120.0):
+        self.base_url = base_url
+        self.stats = stats
+        self.timeout = timeout
+        self.socket = None
+        self.session_id = None
+        self.query_string = ""
+        # key (or label for unkeyed widgets) -> (widget id, fragment id)
+        self.widgets = {}
+        self.widget_states = {}
+        self.auto_reruns = {}
+        self.pending = None
+        self.idle = asyncio.Event()
+        self.idle.set()
+        self.file_urls = {}
+        self.reader = None
+
+    async def connect(self):
+        url = self.base_url.replace("http", "ws", 1) + "/_stcore/stream"
+        self.socket = await websockets.connect(url, subprotocols=["streamlit"], max_size=None,
+                                               additional_headers={"Origin": self.base_url})
+        self.reader = asyncio.create_task(self.read())
+        await self.rerun(kind="load")
+
+    async def close(self):
+        for timer in self.auto_reruns.values():
+            timer.cancel()
+        if self.socket is not None:
+            await self.socket.close()
+        if self.reader is not None:
+            self.reader.cancel()
+
+    async def read(self):
+        async for data in self.socket:
+            self.stats.messages += 1
+            self.stats.bytes += len(data)
+            message = ForwardMsg()
+            message.ParseFromString(data)
+            self.handle(message)
+
+    def handle(self, message):
+        kind = message.WhichOneof("type")
+        if kind == "new_session":
+            self.session_id = message.new_session.initialize.session_id or self.session_id
+            # A full run starts: the frontend drops fragment timers, the run re-registers the live ones
+            if not message.new_session.fragment_ids_this_run:
+                for timer in self.auto_reruns.values():
+                    timer.cancel()
+                self.auto_reruns = {}
+        elif kind == "page_info_changed":
+            self.query_string = message.page_info_changed.query_string
+        elif kind == "delta":
+            self.register_widget(message.delta, message.delta.fragment_id)
+        elif kind == "auto_rerun":
+            fragment_id = message.auto_rerun.fragment_id
+            if fragment_id not in self.auto_reruns:
+                self.auto_reruns[fragment_id] = asyncio.create_task(
+                    self.auto_rerun(fragment_id, message.auto_rerun.interval))
+        elif kind == "stop_auto_rerun":
+            for fragment_id in message.stop_auto_rerun.fragment_ids:
+                timer = self.auto_reruns.pop(fragment_id, None)
+                if timer is not None:
+                    timer.cancel()
+        elif kind == "file_urls_response":
+            future = self.file_urls.pop(message.file_urls_response.response_id, None)
+            if future is not None and not future.done():
+                future.set_result(message.file_urls_response)
+        elif kind == "script_finished":
+            if message.script_finished == ForwardMsg.FINISHED_EARLY_FOR_RERUN:
+                return
+            if self.pending is not None:
+                rerun_kind, started = self.pending
+                self.stats.record(rerun_kind, time.perf_counter() - started)
+                self.pending = None
+            self.idle.set()
+
+    def register_widget(self, delta, fragment_id):
+        widget_id = None
+        label = None
+        if delta.WhichOneof("type") == "new_element":
+            element = delta.new_element
+            proto = getattr(element, element.WhichOneof("type") or "", None)
+            widget_id = getattr(proto, "id", None)
+            label = getattr(proto, "label", None)
+        elif delta.WhichOneof("type") == "add_block" and delta.add_block.WhichOneof("type") == "tab_container":
+            widget_id = delta.add_block.tab_container.id
+        if not widget_id:
+            return
+        # Widget ids look like "$$ID-<hash>-<user key or None>"
+        key = widget_id.split("-", 2)[-1]
+        self.widgets[label if key == "None" else key] = (widget_id, fragment_id)
+
+    async def rerun(self, kind="full", fragment_id="", changes=(), is_auto_rerun=False):
+        await asyncio.wait_for(self.idle.wait(), self.timeout)
+        message = BackMsg()
+        state = message.rerun_script
+        state.query_string = self.query_string
+        state.fragment_id = fragment_id
+        state.is_auto_rerun = is_auto_rerun
+        for widget in list(self.widget_states.values()) + list(changes):
+            state.widget_states.widgets.add().CopyFrom(widget)
+        self.idle.clear()
+        self.pending = (kind, time.perf_counter())
+        await self.socket.send(message.SerializeToString())
+
+    async def auto_rerun(self, fragment_id, interval):
+        while True:
+            await asyncio.sleep(interval)
+            # Like the browser, skip a tick while a run is still in flight
+            if self.idle.is_set():
+                await self.rerun(kind="auto", fragment_id=fragment_id, is_auto_rerun=True)
+
+    async def wait_until_idle(self):
+        await asyncio.wait_for(self.idle.wait(), self.timeout)
+
+    # A response is finished once no run is in flight and no fragment is polling for it
+    async def wait_for_response(self):
+        deadline = time.monotonic() + self.timeout
+        while not self.idle.is_set() or self.auto_reruns:
+            if time.monotonic() > deadline:
+                raise TimeoutError("Response did not finish in time")
+            await asyncio.sleep(0.05)
+
+    def widget(self, name):
+        if name not in self.widgets:
+            raise KeyError(f"Widget {name!r} not found; seen: {sorted(self.widgets)}")
+        return self.widgets[name]
+
+    async def upload(self, name, data, media_type):
+        request_id = uuid.uuid4().hex
+        future = asyncio.get_running_loop().create_future()
+        self.file_urls[request_id] = future
+        message = BackMsg()
+        message.file_urls_request.request_id = request_id
+        message.file_urls_request.file_names.append(name)
+        message.file_urls_request.session_id = self.session_id
+        await self.socket.send(message.SerializeToString())
+        file_urls = (await asyncio.wait_for(future, self.timeout)).file_urls[0]
+        upload_url = file_urls.upload_url if file_urls.upload_url.startswith("http") \
+            else self.base_url + file_urls.upload_url
+        response = await asyncio.to_thread(requests.put, upload_url, files={"file": (name, data, media_type)},
+                                           timeout=self.timeout)
+        response.raise_for_status()
+        return file_urls
+
+    async def send_message(self, text, image=None):
+        await self.wait_until_idle()
+        input_id, fragment_id = self.widget("user_input_field")
+        submit_id, _ = self.widget("FormSubmitter:message_form-Send")
+        changes = [self.state(input_id, string_value=text), self.state(submit_id, trigger_value=True)]
+        if image is not None:
+            uploader_id, _ = self.widget("chat_image_upload")
+            file_urls = await self.upload("worksheet.jpg", image, "image/jpeg")
+            uploader = self.state(uploader_id)
+            info = uploader.file_uploader_state_value.uploaded_file_info.add()
+            info.file_id = file_urls.file_id
+            info.name = "worksheet.jpg"
+            info.size = len(image)
+            info.file_urls.CopyFrom(file_urls)
+            changes.append(uploader)
+        started = time.perf_counter()
+        await self.rerun(kind="fragment", fragment_id=fragment_id, changes=changes)
+        await self.wait_for_response()
+        self.stats.responses.append(time.perf_counter() - started)
+
+    async def switch_tab(self, label):
+        await self.wait_until_idle()
+        tabs_id, fragment_id = self.widget("data_tab")
+        tab_state = self.state(tabs_id, string_value=label)
+        self.widget_states[tabs_id] = tab_state
+        await self.rerun(kind="fragment", fragment_id=fragment_id)
+
+    @staticmethod
+    def state(widget_id, **value):
+        widget_state = WidgetState(id=widget_id)
+        for field, field_value in value.items():
+            setattr(widget_state, field, field_value)
+        return widget_state
+
+
+# A teacher's visit: open the page and read the greeting, then alternate between looking at the
+# student's data tabs and chatting, with one turn sending a photo of a worksheet
+async def teacher_script(base_url, stats, turns, think_time, image, seed):
+    rng = random.Random(seed)
+    session = LoadSession(base_url, stats)
+    try:
+        started = time.perf_counter()
+        await session.connect()
+        await session.wait_for_response()
+        stats.responses.append(time.perf_counter() - started)
+        image_turn = turns // 2 if image is not None else None
+        for turn in range(turns):
+            await asyncio.sleep(rng.uniform(0.5, 1.5) * think_time)
+            await session.switch_tab(rng.choice(DATA_TABS))
+            await asyncio.sleep(rng.uniform(0.5, 1.5) * think_time)
+            await session.send_message(QUESTIONS[turn % len(QUESTIONS)], image=image if turn == image_turn else None)
+    except Exception as e:
+        stats.errors.append(f"{type(e).__name__}: {e}")
+    finally:
+        await session.close()
+
+
+async def run_level(base_url, pid, sessions, turns, think_time, ramp, image, seed):
+    stats = LevelStats()
+    cpu_before, rss_before = process_usage(pid)
+    peak_rss = rss_before or 0
+    started = time.perf_counter()
+
+    async def staggered(index):
+        await asyncio.sleep(ramp * index / max(1, sessions))
+        await teacher_script(base_url, stats, turns, think_time, image, seed + index)
+
+    tasks = asyncio.gather(*(staggered(index) for index in range(sessions)))
+    while not tasks.done():
+        await asyncio.wait([tasks], timeout=0.5)
+        peak_rss = max(peak_rss, process_usage(pid)[1] or 0)
+    elapsed = time.perf_counter() - started
+    cpu_after, rss_after = process_usage(pid)
+
+    user_reruns = [seconds for kind in USER_RERUNS for seconds in stats.reruns.get(kind, [])]
+    cpu_seconds = (cpu_after - cpu_before) if cpu_before is not None and cpu_after is not None else None
+    return {
+        "sessions": sessions,
+        "duration_s": round(elapsed, 2),
+        "rerun_ms": {kind: percentiles(samples) for kind, samples in sorted(stats.reruns.items())},
+        "user_rerun_ms": percentiles(user_reruns),
+        "response_s": percentiles(stats.responses, scale=1.0),
+        "ws_messages_per_s_per_session": round(stats.messages / elapsed / sessions, 1),
+        "ws_kb_per_s_per_session": round(stats.bytes / 1024 / elapsed / sessions, 1),
+        "cpu_cores": round(cpu_seconds / elapsed, 3) if cpu_seconds is not None else None,
+        "cpu_seconds_per_session": round(cpu_seconds / sessions, 3) if cpu_seconds is not None else None,
+        "rss_mb": round((rss_after or 0) / 2 ** 20, 1),
+        "peak_rss_growth_mb_per_session": round((peak_rss - (rss_before or 0)) / 2 ** 20 / sessions, 2),
+        "errors": len(stats.errors),
+        "error_samples": stats.errors[:5],
+    }
+
+
+# The first level that breaks the latency objective, pegs a core (one process runs Python on one core
+# at a time) or starts failing sessions
+def find_saturation(levels, slo_ms, cpu_limit):
+    for level in levels:
+        reasons = []
+        if level["user_rerun_ms"].get("p90", 0) > slo_ms:
+            reasons.append(f"p90 rerun latency {level['user_rerun_ms']['p90']:.0f} ms > {slo_ms:.0f} ms")
+        if level["cpu_cores"] is not None and level["cpu_cores"] >= cpu_limit:
+            reasons.append(f"CPU at {level['cpu_cores']:.2f} cores")
+        if level["errors"]:
+            reasons.append(f"{level['errors']} sessions failed")
+        if reasons:
+            return {"sessions": level["sessions"], "reasons": reasons}
+    return None
+
+
+def start_server(port, api_base_url, workdir):
+    secrets_path = os.path.join(workdir, "secrets.toml")
+    with open(secrets_path, "w") as f:
+        f.write('ANTHROPIC_API_KEY = "load-test"\n')
+    env = dict(os.environ, ANTHROPIC_BASE_URL=api_base_url,
+               REQUEST_LOG_PATH=os.environ.get("REQUEST_LOG_PATH", os.path.join(workdir, "requests.jsonl")))
+    command = [sys.executable, "-m", "streamlit", "run", APP_PATH, "--server.headless", "true",
+               "--server.port", str(port), "--server.address", "127.0.0.1", "--server.fileWatcherType", "none",
+               "--server.enableXsrfProtection", "false", "--browser.gatherUsageStats", "false",
+               "--secrets.files", secrets_path]
+    log = open(os.path.join(workdir, "server.log"), "w")
+    server = subprocess.Popen(command, cwd=os.path.dirname(APP_PATH), env=env, stdout=log, stderr=subprocess.STDOUT)
+    base_url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"streamlit exited; see {log.name}")
+        try:
+            if requests.get(base_url + "/_stcore/health", timeout=1).ok:
+                return server, base_url
+        except requests.RequestException:
+            time.sleep(0.25)
+    server.kill()
+    raise RuntimeError("streamlit did not become healthy in 60s")
+
+
+# python -m bench.load_test --sessions 1,2,4,8,16 --output load.json (from the repository root)
+def main():
+    parser = argparse.ArgumentParser(description="Find how many concurrent sessions one app.py process can serve")
+    parser.add_argument("--sessions", default="1,2,4,8,16", help="concurrent sessions per level, comma separated")
+    parser.add_argument("--turns", type=int, default=3, help="chat turns per session after the greeting")
+    parser.add_argument("--think-time", type=float, default=2.0, help="mean seconds between a session's actions")
+    parser.add_argument("--ramp", type=float, default=5.0, help="seconds over which a level's sessions start")
+    parser.add_argument("--no-image", action="store_true", help="skip the image upload turn")
+    parser.add_argument("--slo-ms", type=float, default=1000.0, help="p90 rerun latency that counts as saturated")
+    parser.add_argument("--cpu-limit", type=float, default=0.9, help="CPU cores that count as saturated")
+    parser.add_argument("--stop-at-saturation", action="store_true", help="skip the levels after the first saturated one")
+    parser.add_argument("--ttft", type=float, default=0.5)
+    parser.add_argument("--tokens-per-second", type=float, default=80.0)
+    parser.add_argument("--output-tokens", type=int, default=300)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--port", type=int, default=0, help="port for the streamlit server (default: any free port)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="write the JSON results here instead of stdout")
+    args = parser.parse_args()
+    levels = sorted({int(count) for count in args.sessions.split(",")})
+
+    config = FakeAPIConfig(ttft=args.ttft, tokens_per_second=args.tokens_per_second, output_tokens=args.output_tokens,
+                           error_rate=args.error_rate, seed=args.seed)
+    api = FakeMessagesAPI(config).start()
+    workdir = tempfile.mkdtemp(prefix="wittly-load-")
+    server, base_url = start_server(args.port or free_port(), api.base_url, workdir)
+    image = None if args.no_image else sample_image()
+    results = []
+    try:
+        _, rss_idle = process_usage(server.pid)
+        # The first session pays for imports and process-wide caches; keep that out of the levels
+        warm_up = asyncio.run(run_level(base_url, server.pid, 1, 0, 0.0, 0.0, None, args.seed))
+        for sessions in levels:
+            level = asyncio.run(run_level(base_url, server.pid, sessions, args.turns, args.think_time, args.ramp,
+                                          image, args.seed * 1000 + sessions))
+            results.append(level)
+            print(f"{sessions} sessions: p90 rerun {level['user_rerun_ms'].get('p90')} ms, "
+                  f"CPU {level['cpu_cores']} cores, {level['errors']} errors", file=sys.stderr)
+            if args.stop_at_saturation and find_saturation([level], args.slo_ms, args.cpu_limit):
+                break
+    finally:
+        server.terminate()
+        server.wait(timeout=30)
+        api.stop()
+
+    report = {
+        "meta": {
+            "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "commit": git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "streamlit": version("streamlit"),
+            "anthropic": version("anthropic"),
+            "fake_api": config.as_dict(),
+            "turns": args.turns,
+            "think_time": args.think_time,
+            "image": image is not None,
+            "server_log": os.path.join(workdir, "server.log"),
+        },
+        "idle_rss_mb": round((rss_idle or 0) / 2 ** 20, 1),
+        "cold_load_ms": warm_up["rerun_ms"].get("load", {}).get("max"),
+        "warm_rss_mb": warm_up["rss_mb"],
+        "levels": results,
+        "saturation": find_saturation(results, args.slo_ms, args.cpu_limit),
+        "api": {"requests": len(api.requests), "with_images": sum(1 for request in api.requests if request["images"]),
+                **api.counters},
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import anthropic
+
+logger = logging.getLogger(__name__)
+
+# The SDK's Limits class, whichever httpx flavour this SDK version is built on
+Limits = type(anthropic.DEFAULT_CONNECTION_LIMITS)
+
+
+def key_fingerprint(api_key):
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()[:12]
+
+
+# One Anthropic client (and so one keep-alive connection pool) per API key for the whole process,
+# instead of one per browser session. The registry keeps the httpx client it passes in as http_client=,
+# so warm-up and stats use that rather than the SDK's internals. Clients dropped from the registry are
+# closed once none of their connections are in use, so a response still streaming on one can finish.
+class ClientRegistry:
+    def __init__(self, max_connections=100, max_keepalive_connections=20, keepalive_expiry=60.0,
+                 connect_timeout=5.0, read_timeout=600.0, max_retries=2, max_clients=50):
+        self.limits = Limits(max_connections=max_connections,
+                             max_keepalive_connections=max_keepalive_connections,
+                             keepalive_expiry=keepalive_expiry)
+        self.timeout = anthropic.Timeout(read_timeout, connect=connect_timeout)
+        self.max_retries = max_retries
+        self.max_clients = max_clients
+        # fingerprint -> (client, http_client)
+        self._clients = OrderedDict()
+        # Evicted (client, http_client) pairs waiting for their requests to finish before closing
+        self._retired = []
+        self._lock = threading.Lock()
+
+    def get(self, api_key):
+        fingerprint = key_fingerprint(api_key)
+        self.close_retired()
+        with self._lock:
+            entry = self._clients.get(fingerprint)
+            if entry is not None:
+                self._clients.move_to_end(fingerprint)
+                return entry[0]
+            http_client = anthropic.DefaultHttpxClient(limits=self.limits, timeout=self.timeout)
+            client = anthropic.Anthropic(
+                api_key=api_key,
+                timeout=self.timeout,
+                max_retries=self.max_retries,
+                http_client=http_client,
+            )
+            self._clients[fingerprint] = (client, http_client)
+            # Least recently used keys are dropped; sessions pick up a new client on their next run
+            while len(self._clients) > self.max_clients:
+                self._retired.append(self._clients.popitem(last=False)[1])
+            return client
+
+    def http_client(self, api_key):
+        with self._lock:
+            entry = self._clients.get(key_fingerprint(api_key))
+        return entry[1] if entry else None
+
+    def close_retired(self):
+        with self._lock:
+            retired, self._retired = self._retired, []
+        for client, http_client in retired:
+            if connection_counts(http_client)[1]:
+                with self._lock:
+                    self._retired.append((client, http_client))
+                continue
+            try:
+                client.close()
+            except Exception as e:
+                logger.warning("Closing an evicted client failed: %s", e)
+
+    # Open `connections` keep-alive connections (DNS, TCP and TLS) before the first real request.
+    # Any response counts, so an unauthenticated GET of the API root is enough.
+    def warm_up(self, api_key, connections=2):
+        client = self.get(api_key)
+        http_client = self.http_client(api_key)
+
+        def connect(_):
+            try:
+                http_client.get(str(client.base_url), timeout=self.timeout.connect)
+                return True
+            except Exception as e:
+                logger.warning("Connection warm-up failed: %s", e)
+                return False
+
+        with ThreadPoolExecutor(max_workers=connections) as executor:
+            opened = sum(executor.map(connect, range(connections)))
+        logger.info("Warmed up %d connection(s) for key %s", opened, key_fingerprint(api_key))
+        return opened
+
+    def warm_up_async(self, api_key, connections=2):
+        threading.Thread(target=self.warm_up, args=(api_key, connections), name="client-warm-up", daemon=True).start()
+
+    # Connections per client: open, in use and idle, against the pool limit
+    def stats(self):
+        self.close_retired()
+        with self._lock:
+            clients = [(fingerprint, entry[1]) for fingerprint, entry in self._clients.items()]
+        report = []
+        for fingerprint, http_client in clients:
+            open_connections, in_use = connection_counts(http_client)
+            report.append({
+                "key": fingerprint,
+                "open": open_connections,
+                "in_use": in_use,
+                "idle": open_connections - in_use,
+                "max": self.limits.max_connections,
+            })
+        return report
+
+
+# (open, in use) connections of an httpx client. Reads the transport's pool, which httpx doesn't
+# make public, so missing attributes just report zeros.
+def connection_counts(http_client):
+    pool = getattr(getattr(http_client, "_transport", None), "_pool", None)
+    connections = list(getattr(pool, "connections", []))
+    return len(connections), sum(1 for connection in connections if not connection.is_idle())
+
+
+def format_pool_stats(stats):
+    open_connections = sum(entry["open"] for entry in stats)
+    in_use = sum(entry["in_use"] for entry in stats)
+    limit = sum(entry["max"] for entry in stats)
+    return (f"Connection pool: {open_connections} open, {in_use} in use"
+            f" / {limit} max across {len(stats)} client{'s' if len(stats) != 1 else ''}")
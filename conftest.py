@@ -0,0 +1 @@
+# Lets the tests under tests/ import the app's flat modules
@@ -0,0 +1,220 @@
+import base64
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from history import message_tokens
+from student_store import DATA_DIR
+
+CONVERSATIONS_PATH = os.path.join(DATA_DIR, "conversations.db")
+BLOB_DIR = os.path.join(DATA_DIR, "blobs")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversations (
+    conversation_id TEXT PRIMARY KEY,
+    owner TEXT, student TEXT, title TEXT,
+    created REAL, updated REAL, message_count INTEGER DEFAULT 0
+);
+
+-- Append-only: rows are never updated or deleted
+CREATE TABLE IF NOT EXISTS messages (
+    conversation_id TEXT, seq INTEGER, role TEXT, content TEXT, created REAL,
+    PRIMARY KEY (conversation_id, seq)
+);
+"""
+
+OWNER_INDEXES = """
+CREATE INDEX IF NOT EXISTS idx_conversations_owner ON conversations (owner, updated);
+CREATE INDEX IF NOT EXISTS idx_conversations_owner_student ON conversations (owner, student, updated);
+"""
+
+TITLE_CHARS = 80
+
+
+def message_title(message):
+    content = message["content"]
+    if isinstance(content, list):
+        content = " ".join(block["text"] for block in content if block["type"] == "text")
+    content = " ".join(content.split())
+    return content[:TITLE_CHARS - 1] + "…" if len(content) > TITLE_CHARS else content
+
+
+# Conversations persisted in SQLite under .wittly/, indexed per owner (the identity of whoever started
+# them, see app.session_owner) and per student.
+# Images are stored once as content-addressed blobs; messages hold {"type": "blob", "blob_id": ...} image
+# sources instead of base64 data, which is only read back for the images actually sent to the API.
+class ConversationStore:
+    def __init__(self, db_path=CONVERSATIONS_PATH, blob_dir=BLOB_DIR, hidden_messages=()):
+        self.db_path = db_path
+        self.blob_dir = blob_dir
+        # App-generated user messages (e.g. the greeting prompt) that shouldn't become a conversation's title
+        self.hidden_messages = set(hidden_messages)
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        os.makedirs(blob_dir, exist_ok=True)
+        with self.connect() as conn:
+            conn.executescript(SCHEMA)
+            # Conversations stored before they had owners belong to no one and are never listed or opened
+            if "owner" not in {row[1] for row in conn.execute("PRAGMA table_info(conversations)")}:
+                conn.execute("ALTER TABLE conversations ADD COLUMN owner TEXT")
+            conn.executescript(OWNER_INDEXES)
+
+    def connect(self):
+        return sqlite3.connect(self.db_path, timeout=5)
+
+    def blob_path(self, blob_id):
+        return os.path.join(self.blob_dir, blob_id[:2], blob_id)
+
+    def put_blob(self, data):
+        blob_id = hashlib.sha256(data).hexdigest()
+        path = self.blob_path(blob_id)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            temporary = f"{path}.{os.getpid()}.tmp"
+            with open(temporary, "wb") as f:
+                f.write(data)
+            os.replace(temporary, path)
+        return blob_id
+
+    def read_blob(self, blob_id):
+        with open(self.blob_path(blob_id), "rb") as f:
+            return f.read()
+
+    # None if the conversation doesn't exist (or has no owner)
+    def owner(self, conversation_id):
+        with self.connect() as conn:
+            row = conn.execute("SELECT owner FROM conversations WHERE conversation_id = ?",
+                               (conversation_id,)).fetchone()
+        return row[0] if row else None
+
+    def message_count(self, conversation_id):
+        with self.connect() as conn:
+            row = conn.execute("SELECT message_count FROM conversations WHERE conversation_id = ?",
+                               (conversation_id,)).fetchone()
+        return row[0] if row else 0
+
+    # Messages in order; `limit` returns only the most recent ones, `before` pages further back by seq
+    def messages(self, conversation_id, limit=None, before=None):
+        return [message for _, message in self.message_rows(conversation_id, limit, before)]
+
+    # The same as (seq, message) pairs
+    def message_rows(self, conversation_id, limit=None, before=None):
+        query = "SELECT seq, role, content FROM messages WHERE conversation_id = ?"
+        params = [conversation_id]
+        if before is not None:
+            query += " AND seq < ?"
+            params.append(before)
+        query += " ORDER BY seq DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+        with self.connect() as conn:
+            rows = conn.execute(query, params).fetchall()
+        return [(seq, {"role": role, "content": json.loads(content)}) for seq, role, content in reversed(rows)]
+
+    # The most recent messages whose estimated tokens fit token_budget (more would never be sent), read
+    # back a page at a time and starting at a user message. Returns (seq of the first one, messages); the
+    # seq is also the number of earlier messages left in the store.
+    def recent_messages(self, conversation_id, token_budget, page_size=50):
+        recent = []
+        tokens = 0
+        before = None
+        while tokens < token_budget:
+            rows = self.message_rows(conversation_id, limit=page_size, before=before)
+            for seq, message in reversed(rows):
+                if tokens >= token_budget:
+                    break
+                recent.append((seq, message))
+                tokens += message_tokens(message)
+            if len(rows) < page_size:
+                break
+            before = rows[0][0]
+        recent.reverse()
+        while recent and recent[0][1]["role"] != "user":
+            recent.pop(0)
+        first = recent[0][0] if recent else self.message_count(conversation_id)
+        return first, [message for _, message in recent]
+
+    def append(self, conversation_id, message, owner=None, student=None):
+        now = time.time()
+        title = None
+        if message["role"] == "user":
+            title = message_title(message)
+            title = title if title and title not in self.hidden_messages else None
+        with self.connect() as conn:
+            conn.execute("INSERT OR IGNORE INTO conversations (conversation_id, owner, student, created, updated) "
+                         "VALUES (?, ?, ?, ?, ?)", (conversation_id, owner, student, now, now))
+            conn.execute("INSERT INTO messages (conversation_id, seq, role, content, created) VALUES "
+                         "(?, (SELECT COALESCE(MAX(seq) + 1, 0) FROM messages WHERE conversation_id = ?), ?, ?, ?)",
+                         (conversation_id, conversation_id, message["role"], json.dumps(message["content"]), now))
+            conn.execute("UPDATE conversations SET updated = ?, message_count = message_count + 1, "
+                         "student = COALESCE(?, student), title = COALESCE(title, ?) WHERE conversation_id = ?",
+                         (now, student, title, conversation_id))
+
+    # Most recent first: [{"conversation_id", "student", "title", "updated", "message_count"}, ...].
+    # Conversations without a title never got past the greeting and are left out.
+    def conversations(self, owner, student=None, limit=20):
+        query = ("SELECT conversation_id, student, title, updated, message_count FROM conversations "
+                 "WHERE owner = ? AND title IS NOT NULL")
+        params = [owner]
+        if student is not None:
+            query += " AND student = ?"
+            params.append(student)
+        query += " ORDER BY updated DESC LIMIT ?"
+        params.append(limit)
+        with self.connect() as conn:
+            rows = conn.execute(query, params).fetchall()
+        return [dict(zip(("conversation_id", "student", "title", "updated", "message_count"), row)) for row in rows]
+
+    # Image block pointing at a stored blob, from the image pipeline's base64 output
+    def image_block(self, media_type, data):
+        return {"type": "image",
+                "source": {"type": "blob", "media_type": media_type, "blob_id": self.put_blob(base64.b64decode(data))}}
+
+    # API-ready copies of messages: blob image sources are read back and base64-encoded
+    def resolve_images(self, messages):
+        resolved = []
+        for message in messages:
+            content = message["content"]
+            if isinstance(content, list) and any(block.get("type") == "image" and block["source"]["type"] == "blob"
+                                                 for block in content):
+                content = [block if block.get("type") != "image" or block["source"]["type"] != "blob" else
+                           {"type": "image", "source": {
+                               "type": "base64", "media_type": block["source"]["media_type"],
+                               "data": base64.b64encode(self.read_blob(block["source"]["blob_id"])).decode("ascii")}}
+                           for block in content]
+                message = dict(message, content=content)
+            resolved.append(message)
+        return resolved
+
+
+# The message list of one conversation. Appending writes the message through to the store, so every
+# place that adds to the history (including the response workers) persists it. A reopened conversation
+# holds only its recent messages; the `earlier` ones stay in the store and are read back page by page.
+class ConversationMessages(list):
+    def __init__(self, store, conversation_id, owner=None, student=None, messages=(), earlier=0):
+        super().__init__(messages)
+        self.store = store
+        self.conversation_id = conversation_id
+        self.owner = owner
+        self.earlier = earlier
+        # The student selected when the latest message was added; the conversation is indexed under it
+        self.student = student
+
+    def append(self, message):
+        self.store.append(self.conversation_id, {"role": message["role"], "content": message["content"]},
+                          owner=self.owner, student=self.student)
+        super().append(message)
+
+    # Up to `limit` of the earlier messages, just before the `skip` nearest ones already read back
+    def earlier_page(self, skip, limit):
+        return self.store.messages(self.conversation_id, limit=min(limit, self.earlier - skip),
+                                   before=self.earlier - skip) if skip < self.earlier else []
+
+
+# Reopen a stored conversation with only the messages that can still fit in a request's token budget
+def open_conversation(store, conversation_id, owner=None, student=None, token_budget=60000):
+    earlier, messages = store.recent_messages(conversation_id, token_budget)
+    return ConversationMessages(store, conversation_id, owner=owner, student=student, messages=messages,
+                                earlier=earlier)
@@ -0,0 +1,136 @@
+import numpy as np
+import pandas as pd
+
+from response_cache import content_hash
+
+# Fewer scored weeks than this and a slope is noise
+MIN_SCORED_WEEKS = 3
+
+# Tables the analytics read, and an order that makes their rows canonical
+VERSIONED_TABLES = [("pm_periods", "student_id, subject, week"),
+                    ("pm_summaries", "student_id, subject"),
+                    ("phase_changes", "student_id, subject, week, phase_change_id")]
+
+PERIOD_COLUMNS = ["student_id", "subject", "week", "week_start", "scaled_score", "status"]
+
+
+# Changes whenever a score, goal or phase change is added or corrected, so cached analytics can be keyed by it.
+# A hash of every row the analytics read, in a fixed order: any edit changes it, whatever the numbers.
+def scores_version(store):
+    return content_hash([store.query(f"SELECT * FROM {table} ORDER BY {order}") for table, order in VERSIONED_TABLES])
+
+
+def load_frames(store):
+    periods = pd.DataFrame(store.query("SELECT " + ", ".join(PERIOD_COLUMNS) + " FROM pm_periods"),
+                           columns=PERIOD_COLUMNS)
+    summaries = pd.DataFrame(store.query(
+        "SELECT student_id, subject, domain, level, moderate_roi, aggressive_roi, roi_target FROM pm_summaries"),
+        columns=["student_id", "subject", "domain", "level", "moderate_roi", "aggressive_roi", "roi_target"])
+    # A week with more than one phase-change record is where the intervention changed; the new phase starts there
+    phase_weeks = pd.DataFrame(store.query(
+        "SELECT student_id, subject, week FROM phase_changes GROUP BY student_id, subject, week HAVING COUNT(*) > 1"),
+        columns=["student_id", "subject", "week"])
+    return periods, summaries, phase_weeks
+
+
+# Least-squares slope and intercept for every group at once, from grouped sums
+def grouped_fit(frame, keys, x="week", y="scaled_score"):
+    sums = frame.assign(xy=frame[x] * frame[y], xx=frame[x] * frame[x]).groupby(keys).agg(
+        n=(y, "size"), sx=(x, "sum"), sy=(y, "sum"), sxy=("xy", "sum"), sxx=("xx", "sum"),
+        first_week=(x, "min"), last_week=(x, "max"))
+    denominator = sums["n"] * sums["sxx"] - sums["sx"] ** 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        sums["slope"] = np.where(denominator != 0, (sums["n"] * sums["sxy"] - sums["sx"] * sums["sy"]) / denominator, np.nan)
+    sums["intercept"] = (sums["sy"] - sums["slope"] * sums["sx"]) / sums["n"]
+    return sums.drop(columns=["sx", "sy", "sxy", "sxx"]).reset_index()
+
+
+# ROI, trend and aim-line comparison for every student and subject in the caseload.
+# Only completed weeks are fitted: skipped weeks are gaps, not zeros, and assigned weeks haven't happened yet.
+# Returns (growth, phases, trend): one row per student/subject, one per phase, and one per scored week.
+def compute_growth(periods, summaries, phase_weeks):
+    keys = ["student_id", "subject"]
+    scored = periods[periods["status"] == "Completed"].copy()
+    counts = periods.assign(
+        skipped=periods["status"] == "Skipped", scored=periods["status"] == "Completed"
+    ).groupby(keys)[["skipped", "scored"]].sum().reset_index()
+
+    # Phase number of each scored week: how many phase starts are at or before it
+    starts = phase_weeks.sort_values("week").assign(phase_start=True)
+    scored = scored.sort_values("week")
+    if len(starts):
+        scored = pd.merge_asof(scored, starts.rename(columns={"week": "start_week"}),
+                               left_on="week", right_on="start_week", by=keys, direction="backward")
+        scored["phase"] = scored.groupby(keys)["start_week"].rank(method="dense").fillna(0).astype(int)
+        scored = scored.drop(columns=["start_week", "phase_start"])
+    else:
+        scored["phase"] = 0
+
+    overall = grouped_fit(scored, keys)
+    phases = grouped_fit(scored, keys + ["phase"])
+    current = phases.sort_values("phase").groupby(keys).tail(1)[keys + ["phase", "slope", "n"]].rename(
+        columns={"phase": "current_phase", "slope": "current_roi", "n": "current_phase_weeks"})
+
+    growth = (summaries.merge(counts, on=keys, how="left")
+              .merge(overall.rename(columns={"slope": "overall_roi", "n": "fitted_weeks"}), on=keys, how="left")
+              .merge(current, on=keys, how="left"))
+    growth["target_roi"] = np.where(growth["roi_target"].str.upper() == "AGGRESSIVE",
+                                    growth["aggressive_roi"], growth["moderate_roi"])
+
+    # Aim line: from the trend's starting point, rising at the target ROI
+    growth["baseline"] = growth["intercept"] + growth["overall_roi"] * growth["first_week"]
+    elapsed = growth["last_week"] - growth["first_week"]
+    growth["trend_end"] = growth["intercept"] + growth["overall_roi"] * growth["last_week"]
+    growth["aim_end"] = growth["baseline"] + growth["target_roi"] * elapsed
+    growth["aim_gap"] = growth["trend_end"] - growth["aim_end"]
+
+    enough = growth["current_phase_weeks"].fillna(0) >= MIN_SCORED_WEEKS
+    growth["roi_result"] = np.select(
+        [~enough, growth["current_roi"] >= growth["target_roi"]], ["INSUFFICIENT DATA", "AT OR ABOVE"], "BELOW")
+    growth["tier_flag"] = np.select(
+        [~enough, growth["current_roi"] >= growth["target_roi"], growth["current_roi"] >= growth["moderate_roi"],
+         growth["current_roi"] > 0],
+        ["Too few scored weeks to judge growth",
+         "On track for the target rate",
+         "Meeting expected growth but below the target rate",
+         "Growing below the expected rate; consider adjusting the intervention"],
+        "Not growing; consider intensifying the intervention (Tier 3)")
+
+    trend = scored.merge(overall[keys + ["slope", "intercept", "first_week"]], on=keys).merge(
+        growth[keys + ["baseline", "target_roi"]], on=keys)
+    trend["trend"] = trend["intercept"] + trend["slope"] * trend["week"]
+    trend["aim"] = trend["baseline"] + trend["target_roi"] * (trend["week"] - trend["first_week"])
+    trend = trend[keys + ["week", "week_start", "phase", "scaled_score", "trend", "aim"]]
+    return growth, phases, trend
+
+
+def compute_caseload_growth(store):
+    return compute_growth(*load_frames(store))
+
+
+def student_rows(frame, student_id, subject=None):
+    rows = frame[frame["student_id"] == student_id]
+    if subject is not None:
+        rows = rows[rows["subject"] == subject]
+    return rows
+
+
+# Plain-text growth summary for the system prompt, so the model quotes the computed figures
+def growth_prompt_section(growth_rows):
+    lines = []
+    for row in growth_rows.to_dict("records"):
+        if pd.isna(row["overall_roi"]):
+            lines.append(f"- {row['subject'].title()} ({row['domain']}): no scored weeks yet.")
+            continue
+        lines.append(
+            f"- {row['subject'].title()} ({row['domain']}, level {row['level']}): "
+            f"current ROI {row['current_roi']:.2f} points/week over {int(row['current_phase_weeks'])} scored weeks "
+            f"(overall {row['overall_roi']:.2f}; {int(row['skipped'])} skipped weeks excluded). "
+            f"Target ({row['roi_target'].lower()}) ROI {row['target_roi']:.2f}: {row['roi_result']}. "
+            f"Trend at week {int(row['last_week'])} is {row['trend_end']:.1f} vs. aim line {row['aim_end']:.1f}. "
+            f"{row['tier_flag']}.")
+    if not lines:
+        return None
+    return ("##### COMPUTED GROWTH ANALYSIS",
+            "Rate of improvement computed by least squares over completed progress-monitoring weeks. "
+            "Prefer these figures over the ROI fields in the raw data.\n" + "\n".join(lines))
@@ -0,0 +1,191 @@
+import logging
+import threading
+
+from prompt_builder import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Vision input is billed by pixel area and capped around 1,600 tokens for a full-size image
+IMAGE_TOKEN_ESTIMATE = 1600
+
+# Per-message overhead for role markers and block framing
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_MESSAGE_CHARS = 4000
+
+SUMMARY_PROMPT = (
+    "Summarize the earlier part of this conversation between a special education teacher and Wittly, "
+    "their AI assistant, so the conversation can continue without it. Keep student names, data points, "
+    "decisions, drafted IEP goals and open questions. Be concise and factual; use bullet points."
+)
+
+
+def block_tokens(block):
+    if block.get("type") == "image":
+        return IMAGE_TOKEN_ESTIMATE
+    return estimate_tokens(block.get("text", ""))
+
+
+# Token estimate for a message, cached on the message dict so it is computed once per message
+def message_tokens(message):
+    if "token_estimate" not in message:
+        content = message["content"]
+        if isinstance(content, list):
+            tokens = sum(block_tokens(block) for block in content)
+        else:
+            tokens = estimate_tokens(content)
+        message["token_estimate"] = tokens + MESSAGE_OVERHEAD_TOKENS
+    return message["token_estimate"]
+
+
+def message_text(message):
+    content = message["content"]
+    if isinstance(content, list):
+        return "\n".join(block["text"] if block["type"] == "text" else "[image]" for block in content)
+    return content
+
+
+# Replace image blocks with a short text stub
+def stub_images(content):
+    if not isinstance(content, list):
+        return content
+    return [block if block["type"] != "image" else
+            {"type": "text", "text": f"[Image shared earlier in the conversation ({block['source'].get('media_type', 'image')})]"}
+            for block in content]
+
+
+def prepend_text(content, text):
+    if isinstance(content, list):
+        return [{"type": "text", "text": text}] + content
+    return f"{text}\n\n{content}"
+
+
+class HistoryManager:
+    def __init__(self, token_budget=60000, keep_recent=6, keep_images=1, summary_model=None):
+        self.token_budget = token_budget
+        # Number of trailing messages always sent verbatim (if they fit)
+        self.keep_recent = keep_recent
+        # Images are kept only in this many of the most recent user messages
+        self.keep_images = keep_images
+        self.summary_model = summary_model
+        self.summary = ""
+        # Messages before this index are covered by self.summary
+        self.summarized_upto = 0
+        self.last_usage = {"system": 0, "history": 0, "budget": token_budget, "dropped": 0}
+        self._lock = threading.Lock()
+        self._worker = None
+
+    # First index of the verbatim tail; always a user message so the payload keeps user/assistant alternation
+    def recent_start(self, messages):
+        start = max(0, len(messages) - self.keep_recent)
+        while start > 0 and messages[start]["role"] != "user":
+            start -= 1
+        return start
+
+    # Fold messages [summarized_upto, upto) into the running summary on a background thread
+    def summarize_async(self, client, messages, upto):
+        if self.summary_model is None or client is None or upto <= self.summarized_upto:
+            return
+        if self._worker is not None and self._worker.is_alive():
+            return
+        start = self.summarized_upto
+        previous = self.summary
+        # Very long turns (pasted documents, full IEP drafts) are clipped; the summary only needs their gist
+        transcript = "\n\n".join(f"{message['role'].title()}: {message_text(message)[:SUMMARY_MESSAGE_CHARS]}"
+                                   for message in messages[start:upto])
+
+        def run():
+            try:
+                prompt = SUMMARY_PROMPT
+                if previous:
+                    prompt += f"\n\nSummary of the conversation before this excerpt:\n{previous}"
+                response = client.messages.create(
+                    model=self.summary_model,
+                    max_tokens=800,
+                    system=prompt,
+                    messages=[{"role": "user", "content": transcript}],
+                )
+                summary = "".join(block.text for block in response.content if block.type == "text")
+                with self._lock:
+                    if self.summarized_upto == start:
+                        self.summary = summary
+                        self.summarized_upto = upto
+            except Exception:
+                logger.exception("Conversation summary failed; older turns will be dropped instead")
+
+        self._worker = threading.Thread(target=run, name="history-summary", daemon=True)
+        self._worker.start()
+
+    # Build the API message list so system + history fit the token budget:
+    #   - the last keep_recent messages are sent verbatim, with only the newest images kept
+    #   - older messages are replaced by the running summary once the background summary catches up,
+    #     and simply dropped until then
+    # `earlier` counts messages before `messages` that were never loaded (a reopened conversation's older
+    # turns, left in the store); they are treated as already dropped.
+    def build_messages(self, messages, system_tokens=0, client=None, earlier=0):
+        allowance = max(0, self.token_budget - system_tokens)
+        recent_start = self.recent_start(messages)
+
+        image_messages = [index for index, message in enumerate(messages)
+                          if message["role"] == "user" and isinstance(message["content"], list)
+                          and any(block["type"] == "image" for block in message["content"])]
+        images_to_keep = set(image_messages[-self.keep_images:]) if self.keep_images else set()
+
+        def content_for(index):
+            message = messages[index]
+            if index in images_to_keep:
+                return message["content"], message_tokens(message)
+            content = stub_images(message["content"])
+            if content is message["content"]:
+                return content, message_tokens(message)
+            return content, sum(block_tokens(block) for block in content) + MESSAGE_OVERHEAD_TOKENS
+
+        total = sum(content_for(index)[1] for index in range(len(messages)))
+        if total > allowance * 0.75:
+            # Get the summary going before the budget is actually hit
+            self.summarize_async(client, messages, recent_start)
+
+        with self._lock:
+            summary = self.summary
+            summarized_upto = min(self.summarized_upto, recent_start)
+
+        # Start from the verbatim tail and walk backwards while older messages still fit
+        start = recent_start
+        used = sum(content_for(index)[1] for index in range(recent_start, len(messages)))
+        summary_tokens = estimate_tokens(summary) if summary else 0
+        while start > summarized_upto:
+            candidate = start - 1
+            while candidate > summarized_upto and messages[candidate]["role"] != "user":
+                candidate -= 1
+            cost = sum(content_for(index)[1] for index in range(candidate, start))
+            if used + cost + summary_tokens > allowance:
+                break
+            start = candidate
+            used += cost
+
+        # If even the recent tail is too big, drop its oldest turns (never the latest user message)
+        while used > allowance:
+            next_start = next((index for index in range(start + 1, len(messages))
+                               if messages[index]["role"] == "user"), None)
+            if next_start is None:
+                break
+            used -= sum(content_for(index)[1] for index in range(start, next_start))
+            start = next_start
+
+        notes = []
+        covered = 0
+        if summary and summarized_upto > 0 and used + summary_tokens <= allowance:
+            notes.append(f"[Summary of our earlier conversation]\n{summary}")
+            covered = summarized_upto
+        if start > covered or earlier:
+            notes.append("[Some earlier messages in this conversation were omitted to stay within the context budget]")
+        prefix = "\n\n".join(notes)
+        used += estimate_tokens(prefix) if prefix else 0
+
+        api_messages = [{"role": messages[index]["role"], "content": content_for(index)[0]}
+                        for index in range(start, len(messages))]
+        if prefix and api_messages:
+            api_messages[0]["content"] = prepend_text(api_messages[0]["content"], prefix)
+
+        self.last_usage = {"system": system_tokens, "history": used, "budget": self.token_budget, "dropped": earlier + start}
+        return api_messages
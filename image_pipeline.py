@@ -0,0 +1,169 @@
+import base64
+import hashlib
+import io
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+from PIL import Image, ImageOps
+
+from student_store import DATA_DIR
+
+logger = logging.getLogger(__name__)
+
+IMAGE_CACHE_DIR = os.path.join(DATA_DIR, "images")
+
+# Claude downscales anything beyond ~1.15 megapixels or a 1568 px long edge, so more pixels
+# only cost upload bytes
+MAX_LONG_EDGE = 1568
+MAX_PIXELS = 1_150_000
+
+# Vision input costs about (width * height) / 750 tokens
+PIXELS_PER_TOKEN = 750
+
+JPEG_QUALITY = 85
+
+MEDIA_TYPES = {"JPEG": "image/jpeg", "PNG": "image/png", "GIF": "image/gif", "WEBP": "image/webp"}
+
+
+def image_tokens(width, height, max_long_edge=MAX_LONG_EDGE, max_pixels=MAX_PIXELS):
+    width, height = fitted_size(width, height, max_long_edge, max_pixels)
+    return max(1, round(width * height / PIXELS_PER_TOKEN))
+
+
+def fitted_size(width, height, max_long_edge=MAX_LONG_EDGE, max_pixels=MAX_PIXELS):
+    scale = min(1.0, max_long_edge / max(width, height), (max_pixels / (width * height)) ** 0.5)
+    return max(1, int(width * scale)), max(1, int(height * scale))
+
+
+# Downscales, re-encodes and deduplicates uploaded images before they go into the conversation.
+# Results are cached by a hash of the uploaded bytes, in memory and under .wittly/images/, so an image
+# uploaded again (by anyone) is not re-processed and every message holding it shares one copy of its data.
+# Both caches are bounded: the least recently used entries are dropped past memory_entries in memory and
+# past disk_bytes on disk.
+class ImagePipeline:
+    def __init__(self, cache_dir=IMAGE_CACHE_DIR, max_long_edge=MAX_LONG_EDGE, max_pixels=MAX_PIXELS,
+                 jpeg_quality=JPEG_QUALITY, memory_entries=64, disk_bytes=200 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.disk_bytes = disk_bytes
+        self.max_long_edge = max_long_edge
+        self.max_pixels = max_pixels
+        self.jpeg_quality = jpeg_quality
+        self.memory_entries = memory_entries
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def process(self, raw, media_type=None):
+        image_id = hashlib.sha256(raw).hexdigest()
+        with self._lock:
+            result = self._memory.get(image_id)
+            if result is not None:
+                self._memory.move_to_end(image_id)
+                return dict(result, reused=True)
+        result = self.load(image_id)
+        reused = result is not None
+        if result is None:
+            result = self.encode(image_id, raw, media_type)
+            self.save(result)
+        with self._lock:
+            self._memory[image_id] = result
+            while len(self._memory) > self.memory_entries:
+                self._memory.popitem(last=False)
+        return dict(result, reused=reused)
+
+    def encode(self, image_id, raw, media_type):
+        result = {"id": image_id, "original_bytes": len(raw)}
+        try:
+            image = Image.open(io.BytesIO(raw))
+            original_format = image.format
+            # Phone photos are often stored sideways with an EXIF rotation flag
+            image = ImageOps.exif_transpose(image)
+        except Exception:
+            logger.warning("Could not read uploaded image; sending it unchanged", exc_info=True)
+            return dict(result, media_type=media_type or "image/jpeg", data=base64.b64encode(raw).decode("ascii"),
+                        bytes=len(raw), width=None, height=None, original_width=None, original_height=None,
+                        original_tokens=None, tokens=None)
+
+        original_width, original_height = image.size
+        width, height = fitted_size(original_width, original_height, self.max_long_edge, self.max_pixels)
+        if (width, height) != image.size:
+            image = image.resize((width, height), Image.LANCZOS)
+
+        # Keep transparency as PNG; everything else (photos, scans) is smaller as JPEG
+        output = io.BytesIO()
+        if image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info):
+            image.save(output, format="PNG", optimize=True)
+            encoded_type = "image/png"
+        else:
+            image.convert("RGB").save(output, format="JPEG", quality=self.jpeg_quality, optimize=True)
+            encoded_type = "image/jpeg"
+        encoded = output.getvalue()
+
+        # An already-small upload in a supported format may beat the re-encode; keep it as is
+        if (width, height) == (original_width, original_height) and original_format in MEDIA_TYPES \
+                and len(raw) <= len(encoded):
+            encoded, encoded_type = raw, MEDIA_TYPES[original_format]
+
+        return dict(result, media_type=encoded_type, data=base64.b64encode(encoded).decode("ascii"),
+                    bytes=len(encoded), width=width, height=height,
+                    original_width=original_width, original_height=original_height,
+                    # What the raw upload would have cost after the API's own downscaling
+                    original_tokens=image_tokens(original_width, original_height),
+                    tokens=image_tokens(width, height))
+
+    def path(self, image_id):
+        return os.path.join(self.cache_dir, f"{image_id}.json")
+
+    def load(self, image_id):
+        try:
+            with open(self.path(image_id)) as f:
+                result = json.load(f)
+            # The modification time doubles as the last-used time for eviction
+            os.utime(self.path(image_id))
+            return result
+        except (OSError, ValueError):
+            return None
+
+    def save(self, result):
+        temporary = self.path(result["id"]) + ".tmp"
+        with open(temporary, "w") as f:
+            json.dump(result, f)
+        os.replace(temporary, self.path(result["id"]))
+        self.evict()
+
+    # Delete the least recently used entries on disk until the cache fits in disk_bytes
+    def evict(self):
+        entries = []
+        for entry in os.scandir(self.cache_dir):
+            if entry.name.endswith(".json"):
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.disk_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+
+
+def format_image_report(result):
+    if result["width"] is None:
+        return f"Image sent unchanged ({result['bytes'] / 1024:,.0f} KB; could not be processed)"
+    saved = result["original_bytes"] - result["bytes"]
+    report = (f"Image {result['original_width']}×{result['original_height']} → {result['width']}×{result['height']}, "
+              f"{result['original_bytes'] / 1024:,.0f} KB → {result['bytes'] / 1024:,.0f} KB "
+              f"({saved / 1024:,.0f} KB saved), ~{result['tokens']:,} tokens")
+    if result["original_tokens"] > result["tokens"]:
+        report += f" (~{result['original_tokens'] - result['tokens']:,} fewer)"
+    if result["reused"]:
+        report += "; reused the cached copy of this image"
+    return report
@@ -0,0 +1,366 @@
+import hashlib
+import io
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+import uuid
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from xml.etree import ElementTree
+
+from PIL import Image, ImageOps
+
+from prompt_builder import estimate_tokens
+from retrieval import tokenize
+from student_store import DATA_DIR
+
+logger = logging.getLogger(__name__)
+
+PORTFOLIO_PATH = os.path.join(DATA_DIR, "portfolio.db")
+PORTFOLIO_FILES_DIR = os.path.join(DATA_DIR, "portfolio")
+
+# Uploads are copied to disk this many bytes at a time
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+
+# Extracted text is indexed in passages of about this many characters, split on paragraph breaks
+PASSAGE_CHARS = 1200
+
+THUMBNAIL_SIZE = (320, 320)
+
+MEDIA_TYPES = {
+    "pdf": "application/pdf",
+    "doc": "application/msword",
+    "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "png": "image/png",
+}
+
+SCHEMA = """
+-- One row per distinct file content; status goes pending -> extracting -> ready | failed
+CREATE TABLE IF NOT EXISTS files (
+    file_id TEXT PRIMARY KEY, size INTEGER, media_type TEXT, status TEXT,
+    pages INTEGER, text_chars INTEGER, thumbnail INTEGER DEFAULT 0, error TEXT,
+    created REAL, extracted REAL
+);
+
+-- A file filed under a student by its owner (whoever uploaded it, see app.session_owner); the same file
+-- can be in several students' portfolios. Students are their roster_id (two students can share a name);
+-- student keeps the name they had when the file was filed.
+CREATE TABLE IF NOT EXISTS samples (
+    sample_id INTEGER PRIMARY KEY,
+    owner TEXT, roster_id INTEGER, student TEXT, category TEXT, title TEXT, filename TEXT, file_id TEXT,
+    uploaded REAL
+);
+
+CREATE VIRTUAL TABLE IF NOT EXISTS passages USING fts5(
+    text, file_id UNINDEXED, position UNINDEXED, page UNINDEXED
+);
+"""
+
+# The name-keyed indexes from before samples had a roster_id are dropped: two students with the same
+# name could not have both held the same file under them
+OWNER_INDEXES = """
+DROP INDEX IF EXISTS idx_samples_owner_file;
+DROP INDEX IF EXISTS idx_samples_owner_student;
+CREATE UNIQUE INDEX IF NOT EXISTS idx_samples_owner_roster_file ON samples (owner, roster_id, file_id);
+CREATE INDEX IF NOT EXISTS idx_samples_owner_roster ON samples (owner, roster_id, uploaded);
+"""
+
+SAMPLE_COLUMNS = ("sample_id", "category", "title", "filename", "file_id", "uploaded", "size", "media_type",
+                  "status", "pages", "text_chars", "thumbnail", "error")
+
+
+def media_type_for(filename):
+    return MEDIA_TYPES.get(os.path.splitext(filename)[1].lower().lstrip("."), "application/octet-stream")
+
+
+def sample_label(sample_id):
+    return f"W{sample_id}"
+
+
+# Split page texts into passages of about max_chars: [(page, text), ...]
+def split_passages(pages, max_chars=PASSAGE_CHARS):
+    passages = []
+    for page, text in pages:
+        current = ""
+        for paragraph in re.split(r"\n\s*\n", text):
+            paragraph = " ".join(paragraph.split())
+            if not paragraph:
+                continue
+            if current and len(current) + len(paragraph) + 1 > max_chars:
+                passages.append((page, current))
+                current = ""
+            while len(paragraph) > max_chars:
+                passages.append((page, paragraph[:max_chars]))
+                paragraph = paragraph[max_chars:]
+            current = f"{current}\n{paragraph}" if current else paragraph
+        if current:
+            passages.append((page, current))
+    return passages
+
+
+def extract_pdf(path):
+    from pypdf import PdfReader
+    reader = PdfReader(path)
+    pages = [(number, page.extract_text() or "") for number, page in enumerate(reader.pages, 1)]
+    # Scanned work has no text layer; its first embedded image makes the thumbnail
+    cover = None
+    if reader.pages:
+        for image in reader.pages[0].images:
+            cover = Image.open(io.BytesIO(image.data))
+            break
+    return pages, cover
+
+
+WORD_NAMESPACE = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+
+def extract_docx(path):
+    with zipfile.ZipFile(path) as document:
+        root = ElementTree.fromstring(document.read("word/document.xml"))
+    paragraphs = ["".join(node.text or "" for node in paragraph.iter(f"{WORD_NAMESPACE}t"))
+                  for paragraph in root.iter(f"{WORD_NAMESPACE}p")]
+    return [(None, "\n\n".join(paragraphs))], None
+
+
+# Legacy .doc files store their text as UTF-16 runs between binary structures; keep the readable runs
+def extract_doc(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    runs = re.findall(r"[\x20-\x7e\u00a0-\u024f\r\n\t]{20,}", data.decode("utf-16-le", errors="ignore"))
+    return [(None, "\n\n".join(run.replace("\r", "\n") for run in runs))], None
+
+
+def extract_image(path):
+    return [], Image.open(path)
+
+
+EXTRACTORS = {
+    "application/pdf": extract_pdf,
+    "application/vnd.openxmlformats-officedocument.wordprocessingml.document": extract_docx,
+    "application/msword": extract_doc,
+    "image/jpeg": extract_image,
+    "image/png": extract_image,
+}
+
+
+# Work samples filed under students, persisted under .wittly/. Files are stored once under their
+# content hash, however many times (or for however many students) they are uploaded. Text extracted
+# from them is indexed in SQLite FTS5 for search, and thumbnails are kept next to the files. Samples,
+# and the passages searched through them, are only ever read back for the owner who filed them.
+class PortfolioStore:
+    def __init__(self, db_path=PORTFOLIO_PATH, files_dir=PORTFOLIO_FILES_DIR):
+        self.db_path = db_path
+        self.files_dir = files_dir
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        os.makedirs(os.path.join(files_dir, "incoming"), exist_ok=True)
+        with self.connect() as conn:
+            conn.executescript(SCHEMA)
+            # Samples filed before they had owners belong to no one and are never shown or sent to the model
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(samples)")}
+            if "owner" not in columns:
+                conn.execute("ALTER TABLE samples ADD COLUMN owner TEXT")
+            # Samples filed by name only stay hidden until adopt_named_samples finds their student
+            if "roster_id" not in columns:
+                conn.execute("ALTER TABLE samples ADD COLUMN roster_id INTEGER")
+            conn.executescript(OWNER_INDEXES)
+
+    def connect(self):
+        return sqlite3.connect(self.db_path, timeout=5)
+
+    def file_path(self, file_id):
+        return os.path.join(self.files_dir, file_id[:2], file_id)
+
+    def thumbnail_path(self, file_id):
+        return self.file_path(file_id) + ".thumb.jpg"
+
+    # Copy a file-like object to disk chunk by chunk, hashing as it goes; returns (file_id, size)
+    def put_file(self, stream, chunk_bytes=UPLOAD_CHUNK_BYTES):
+        digest = hashlib.sha256()
+        size = 0
+        incoming = os.path.join(self.files_dir, "incoming", uuid.uuid4().hex)
+        try:
+            with open(incoming, "wb") as f:
+                while True:
+                    chunk = stream.read(chunk_bytes)
+                    if not chunk:
+                        break
+                    digest.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+            file_id = digest.hexdigest()
+            path = self.file_path(file_id)
+            if not os.path.exists(path):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(incoming, path)
+        finally:
+            if os.path.exists(incoming):
+                os.remove(incoming)
+        return file_id, size
+
+    # File an upload under a student. Returns (sample_id, file_id, new_file): new_file is True when the content
+    # wasn't stored before and needs extracting; sample_id is the existing sample if the student already has it.
+    def add_sample(self, owner, roster_id, student, category, filename, stream, title=None):
+        file_id, size = self.put_file(stream)
+        now = time.time()
+        with self.connect() as conn:
+            new_file = conn.execute(
+                "INSERT OR IGNORE INTO files (file_id, size, media_type, status, created) VALUES (?, ?, ?, 'pending', ?)",
+                (file_id, size, media_type_for(filename), now)).rowcount == 1
+            conn.execute("INSERT OR IGNORE INTO samples (owner, roster_id, student, category, title, filename, file_id, "
+                         "uploaded) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                         (owner, roster_id, student, category, title or os.path.splitext(filename)[0], filename,
+                          file_id, now))
+            sample_id = conn.execute("SELECT sample_id FROM samples WHERE owner = ? AND roster_id = ? AND file_id = ?",
+                                     (owner, roster_id, file_id)).fetchone()[0]
+        return sample_id, file_id, new_file
+
+    # A student's samples, newest first, with their file's extraction status
+    def samples(self, owner, roster_id):
+        with self.connect() as conn:
+            rows = conn.execute(
+                "SELECT s.sample_id, s.category, s.title, s.filename, s.file_id, s.uploaded, f.size, f.media_type, "
+                "f.status, f.pages, f.text_chars, f.thumbnail, f.error FROM samples s JOIN files f USING (file_id) "
+                "WHERE s.owner = ? AND s.roster_id = ? ORDER BY s.uploaded DESC", (owner, roster_id)).fetchall()
+        return [dict(zip(SAMPLE_COLUMNS, row)) for row in rows]
+
+    # File samples stored by name alone under the roster_id of that name, given as {full_name: roster_id}
+    # for the names that belong to exactly one student. Returns how many samples were adopted.
+    def adopt_named_samples(self, roster_ids):
+        with self.connect() as conn:
+            return sum(conn.execute("UPDATE OR IGNORE samples SET roster_id = ? WHERE roster_id IS NULL AND student = ?",
+                                    (roster_id, name)).rowcount for name, roster_id in roster_ids.items())
+
+    # Changes whenever a sample is added or a file finishes extracting, for keying caches
+    def version(self, owner):
+        with self.connect() as conn:
+            return conn.execute(
+                "SELECT COUNT(*), MAX(s.uploaded), MAX(f.extracted) FROM samples s JOIN files f USING (file_id) "
+                "WHERE s.owner = ?", (owner,)).fetchone()
+
+    def unfinished_files(self):
+        with self.connect() as conn:
+            return [row[0] for row in conn.execute("SELECT file_id FROM files WHERE status IN ('pending', 'extracting')")]
+
+    def media_type(self, file_id):
+        with self.connect() as conn:
+            return conn.execute("SELECT media_type FROM files WHERE file_id = ?", (file_id,)).fetchone()[0]
+
+    def set_status(self, file_id, status, error=None):
+        with self.connect() as conn:
+            conn.execute("UPDATE files SET status = ?, error = ?, extracted = ? WHERE file_id = ?",
+                         (status, error, time.time() if status == "failed" else None, file_id))
+
+    def save_extraction(self, file_id, pages, thumbnail):
+        passages = split_passages(pages)
+        with self.connect() as conn:
+            conn.execute("DELETE FROM passages WHERE file_id = ?", (file_id,))
+            conn.executemany("INSERT INTO passages (text, file_id, position, page) VALUES (?, ?, ?, ?)",
+                             [(text, file_id, position, page) for position, (page, text) in enumerate(passages)])
+            conn.execute("UPDATE files SET status = 'ready', pages = ?, text_chars = ?, thumbnail = ?, error = NULL, "
+                         "extracted = ? WHERE file_id = ?",
+                         (sum(1 for page, _ in pages if page) or None, sum(len(text) for _, text in passages),
+                          int(thumbnail), time.time(), file_id))
+
+    # Passages from a student's samples matching the query, best first:
+    # [{"sample_id", "title", "category", "uploaded", "page", "text"}, ...]
+    def search(self, owner, roster_id, query, limit=5):
+        terms = sorted(set(tokenize(query)))
+        if not terms:
+            return []
+        match = " OR ".join(f'"{term}"' for term in terms)
+        with self.connect() as conn:
+            rows = conn.execute(
+                "SELECT s.sample_id, s.title, s.category, s.uploaded, p.page, p.text FROM passages p "
+                "JOIN samples s ON s.file_id = p.file_id WHERE passages MATCH ? AND s.owner = ? AND s.roster_id = ? "
+                "ORDER BY bm25(passages) LIMIT ?", (match, owner, roster_id, limit)).fetchall()
+        return [dict(zip(("sample_id", "title", "category", "uploaded", "page", "text"), row)) for row in rows]
+
+    def passage_text(self, file_id, limit_chars=4000):
+        with self.connect() as conn:
+            rows = conn.execute("SELECT text FROM passages WHERE file_id = ? ORDER BY CAST(position AS INTEGER)",
+                                (file_id,)).fetchall()
+        return "\n\n".join(row[0] for row in rows)[:limit_chars]
+
+
+# Extracts text and thumbnails on a background pool, once per distinct file. Files left unfinished
+# by a previous process are picked up again by resume().
+class PortfolioExtractor:
+    def __init__(self, store, max_workers=2):
+        self.store = store
+        self.metrics = {"extracted": 0, "failed": 0, "seconds": 0.0}
+        self._in_flight = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="portfolio")
+
+    def submit(self, file_id):
+        with self._lock:
+            if file_id in self._in_flight:
+                return False
+            self._in_flight.add(file_id)
+        self._executor.submit(self.extract, file_id)
+        return True
+
+    def resume(self):
+        return sum(self.submit(file_id) for file_id in self.store.unfinished_files())
+
+    def extract(self, file_id):
+        started = time.perf_counter()
+        self.store.set_status(file_id, "extracting")
+        try:
+            extractor = EXTRACTORS.get(self.store.media_type(file_id))
+            if extractor is None:
+                raise ValueError("unsupported file type")
+            pages, cover = extractor(self.store.file_path(file_id))
+            if cover is not None:
+                cover = ImageOps.exif_transpose(cover).convert("RGB")
+                cover.thumbnail(THUMBNAIL_SIZE)
+                cover.save(self.store.thumbnail_path(file_id), "JPEG", quality=80)
+            self.store.save_extraction(file_id, pages, thumbnail=cover is not None)
+            outcome = "extracted"
+        except Exception as e:
+            logger.warning("Portfolio extraction failed for %s: %s", file_id, e)
+            self.store.set_status(file_id, "failed", error=f"{type(e).__name__}: {e}")
+            outcome = "failed"
+        with self._lock:
+            self._in_flight.discard(file_id)
+            self.metrics[outcome] += 1
+            self.metrics["seconds"] += time.perf_counter() - started
+
+    def pending(self):
+        with self._lock:
+            return len(self._in_flight)
+
+
+# "Work samples" prompt section: the student's samples, then the passages matching the conversation,
+# labelled so the model can cite them. None when the student has no samples.
+def portfolio_prompt_section(samples, passages, token_budget=1500):
+    if not samples:
+        return None
+    lines = ["Work samples in this student's portfolio. When your answer draws on one, cite it by its label "
+             "in square brackets, e.g. [W3] or [W3, p. 2]."]
+    for sample in samples:
+        details = [sample["category"], datetime.fromtimestamp(sample["uploaded"]).strftime("uploaded %b %d, %Y")]
+        if sample["pages"]:
+            details.append(f"{sample['pages']} page{'s' if sample['pages'] != 1 else ''}")
+        if sample["status"] != "ready":
+            details.append("text not extracted yet" if sample["status"] != "failed" else "no readable text")
+        lines.append(f"- [{sample_label(sample['sample_id'])}] {sample['title']} ({', '.join(details)})")
+    excerpts = []
+    used = 0
+    for passage in passages:
+        cost = estimate_tokens(passage["text"])
+        if used + cost > token_budget:
+            continue
+        used += cost
+        page = f", p. {passage['page']}" if passage["page"] else ""
+        excerpts.append(f"[{sample_label(passage['sample_id'])}{page}] {passage['text']}")
+    if excerpts:
+        lines.append("\nExcerpts relevant to the conversation:")
+        lines.extend(excerpts)
+    return ("##### WORK SAMPLES", "\n".join(lines))
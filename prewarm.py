@@ -0,0 +1,177 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from client_pool import key_fingerprint
+from prompt_builder import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+# An ephemeral cache entry lives five minutes, refreshed each time it is read
+CACHE_TTL_SECONDS = 300
+
+# Window for the per-organization prewarm budget
+BUDGET_WINDOW_SECONDS = 3600
+
+PREWARM_MESSAGES = [{"role": "user", "content": "Ready?"}]
+
+
+# The system blocks up to and including the last cache breakpoint: the part a prewarm writes to the cache
+def cached_prefix(system_blocks):
+    last = max((index for index, block in enumerate(system_blocks) if block.get("cache_control")), default=-1)
+    return system_blocks[:last + 1]
+
+
+# Prompt caches are per organization, so the same prefix warmed with another org's API key is a different entry
+def prefix_key(org, model, system_blocks):
+    digest = hashlib.sha256(f"{org}\0{model}".encode("utf-8"))
+    for block in cached_prefix(system_blocks):
+        digest.update(b"\0" + block["text"].encode("utf-8"))
+    return digest.hexdigest()
+
+
+# Speculatively writes a student's prompt prefix to the API's prompt cache (a one-token request on a
+# background thread) when a teacher opens that student, so their first question reads the prefix
+# from the cache instead of paying for it uncached.
+#   - Deduplicated across sessions: a prefix warmed recently, by a prewarm or by a real request, isn't
+#     sent again until its cache entry is about to expire.
+#   - Budgeted per organization (API key): at most tokens_per_hour prefix tokens written by prewarms.
+#   - Yields to real traffic: sent only if the rate-limit scheduler can admit it right away with headroom.
+# Metrics count how many prewarms were later used, i.e. the next real request for the prefix read it from cache.
+class PromptPrewarmer:
+    def __init__(self, scheduler, tokens_per_hour=1_000_000, headroom=0.25, max_workers=2,
+                 ttl=CACHE_TTL_SECONDS, refresh_margin=60):
+        self.scheduler = scheduler
+        self.tokens_per_hour = tokens_per_hour
+        self.headroom = headroom
+        self.ttl = ttl
+        self.refresh_margin = refresh_margin
+        self.metrics = Counter()
+        # prefix key -> {"warmed": time the cache entry was last written or read, "in_flight", "prewarmed": pending use}
+        self._prefixes = {}
+        # org -> deque of (time, tokens) spent on prewarms in the budget window
+        self._spent = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="prewarm")
+
+    def spent(self, org, now):
+        spent = self._spent.setdefault(org, deque())
+        while spent and spent[0][0] < now - BUDGET_WINDOW_SECONDS:
+            spent.popleft()
+        return sum(tokens for _, tokens in spent)
+
+    # Queue a prewarm of this prefix; returns what happened ("queued", "deduplicated", "over budget", ...)
+    def prewarm(self, client, model, system_blocks, session_id=None):
+        prefix = cached_prefix(system_blocks)
+        if not prefix:
+            return self.count("not cacheable")
+        org = key_fingerprint(client.api_key)
+        key = prefix_key(org, model, system_blocks)
+        tokens = sum(estimate_tokens(block["text"]) for block in prefix)
+        now = time.time()
+        charge = (now, tokens)
+        with self._lock:
+            entry = self._prefixes.get(key)
+            if entry and (entry["in_flight"] or now - entry["warmed"] < self.ttl - self.refresh_margin):
+                outcome = "deduplicated"
+            elif self.spent(org, now) + tokens > self.tokens_per_hour:
+                outcome = "over budget"
+            else:
+                outcome = "queued"
+                self._spent[org].append(charge)
+                self._prefixes[key] = {"warmed": now, "in_flight": True, "prewarmed": False}
+        if outcome == "queued":
+            self._executor.submit(self.send, client, model, prefix, key, org, charge, session_id)
+        return self.count(outcome)
+
+    def send(self, client, model, prefix, key, org, charge, session_id):
+        ticket = self.scheduler.ticket(session_id or "prewarm", model, input_tokens=charge[1], output_tokens=1)
+        if not self.scheduler.try_acquire(ticket, headroom=self.headroom):
+            self.finish(key, org, charge, None, "rate limited")
+            return
+        usage = {}
+        try:
+            # One output token: the request exists only to write the prefix to the cache
+            response = client.with_options(max_retries=0).messages.create(
+                model=model, max_tokens=1, system=prefix, messages=PREWARM_MESSAGES)
+            usage = response.usage.model_dump()
+            self.finish(key, org, charge, usage, "sent")
+        except Exception as e:
+            logger.warning("Prompt-cache prewarm failed (%s): %s", model, e)
+            self.finish(key, org, charge, None, "failed")
+        finally:
+            self.scheduler.release(ticket, input_tokens=(usage.get("input_tokens") or 0)
+                                   + (usage.get("cache_creation_input_tokens") or 0),
+                                   output_tokens=usage.get("output_tokens") or 0)
+
+    def finish(self, key, org, charge, usage, outcome):
+        with self._lock:
+            self.metrics[outcome] += 1
+            entry = self._prefixes[key]
+            entry["in_flight"] = False
+            if usage is None:
+                # Nothing was written; refund the budget and let the next selection try again
+                if charge in self._spent[org]:
+                    self._spent[org].remove(charge)
+                del self._prefixes[key]
+                return
+            entry["warmed"] = time.time()
+            entry["prewarmed"] = True
+            self.metrics["cache_write_tokens"] += usage.get("cache_creation_input_tokens") or 0
+            # Already cached, e.g. by another server process
+            if usage.get("cache_read_input_tokens") and not usage.get("cache_creation_input_tokens"):
+                self.metrics["already warm"] += 1
+        logger.info("Prewarmed prompt cache: %s", usage)
+
+    # A real request for this prefix is starting: the cache entry will be (re)written or read by it
+    def note_request_started(self, client, model, system_blocks):
+        key = prefix_key(key_fingerprint(client.api_key), model, system_blocks)
+        with self._lock:
+            entry = self._prefixes.setdefault(key, {"in_flight": False, "prewarmed": False})
+            entry["warmed"] = time.time()
+
+    # A real request for this prefix finished: the first one after a prewarm tells whether the prewarm was used
+    def note_request_finished(self, client, model, system_blocks, usage):
+        key = prefix_key(key_fingerprint(client.api_key), model, system_blocks)
+        with self._lock:
+            entry = self._prefixes.get(key)
+            if not entry or not entry["prewarmed"]:
+                return
+            entry["prewarmed"] = False
+            if usage.get("cache_read_input_tokens"):
+                self.metrics["used"] += 1
+            else:
+                self.metrics["missed"] += 1
+
+    def count(self, outcome):
+        with self._lock:
+            self.metrics[outcome] += 1
+        return outcome
+
+    # Count prewarms never followed by a request for their prefix before the cache entry expired,
+    # and forget prefixes whose cache entries have expired
+    def expire(self):
+        now = time.time()
+        with self._lock:
+            for key, entry in list(self._prefixes.items()):
+                if entry["in_flight"] or now - entry["warmed"] <= self.ttl:
+                    continue
+                if entry["prewarmed"]:
+                    self.metrics["expired unused"] += 1
+                del self._prefixes[key]
+
+    def stats(self):
+        self.expire()
+        with self._lock:
+            metrics = dict(self.metrics)
+            now = time.time()
+            spent = {org: self.spent(org, now) for org in self._spent}
+        sent = metrics.get("sent", 0)
+        resolved = metrics.get("used", 0) + metrics.get("missed", 0) + metrics.get("expired unused", 0)
+        metrics["used_rate"] = metrics.get("used", 0) / resolved if resolved else None
+        metrics["pending"] = max(0, sent - resolved)
+        metrics["budget_spent"] = spent
+        return metrics
@@ -0,0 +1,180 @@
+import threading
+import time
+import tracemalloc
+import weakref
+from collections import Counter, deque
+from contextlib import contextmanager
+
+# Profilers currently tracing memory. tracemalloc is process-wide and slows every session, so it runs
+# only while at least one of them exists, and only if this module turned it on (never stopped under
+# someone else who started it).
+_tracing_owners = set()
+_started_tracing = False
+_tracing_lock = threading.Lock()
+
+
+def start_tracing(owner):
+    global _started_tracing
+    with _tracing_lock:
+        if not _tracing_owners and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            _started_tracing = True
+        _tracing_owners.add(owner)
+
+
+def stop_tracing(owner):
+    global _started_tracing
+    with _tracing_lock:
+        _tracing_owners.discard(owner)
+        if not _tracing_owners and _started_tracing:
+            tracemalloc.stop()
+            _started_tracing = False
+
+
+class Frame:
+    def __init__(self, name, path, step=False):
+        self.name = name
+        self.path = path
+        # Steps are sequential siblings: the next step (or the end of the enclosing section) closes them
+        self.step = step
+        self.started = time.perf_counter()
+        self.memory = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+        self.peak = self.memory
+        self.children_seconds = 0.0
+
+
+# Times the sections of one script run (a full page run or a fragment rerun) and, when tracemalloc is on,
+# the memory each section allocated. Sections nest; `step` marks consecutive phases without re-indenting code.
+# Finished runs are kept for the overlay, and the self time of every section path is accumulated in
+# collapsed-stack form for flame graphs. A disabled profiler records nothing and costs next to nothing.
+class ScriptProfiler:
+    def __init__(self, enabled=True, trace_memory=True, keep_runs=20):
+        self.enabled = enabled
+        self.trace_memory = enabled and trace_memory
+        self.runs = deque(maxlen=keep_runs)
+        self.folded = Counter()
+        self._stack = []
+        self._rows = []
+        if self.trace_memory:
+            # Process-wide: allocations by other sessions running at the same time are counted too.
+            # Released when this profiler is stopped or garbage-collected with its session.
+            owner = object()
+            start_tracing(owner)
+            self._release_tracing = weakref.finalize(self, stop_tracing, owner)
+
+    def stop(self):
+        self.enabled = False
+        if self.trace_memory:
+            self.trace_memory = False
+            self._release_tracing()
+
+    @property
+    def active(self):
+        return bool(self._stack)
+
+    def start_run(self, name):
+        if not self.enabled:
+            return
+        # A run cut short by st.rerun() or st.stop() never finished; drop what it recorded
+        self._stack = []
+        self._rows = []
+        self.open(name)
+
+    def finish_run(self):
+        while self._stack:
+            self.close()
+        if not self._rows:
+            return None
+        # Rows are recorded as sections close; show them in the order they started
+        rows = sorted(self._rows, key=lambda row: row["started"])
+        run = {"name": rows[0]["path"][0], "finished": time.time(), "rows": rows}
+        self.runs.append(run)
+        self._rows = []
+        return run
+
+    # A fragment is its own run when it reruns alone, and a section of the page run otherwise
+    @contextmanager
+    def run(self, name):
+        if self.active or not self.enabled:
+            with self.section(name):
+                yield
+            return
+        self.start_run(name)
+        try:
+            yield
+        finally:
+            self.finish_run()
+
+    @contextmanager
+    def section(self, name):
+        if not self.active:
+            yield
+            return
+        frame = self.open(name)
+        try:
+            yield
+        finally:
+            while self._stack and self._stack[-1] is not frame:
+                self.close()
+            if self._stack:
+                self.close()
+
+    def step(self, name):
+        if not self.active:
+            return
+        if self._stack[-1].step:
+            self.close()
+        self.open(name, step=True)
+
+    def sample_peak(self):
+        if not tracemalloc.is_tracing():
+            return
+        peak = tracemalloc.get_traced_memory()[1]
+        for frame in self._stack:
+            frame.peak = max(frame.peak, peak)
+        tracemalloc.reset_peak()
+
+    def open(self, name, step=False):
+        self.sample_peak()
+        path = (self._stack[-1].path if self._stack else ()) + (name,)
+        frame = Frame(name, path, step=step)
+        self._stack.append(frame)
+        return frame
+
+    def close(self):
+        self.sample_peak()
+        frame = self._stack.pop()
+        seconds = time.perf_counter() - frame.started
+        memory = tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+        if self._stack:
+            self._stack[-1].children_seconds += seconds
+        self.folded[";".join(frame.path)] += max(0, round((seconds - frame.children_seconds) * 1e6))
+        self._rows.append({
+            "path": frame.path,
+            "started": frame.started,
+            "seconds": seconds,
+            "self_seconds": seconds - frame.children_seconds,
+            "allocated_bytes": memory - frame.memory,
+            "peak_bytes": frame.peak - frame.memory,
+        })
+
+    # Collapsed stacks ("page;chat;history 1234", self time in microseconds) for flamegraph.pl or speedscope
+    def collapsed_stacks(self):
+        return "".join(f"{path} {micros}\n" for path, micros in sorted(self.folded.items()) if micros)
+
+
+def format_run_rows(run, trace_memory=True):
+    total = run["rows"][0]["seconds"] if run["rows"] else 0.0
+    table = []
+    for row in run["rows"]:
+        entry = {
+            "section": " " * (len(row["path"]) - 1) + row["path"][-1],
+            "ms": round(row["seconds"] * 1000, 1),
+            "self ms": round(row["self_seconds"] * 1000, 1),
+            "% of run": round(row["seconds"] / total * 100, 1) if total else 0.0,
+        }
+        if trace_memory:
+            entry["allocated KB"] = round(row["allocated_bytes"] / 1024, 1)
+            entry["peak KB"] = round(row["peak_bytes"] / 1024, 1)
+        table.append(entry)
+    return table
@@ -0,0 +1,174 @@
+import hashlib
+import os
+import re
+import threading
+import time
+from datetime import datetime
+
+SYSTEM_PROMPT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "system_prompt.txt")
+DEFAULT_SYSTEM_PROMPT = "You are a helpful AI assistant that provides clear, concise answers."
+
+# Section headers in system_prompt.txt are lines of five or more '#' characters
+SECTION_HEADER = re.compile(r"^#{5,}.*$", re.MULTILINE)
+
+# Headers of the sections that hold per-student JSON data (everything else is guidance)
+DATA_SECTION_KEYWORDS = ("demographic", "assessment data", "progress monitoring")
+
+# Mark a block as the end of a cacheable prefix
+CACHE_CONTROL = {"type": "ephemeral"}
+
+
+# Load system prompt from file
+def load_system_prompt(path=SYSTEM_PROMPT_PATH):
+    try:
+        with open(path, "r") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return DEFAULT_SYSTEM_PROMPT
+
+
+# A prompt file loaded once per process and shared by every session. It is re-read (and re-hashed) only
+# when its modification time or size changes, checked at most every check_interval seconds, so edits
+# are picked up without a restart and without reading 125 KB from disk on every call.
+class PromptAsset:
+    def __init__(self, path=SYSTEM_PROMPT_PATH, default=DEFAULT_SYSTEM_PROMPT, check_interval=2.0):
+        self.path = path
+        self.default = default
+        self.check_interval = check_interval
+        self.loads = 0
+        self._signature = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self.reload()
+
+    def stat_signature(self):
+        try:
+            stat = os.stat(self.path)
+            return stat.st_mtime_ns, stat.st_size
+        except FileNotFoundError:
+            return None
+
+    def reload(self):
+        signature = self.stat_signature()
+        self.text = load_system_prompt(self.path) if signature else self.default
+        # Short content hash, for keying anything derived from the prompt
+        self.version = hashlib.sha256(self.text.encode("utf-8")).hexdigest()[:16]
+        self.loaded = time.time()
+        self._signature = signature
+        self.loads += 1
+
+    # Reload if the file changed; returns True when it did
+    def refresh(self):
+        now = time.monotonic()
+        if now - self._checked < self.check_interval:
+            return False
+        with self._lock:
+            self._checked = now
+            if self.stat_signature() == self._signature:
+                return False
+            self.reload()
+            return True
+
+    def get(self):
+        self.refresh()
+        return self.text
+
+
+# Split the prompt into (header, body) pairs; the persona text before the first header has header ""
+def split_sections(prompt):
+    sections = []
+    position = 0
+    header = ""
+    for match in SECTION_HEADER.finditer(prompt):
+        sections.append((header, prompt[position:match.start()]))
+        header = match.group(0).strip()
+        position = match.end()
+    sections.append((header, prompt[position:]))
+    return [(header, body.strip()) for header, body in sections if header or body.strip()]
+
+
+def is_data_section(header):
+    lowered = header.lower()
+    return any(keyword in lowered for keyword in DATA_SECTION_KEYWORDS)
+
+
+def join_sections(sections):
+    return "\n\n".join(f"{header}\n{body}" if header else body for header, body in sections)
+
+
+# Per-session text that changes between sessions/days and so must stay after the cached prefix
+def session_context_text(student_name=None, now=None):
+    now = now or datetime.now()
+    lines = [f"Today's Date: {now.strftime('%A, %B %d, %Y')}"]
+    if student_name:
+        lines.append(f"Student currently selected in the teacher's dashboard: {student_name}")
+    return "\n".join(lines)
+
+
+# Build the `system=` payload as content blocks ordered from most to least stable:
+#   1. persona, image-analysis and IEP guidance (same for every student and day) - cached
+#   2. student data sections (same for every turn about this student) - cached
+#   3. date and other per-session context - not cached
+# data_sections, when given, replaces the data sections pasted into the prompt (e.g. from the student store).
+# Pass cache_data=False when the data block changes from turn to turn (retrieved sections), so the
+# guidance prefix stays cached without paying for a cache write on every turn.
+# context_sections go after the cached blocks, for sections chosen per turn alongside cached data.
+def build_system_blocks(prompt, student_name=None, now=None, data_sections=None, cache_data=True,
+                        context_sections=None):
+    sections = split_sections(prompt)
+    guidance = [section for section in sections if not is_data_section(section[0])]
+    data = data_sections if data_sections is not None else [
+        section for section in sections if is_data_section(section[0])]
+
+    blocks = [{"type": "text", "text": join_sections(guidance), "cache_control": CACHE_CONTROL}]
+    if data:
+        data_block = {"type": "text", "text": join_sections(data)}
+        if cache_data:
+            data_block["cache_control"] = CACHE_CONTROL
+        blocks.append(data_block)
+    if context_sections:
+        blocks.append({"type": "text", "text": join_sections(context_sections)})
+    blocks.append({"type": "text", "text": session_context_text(student_name, now)})
+    return blocks
+
+
+# System blocks for a student with no record in the student store. The data sections pasted into the
+# prompt file belong to one particular student, so they are never sent for anyone else; a note that
+# nothing is on file takes their place.
+def no_data_system_blocks(prompt, student_name=None, now=None, context_sections=None):
+    data_sections = [("########## Student Data ##########",
+                      f"No demographic, assessment or progress-monitoring data is on file for {student_name}. "
+                      "Say so when asked about their data, and never use another student's data in its place.")
+                     ] if student_name else []
+    return build_system_blocks(prompt, student_name=student_name, now=now, data_sections=data_sections,
+                               context_sections=context_sections)
+
+
+# Rough token count (about four characters per token) for budgeting before the API counts for real
+def estimate_tokens(text):
+    return len(text) // 4 + 1
+
+
+# Pull input/cache token counts and the stop reason out of a streamed event, if it carries any
+def usage_from_event(event, usage):
+    if event.type == "message_start":
+        message_usage = event.message.usage
+        usage["input_tokens"] = message_usage.input_tokens or 0
+        usage["cache_read_input_tokens"] = getattr(message_usage, "cache_read_input_tokens", 0) or 0
+        usage["cache_creation_input_tokens"] = getattr(message_usage, "cache_creation_input_tokens", 0) or 0
+        usage["output_tokens"] = message_usage.output_tokens or 0
+    elif event.type == "message_delta":
+        if getattr(event, "usage", None) is not None:
+            usage["output_tokens"] = event.usage.output_tokens or usage.get("output_tokens", 0)
+        usage["stop_reason"] = getattr(event.delta, "stop_reason", None)
+    return usage
+
+
+def format_usage(usage):
+    cached = usage.get("cache_read_input_tokens", 0)
+    written = usage.get("cache_creation_input_tokens", 0)
+    uncached = usage.get("input_tokens", 0)
+    total = cached + written + uncached
+    hit_rate = (cached / total * 100) if total else 0
+    return (f"Input tokens: {total:,} (cache hit {cached:,}, cache write {written:,}, uncached {uncached:,}; "
+            f"{hit_rate:.0f}% cached) | Output tokens: {usage.get('output_tokens', 0):,}")
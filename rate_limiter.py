@@ -0,0 +1,221 @@
+import itertools
+import random
+import threading
+import time
+
+import anthropic
+
+# Per-model limits, per minute, as on the organization's rate-limit page
+DEFAULT_LIMITS = {"requests": 50, "input_tokens": 40000, "output_tokens": 16000}
+
+# Backoff when a 429/529 comes without a retry-after header
+BASE_BACKOFF_SECONDS = 1.0
+MAX_BACKOFF_SECONDS = 30.0
+
+# How often a waiting request re-checks and reports its position
+WAIT_POLL_SECONDS = 0.5
+
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # Seconds until `amount` is available, assuming `ahead` is taken first
+    def seconds_until(self, amount, ahead=0.0):
+        shortfall = amount + ahead - self.tokens
+        return max(0.0, shortfall / self.rate) if self.rate else float("inf")
+
+    def take(self, amount):
+        self.tokens -= amount
+
+    def give(self, amount):
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+class Ticket:
+    def __init__(self, session_id, model, cost, tag, sequence):
+        self.session_id = session_id
+        self.model = model
+        # Reserved amount per bucket: requests, input_tokens, output_tokens
+        self.cost = cost
+        self.tag = tag
+        self.sequence = sequence
+        self.not_before = 0.0
+        self.admitted = False
+        self.attempts = 0
+
+
+def retry_after_seconds(error):
+    response = getattr(error, "response", None)
+    value = response.headers.get("retry-after") if response is not None else None
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def is_retryable(error):
+    return isinstance(error, anthropic.APIStatusError) and error.status_code in (429, 529)
+
+
+# Process-wide admission control for API calls: one set of token buckets per model, shared by every session.
+# Waiting requests are admitted in fair-queueing order (each session's requests get increasing virtual
+# finish tags), so one busy session can't starve the others.
+class RateLimitScheduler:
+    def __init__(self, limits=None, model_limits=None, max_retries=4):
+        self.limits = dict(DEFAULT_LIMITS, **(limits or {}))
+        self.model_limits = model_limits or {}
+        self.max_retries = max_retries
+        self._buckets = {}
+        self._waiting = {}
+        self._paused_until = {}
+        self._session_tags = {}
+        self._virtual_time = 0.0
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    def buckets(self, model):
+        if model not in self._buckets:
+            limits = dict(self.limits, **self.model_limits.get(model, {}))
+            self._buckets[model] = {name: TokenBucket(limits[name]) for name in DEFAULT_LIMITS}
+            self._waiting[model] = []
+        return self._buckets[model]
+
+    def ticket(self, session_id, model, input_tokens, output_tokens):
+        with self._condition:
+            buckets = self.buckets(model)
+            # A request bigger than a whole bucket could never be admitted; cap it at the bucket size
+            cost = {"requests": 1,
+                    "input_tokens": min(input_tokens, buckets["input_tokens"].capacity),
+                    "output_tokens": min(output_tokens, buckets["output_tokens"].capacity)}
+            tag = max(self._virtual_time, self._session_tags.get(session_id, 0.0)) + 1
+            self._session_tags[session_id] = tag
+            return Ticket(session_id, model, cost, tag, next(self._sequence))
+
+    def queue(self, model):
+        return sorted(self._waiting[model], key=lambda ticket: (ticket.tag, ticket.sequence))
+
+    # Estimated seconds until `ticket` can start, given everything queued ahead of it
+    def estimate_wait(self, ticket, now):
+        buckets = self.buckets(ticket.model)
+        ahead = {name: 0.0 for name in buckets}
+        for queued in self.queue(ticket.model):
+            if queued is ticket:
+                break
+            for name in buckets:
+                ahead[name] += queued.cost[name]
+        wait = max(buckets[name].seconds_until(ticket.cost[name], ahead[name]) for name in buckets)
+        pause = max(self._paused_until.get(ticket.model, 0.0), ticket.not_before) - now
+        return max(wait, pause, 0.0)
+
+    def can_admit(self, ticket, now):
+        if now < max(self._paused_until.get(ticket.model, 0.0), ticket.not_before):
+            return False
+        # Tickets still backing off after a 429 don't hold up the ones behind them
+        ready = [queued for queued in self.queue(ticket.model) if now >= queued.not_before]
+        if ready[0] is not ticket:
+            return False
+        buckets = self.buckets(ticket.model)
+        return all(buckets[name].tokens >= ticket.cost[name] for name in buckets)
+
+    # Block until the ticket is admitted. on_wait(position, seconds) is called from this thread
+    # while it waits, so the caller can show queue status.
+    def acquire(self, ticket, on_wait=None):
+        with self._condition:
+            self._waiting[ticket.model].append(ticket)
+        notified = False
+        try:
+            while True:
+                with self._condition:
+                    now = time.monotonic()
+                    for bucket in self.buckets(ticket.model).values():
+                        bucket.refill(now)
+                    if self.can_admit(ticket, now):
+                        for name, bucket in self.buckets(ticket.model).items():
+                            bucket.take(ticket.cost[name])
+                        self._waiting[ticket.model].remove(ticket)
+                        self._virtual_time = max(self._virtual_time, ticket.tag)
+                        ticket.admitted = True
+                        self._condition.notify_all()
+                        return notified
+                    position = self.queue(ticket.model).index(ticket) + 1
+                    wait = self.estimate_wait(ticket, now)
+                if on_wait is not None:
+                    on_wait(position, wait)
+                    notified = True
+                with self._condition:
+                    self._condition.wait(timeout=min(WAIT_POLL_SECONDS, max(wait, 0.01)))
+        finally:
+            if not ticket.admitted:
+                with self._condition:
+                    if ticket in self._waiting[ticket.model]:
+                        self._waiting[ticket.model].remove(ticket)
+                    self._condition.notify_all()
+
+    # Admit the ticket only if it can start right now without delaying anyone: nothing is waiting, the
+    # model isn't paused, and every bucket keeps at least `headroom` (a fraction of its capacity) afterwards.
+    # For optional background requests, which are skipped rather than queued.
+    def try_acquire(self, ticket, headroom=0.0):
+        with self._condition:
+            now = time.monotonic()
+            buckets = self.buckets(ticket.model)
+            if self._waiting[ticket.model] or now < self._paused_until.get(ticket.model, 0.0):
+                return False
+            for bucket in buckets.values():
+                bucket.refill(now)
+            if any(bucket.tokens - ticket.cost[name] < bucket.capacity * headroom for name, bucket in buckets.items()):
+                return False
+            for name, bucket in buckets.items():
+                bucket.take(ticket.cost[name])
+            self._virtual_time = max(self._virtual_time, ticket.tag)
+            ticket.admitted = True
+            return True
+
+    # Reconcile the reservation with what the request actually used; unused tokens go back to the buckets
+    def release(self, ticket, input_tokens=0, output_tokens=0):
+        with self._condition:
+            buckets = self.buckets(ticket.model)
+            buckets["input_tokens"].give(ticket.cost["input_tokens"] - input_tokens)
+            buckets["output_tokens"].give(ticket.cost["output_tokens"] - output_tokens)
+            ticket.admitted = False
+            self._condition.notify_all()
+
+    # After a 429/529: pause the model for everyone until retry-after, and schedule this ticket's retry
+    # with jitter so the waiting sessions don't all retry at the same instant. Returns the delay in seconds.
+    def backoff(self, ticket, error):
+        ticket.attempts += 1
+        retry_after = retry_after_seconds(error)
+        now = time.monotonic()
+        with self._condition:
+            if retry_after is not None:
+                self._paused_until[ticket.model] = max(self._paused_until.get(ticket.model, 0.0), now + retry_after)
+                delay = retry_after + random.uniform(0, min(MAX_BACKOFF_SECONDS, retry_after * 0.2 + 0.5))
+            else:
+                delay = random.uniform(0, min(MAX_BACKOFF_SECONDS, BASE_BACKOFF_SECONDS * 2 ** ticket.attempts))
+            ticket.not_before = now + delay
+            self._condition.notify_all()
+        return delay
+
+    def can_retry(self, ticket, error):
+        return is_retryable(error) and ticket.attempts < self.max_retries
+
+    def stats(self):
+        with self._condition:
+            now = time.monotonic()
+            report = {}
+            for model, buckets in self._buckets.items():
+                for bucket in buckets.values():
+                    bucket.refill(now)
+                report[model] = {
+                    "waiting": len(self._waiting[model]),
+                    "paused_for": max(0.0, self._paused_until.get(model, 0.0) - now),
+                    **{name: int(bucket.tokens) for name, bucket in buckets.items()},
+                }
+            return report
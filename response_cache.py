@@ -0,0 +1,73 @@
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import date
+
+from student_store import DATA_DIR
+
+RESPONSE_CACHE_PATH = os.path.join(DATA_DIR, "response_cache.db")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    model TEXT, text TEXT, usage TEXT,
+    created REAL, last_used REAL, hits INTEGER DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_responses_last_used ON responses (last_used);
+"""
+
+
+def content_hash(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+# Same model, system prompt, day and messages -> same key
+def response_key(model, system, messages, day=None):
+    day = day or date.today()
+    return content_hash([model, content_hash(system), day.isoformat(), content_hash(messages)])
+
+
+# On-disk cache of complete responses for turns whose input is fully deterministic (e.g. the session greeting).
+# Entries expire after ttl_seconds; beyond max_entries the least recently used are evicted.
+class ResponseCache:
+    def __init__(self, db_path=RESPONSE_CACHE_PATH, ttl_seconds=86400, max_entries=500):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.stats = {"hits": 0, "misses": 0, "writes": 0}
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with self.connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def connect(self):
+        return sqlite3.connect(self.db_path, timeout=5)
+
+    def get(self, key):
+        now = time.time()
+        with self.connect() as conn:
+            row = conn.execute("SELECT text, usage, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and now - row[2] > self.ttl_seconds:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                row = None
+            if row is not None:
+                conn.execute("UPDATE responses SET last_used = ?, hits = hits + 1 WHERE key = ?", (now, key))
+        with self._lock:
+            self.stats["hits" if row is not None else "misses"] += 1
+        if row is None:
+            return None
+        return {"text": row[0], "usage": json.loads(row[1])}
+
+    def put(self, key, model, text, usage):
+        now = time.time()
+        with self.connect() as conn:
+            conn.execute("INSERT OR REPLACE INTO responses (key, model, text, usage, created, last_used) "
+                         "VALUES (?, ?, ?, ?, ?, ?)", (key, model, text, json.dumps(usage), now, now))
+            conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl_seconds,))
+            conn.execute("DELETE FROM responses WHERE key NOT IN "
+                         "(SELECT key FROM responses ORDER BY last_used DESC LIMIT ?)", (self.max_entries,))
+        with self._lock:
+            self.stats["writes"] += 1
@@ -0,0 +1,172 @@
+import hashlib
+import json
+import math
+import os
+import re
+from collections import Counter, defaultdict
+
+from prompt_builder import estimate_tokens
+from student_store import DATA_DIR
+
+RETRIEVAL_INDEX_PATH = os.path.join(DATA_DIR, "retrieval_index.json")
+
+# Largest chunk of JSON kept together; bigger objects and arrays are split along their structure
+MAX_CHUNK_CHARS = 1500
+
+# BM25 parameters
+K1 = 1.5
+B = 0.75
+
+TOKEN_PATTERN = re.compile(r"[A-Za-z]+|\d+")
+CAMEL_BOUNDARY = re.compile(r"(?<=[a-z])(?=[A-Z])")
+STOPWORDS = frozenset("""
+a about an and are as at be by can could did do does for from had has have he her him his how i if in is it
+its me my of on or our she so that the their them there these they this to was we were what when where which
+who why will with would you your please write help tell show give
+""".split())
+
+
+# Lower-cased word/number terms; camelCase JSON keys are split so "pmPeriods" matches "periods"
+def tokenize(text):
+    terms = (term.lower() for word in TOKEN_PATTERN.findall(text) for term in CAMEL_BOUNDARY.split(word))
+    return [term for term in terms if term not in STOPWORDS]
+
+
+def compact(value):
+    return json.dumps(value, separators=(",", ":"))
+
+
+# Split a JSON value into pieces of at most max_chars, each labelled with its path in the document
+def chunk_json(value, path="$", max_chars=MAX_CHUNK_CHARS):
+    text = compact(value)
+    if len(text) <= max_chars or not isinstance(value, (dict, list)) or not value:
+        return [(path, text)]
+
+    chunks = []
+    if isinstance(value, dict):
+        batch = {}
+        for key, item in value.items():
+            if len(compact(item)) > max_chars:
+                chunks.extend(chunk_json(item, f"{path}.{key}", max_chars))
+                continue
+            if batch and len(compact({**batch, key: item})) > max_chars:
+                chunks.append((path, compact(batch)))
+                batch = {}
+            batch[key] = item
+        if batch:
+            chunks.append((path, compact(batch)))
+    else:
+        batch = []
+        start = 0
+        for index, item in enumerate(value):
+            if len(compact(item)) > max_chars:
+                chunks.extend(chunk_json(item, f"{path}[{index}]", max_chars))
+                start = index + 1
+                continue
+            if batch and len(compact(batch + [item])) > max_chars:
+                chunks.append((f"{path}[{start}:{index}]", compact(batch)))
+                batch = []
+                start = index
+            batch.append(item)
+        if batch:
+            chunks.append((f"{path}[{start}:{len(value)}]", compact(batch)))
+    return chunks
+
+
+# Chunks for one student's data sections: the prose description of each section, then its JSON pieces
+def build_chunks(student_id, section_rows):
+    chunks = []
+    for row in section_rows:
+        base = {"student_id": student_id, "section": row["position"], "header": row["header"]}
+        chunks.append({**base, "text": row["description"]})
+        for path, text in chunk_json(json.loads(row["payload"])):
+            chunks.append({**base, "text": f"{path}: {text}"})
+    return chunks
+
+
+class SectionRetriever:
+    def __init__(self, chunks):
+        self.chunks = chunks
+        self.term_counts = [Counter(tokenize(chunk["header"] + " " + chunk["text"])) for chunk in chunks]
+        self.lengths = [sum(counts.values()) for counts in self.term_counts]
+        self.average_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0
+        document_frequency = Counter(term for counts in self.term_counts for term in counts)
+        count = len(chunks)
+        self.idf = {term: math.log(1 + (count - frequency + 0.5) / (frequency + 0.5))
+                    for term, frequency in document_frequency.items()}
+        self.by_student = defaultdict(list)
+        for index, chunk in enumerate(chunks):
+            self.by_student[chunk["student_id"]].append(index)
+
+    def score(self, index, query_terms):
+        counts = self.term_counts[index]
+        norm = K1 * (1 - B + B * self.lengths[index] / (self.average_length or 1))
+        total = 0.0
+        for term in query_terms:
+            frequency = counts.get(term)
+            if frequency:
+                total += self.idf[term] * frequency * (K1 + 1) / (frequency + norm)
+        return total
+
+    # Highest-scoring chunks for the student that fit within the token budget, in document order
+    def search(self, student_id, query, top_k=8, token_budget=4000):
+        query_terms = set(tokenize(query))
+        scored = [(self.score(index, query_terms), index) for index in self.by_student.get(student_id, [])]
+        ranked = [index for score, index in sorted(scored, reverse=True) if score > 0][:top_k]
+
+        selected = []
+        used = 0
+        for index in ranked:
+            cost = estimate_tokens(self.chunks[index]["text"])
+            if used + cost > token_budget:
+                continue
+            selected.append(index)
+            used += cost
+        return [self.chunks[index] for index in sorted(selected)]
+
+    # Regroup retrieved chunks under their section headers for the system prompt
+    def select_sections(self, student_id, query, top_k=8, token_budget=4000):
+        sections = {}
+        for chunk in self.search(student_id, query, top_k, token_budget):
+            sections.setdefault(chunk["section"], (chunk["header"], []))[1].append(chunk["text"])
+        return [(header, "\n".join(texts)) for _, (header, texts) in sorted(sections.items())]
+
+
+def chunks_fingerprint(sections_by_student):
+    payload = compact([[student_id, rows] for student_id, rows in sorted(sections_by_student.items())])
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# Load the chunk index from disk, rebuilding it only when the student data has changed.
+# sections_by_student maps student_id -> StudentStore.prompt_section_rows(student_id)
+def open_retriever(sections_by_student, index_path=RETRIEVAL_INDEX_PATH):
+    fingerprint = chunks_fingerprint(sections_by_student)
+    try:
+        with open(index_path, "r") as f:
+            saved = json.load(f)
+        if saved.get("fingerprint") == fingerprint:
+            return SectionRetriever(saved["chunks"])
+    except (FileNotFoundError, json.JSONDecodeError):
+        pass
+
+    chunks = [chunk for student_id, rows in sorted(sections_by_student.items())
+              for chunk in build_chunks(student_id, rows)]
+    os.makedirs(os.path.dirname(index_path), exist_ok=True)
+    with open(index_path, "w") as f:
+        json.dump({"fingerprint": fingerprint, "chunks": chunks}, f)
+    return SectionRetriever(chunks)
+
+
+# Text of the latest user turns, used as the retrieval query
+def conversation_query(messages, turns=2):
+    texts = []
+    for message in reversed(messages):
+        if message["role"] != "user":
+            continue
+        content = message["content"]
+        if isinstance(content, list):
+            content = " ".join(block.get("text", "") for block in content if block.get("type") == "text")
+        texts.append(content)
+        if len(texts) == turns:
+            break
+    return " ".join(reversed(texts))
@@ -0,0 +1,130 @@
+import bisect
+import difflib
+import os
+import sqlite3
+
+from student_store import DATA_DIR
+
+ROSTER_DB_PATH = os.path.join(DATA_DIR, "roster.db")
+
+# The original demo caseload, used to seed an empty roster
+SEED_STUDENTS = [
+    {"first_name": "Aiden", "last_name": "Patel", "grade": 4},
+    {"first_name": "Charlotte", "last_name": "Brown", "grade": 3},
+    {"first_name": "Emma", "last_name": "Chen", "grade": 5},
+    {"first_name": "Isabella", "last_name": "Garcia", "grade": 3},
+    {"first_name": "Lucas", "last_name": "Nguyen", "grade": 4},
+    {"first_name": "Michael", "last_name": "Faraday", "grade": 5, "special_education": 1, "tier": 3},
+    {"first_name": "Noah", "last_name": "Kim", "grade": 3},
+    {"first_name": "Olivia", "last_name": "Washington", "grade": 5},
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS roster (
+    roster_id INTEGER PRIMARY KEY AUTOINCREMENT,
+    teacher TEXT NOT NULL,
+    first_name TEXT NOT NULL, last_name TEXT NOT NULL, full_name TEXT NOT NULL,
+    grade INTEGER, special_education INTEGER DEFAULT 0, english_language_learner INTEGER DEFAULT 0, tier INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_roster_teacher_name ON roster (teacher, first_name, last_name);
+CREATE TABLE IF NOT EXISTS roster_versions (teacher TEXT PRIMARY KEY, version INTEGER NOT NULL);
+"""
+
+COLUMNS = ("first_name", "last_name", "grade", "special_education", "english_language_learner", "tier")
+
+
+class Roster:
+    def __init__(self, db_path=ROSTER_DB_PATH):
+        self.db_path = db_path
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        with self.connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def connect(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    # Bumped on every change to a teacher's roster; cached roster queries are keyed by it
+    def version(self, teacher):
+        with self.connect() as conn:
+            row = conn.execute("SELECT version FROM roster_versions WHERE teacher = ?", (teacher,)).fetchone()
+        return row["version"] if row else 0
+
+    def add_students(self, teacher, students):
+        with self.connect() as conn:
+            conn.executemany(
+                "INSERT INTO roster (teacher, first_name, last_name, full_name, grade, special_education, "
+                "english_language_learner, tier) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                [(teacher, student["first_name"].strip(), student["last_name"].strip(),
+                  f"{student['first_name'].strip()} {student['last_name'].strip()}",
+                  student.get("grade"), int(bool(student.get("special_education"))),
+                  int(bool(student.get("english_language_learner"))), student.get("tier"))
+                 for student in students])
+            conn.execute("INSERT INTO roster_versions VALUES (?, 1) "
+                         "ON CONFLICT (teacher) DO UPDATE SET version = version + 1", (teacher,))
+
+    def seed(self, teacher, students=SEED_STUDENTS):
+        with self.connect() as conn:
+            empty = conn.execute("SELECT 1 FROM roster WHERE teacher = ? LIMIT 1", (teacher,)).fetchone() is None
+        if empty:
+            self.add_students(teacher, students)
+
+    def teacher_students(self, teacher):
+        with self.connect() as conn:
+            rows = conn.execute(
+                "SELECT roster_id, full_name, " + ", ".join(COLUMNS) + " FROM roster "
+                "WHERE teacher = ? ORDER BY first_name COLLATE NOCASE, last_name COLLATE NOCASE",
+                (teacher,)).fetchall()
+        return [dict(row) for row in rows]
+
+
+# In-memory search index over one teacher's roster: sorted name terms for prefix lookups,
+# with a difflib fallback for typos
+class RosterIndex:
+    def __init__(self, students):
+        self.students = students
+        self.terms = sorted((term, position)
+                            for position, student in enumerate(students)
+                            for term in {student["first_name"].lower(), student["last_name"].lower(),
+                                         student["full_name"].lower()})
+        self.term_keys = [term for term, _ in self.terms]
+        self.distinct_terms = sorted(set(self.term_keys))
+
+    def prefix_matches(self, prefix):
+        start = bisect.bisect_left(self.term_keys, prefix)
+        end = bisect.bisect_left(self.term_keys, prefix + "￿")
+        return {position for _, position in self.terms[start:end]}
+
+    # Positions of students matching every word of the query (by prefix, or fuzzily if nothing matches)
+    def search(self, query):
+        words = query.lower().split()
+        if not words:
+            return set(range(len(self.students)))
+        matches = None
+        for word in words:
+            found = self.prefix_matches(word)
+            if not found:
+                for term in difflib.get_close_matches(word, self.distinct_terms, n=5, cutoff=0.75):
+                    found |= self.prefix_matches(term)
+            matches = found if matches is None else matches & found
+        return matches
+
+    # One page of students matching the search and filters, plus the total number of matches
+    def page(self, query="", grades=None, special_education=None, english_language_learner=None,
+             tiers=None, page=0, page_size=25):
+        positions = self.search(query)
+        results = []
+        for position in sorted(positions):
+            student = self.students[position]
+            if grades and student["grade"] not in grades:
+                continue
+            if special_education is not None and bool(student["special_education"]) != special_education:
+                continue
+            if english_language_learner is not None and bool(student["english_language_learner"]) != english_language_learner:
+                continue
+            if tiers and student["tier"] not in tiers:
+                continue
+            results.append(student)
+        start = page * page_size
+        return results[start:start + page_size], len(results)
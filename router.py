@@ -0,0 +1,120 @@
+import re
+import threading
+import time
+
+# Model dropdown value for routing mode
+AUTO_MODEL = "auto"
+
+HAIKU_35 = "claude-3-5-haiku-20241022"
+SONNET_35 = "claude-3-5-sonnet-20241022"
+SONNET_37 = "claude-3-7-sonnet-20250219"
+OPUS_3 = "claude-3-opus-20240229"
+
+# Extended thinking is only available on these
+THINKING_MODELS = {SONNET_37}
+
+# Most output tokens each model accepts; the route's max_tokens is capped to this
+MAX_OUTPUT_TOKENS = {HAIKU_35: 8192, SONNET_35: 8192, SONNET_37: 64000, OPUS_3: 4096}
+
+# Expected seconds from admission to a finished answer, used until a model has been observed on a kind of turn
+PRIOR_SECONDS = {HAIKU_35: 4.0, SONNET_35: 8.0, SONNET_37: 10.0, OPUS_3: 20.0}
+
+# Quality policy: for each kind of turn, the models good enough for it (most preferred first), the thinking
+# budget (used on models that support thinking; 0 turns it off) and the output cap. The router picks the
+# fastest allowed model, so a model only belongs in a list if its answers are acceptable for that turn.
+ROUTE_POLICY = {
+    "greeting": {"models": [HAIKU_35, SONNET_35], "thinking": 0, "max_tokens": 600},
+    "lookup": {"models": [HAIKU_35, SONNET_35, SONNET_37], "thinking": 0, "max_tokens": 1000},
+    "parent email": {"models": [SONNET_35, SONNET_37], "thinking": 0, "max_tokens": 1500},
+    "iep draft": {"models": [SONNET_37, OPUS_3], "thinking": 4096, "max_tokens": 8000},
+    # Claude 3.5 Haiku doesn't take image input
+    "image analysis": {"models": [SONNET_37, SONNET_35], "thinking": 1024, "max_tokens": 2000},
+}
+
+IEP_TERMS = re.compile(r"\b(iep|present levels?|plaafp|annual goals?|accommodations|modifications|"
+                       r"transition plan|service minutes)\b", re.IGNORECASE)
+DRAFT_TERMS = re.compile(r"\b(draft|write|prepare|create|generate|compose|rewrite)\b", re.IGNORECASE)
+MESSAGE_TERMS = re.compile(r"\b(e-?mail|letter|note|message|update)\b", re.IGNORECASE)
+FAMILY_TERMS = re.compile(r"\b(parents?|guardians?|famil(y|ies)|mom|dad|mother|father|caregivers?)\b", re.IGNORECASE)
+
+
+# Kind of turn, from the latest user message: "image analysis", "iep draft", "parent email" or "lookup".
+# Never "greeting": the app routes the greeting turn itself, since it has no teacher message to classify.
+def classify_turn(message):
+    content = message["content"]
+    if isinstance(content, list):
+        if any(block["type"] == "image" for block in content):
+            return "image analysis"
+        content = " ".join(block["text"] for block in content if block["type"] == "text")
+    if IEP_TERMS.search(content) and DRAFT_TERMS.search(content):
+        return "iep draft"
+    if MESSAGE_TERMS.search(content) and FAMILY_TERMS.search(content):
+        return "parent email"
+    return "lookup"
+
+
+# Picks the model, thinking budget and max_tokens for each turn: the allowed model (per ROUTE_POLICY) with
+# the lowest expected latency, learned from observed response times per kind of turn. A model that returns
+# 529 Overloaded is skipped by every session for overload_cooldown seconds, and the turn falls back to the
+# next allowed model. Shared by all sessions in the process.
+class ModelRouter:
+    def __init__(self, policy=None, overload_cooldown=30.0, smoothing=0.3):
+        self.policy = policy or ROUTE_POLICY
+        self.overload_cooldown = overload_cooldown
+        self.smoothing = smoothing
+        # (route, model) -> [exponentially weighted mean seconds, observations]
+        self._latency = {}
+        self._overloaded_until = {}
+        self._lock = threading.Lock()
+
+    def expected_seconds(self, route, model):
+        observed = self._latency.get((route, model))
+        return observed[0] if observed else PRIOR_SECONDS.get(model, 10.0)
+
+    # {"route", "model", "thinking_budget", "max_tokens", "tried"}; None once every allowed model was tried
+    def route(self, route, tried=()):
+        policy = self.policy[route]
+        candidates = [model for model in policy["models"] if model not in tried]
+        if not candidates:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            # If every remaining model is overloaded, try the one that should be fastest anyway
+            available = [model for model in candidates if self._overloaded_until.get(model, 0.0) <= now] or candidates
+            model = min(available, key=lambda model: (self.expected_seconds(route, model), candidates.index(model)))
+        thinking_budget = policy["thinking"] if model in THINKING_MODELS else 0
+        # The output cap must leave room for the answer after the thinking budget
+        max_tokens = max(policy["max_tokens"], thinking_budget + 1024) if thinking_budget else policy["max_tokens"]
+        return {
+            "route": route,
+            "model": model,
+            "thinking_budget": thinking_budget,
+            "max_tokens": min(max_tokens, MAX_OUTPUT_TOKENS.get(model, max_tokens)),
+            "tried": list(tried) + [model],
+        }
+
+    # The routed model is overloaded: the same turn on the next allowed model, or None
+    def fallback(self, decision):
+        with self._lock:
+            self._overloaded_until[decision["model"]] = time.monotonic() + self.overload_cooldown
+        return self.route(decision["route"], tried=decision["tried"])
+
+    def observe(self, route, model, seconds):
+        with self._lock:
+            observed = self._latency.get((route, model))
+            if observed is None:
+                self._latency[(route, model)] = [seconds, 1]
+            else:
+                observed[0] += self.smoothing * (seconds - observed[0])
+                observed[1] += 1
+
+    def stats(self):
+        now = time.monotonic()
+        with self._lock:
+            return [{
+                "route": route,
+                "model": model,
+                "expected s": round(self.expected_seconds(route, model), 2),
+                "observed": self._latency.get((route, model), (None, 0))[1],
+                "overloaded for s": round(max(0.0, self._overloaded_until.get(model, 0.0) - now), 1),
+            } for route, policy in self.policy.items() for model in policy["models"]]
@@ -0,0 +1,19 @@
+import os
+
+import streamlit as st
+
+
+# Read a tuning knob from .streamlit/secrets.toml, then the environment, falling back to the default.
+# Values are coerced to the type of the default so env vars like "0.5" or "false" work.
+def get_setting(name, default=None):
+    try:
+        value = st.secrets.get(name, None)
+    except FileNotFoundError:
+        value = None
+    if value is None:
+        value = os.environ.get(name)
+    if value is None or default is None or isinstance(value, type(default)):
+        return default if value is None else value
+    if isinstance(default, bool):
+        return str(value).strip().lower() in ("1", "true", "yes", "on")
+    return type(default)(value)
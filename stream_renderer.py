@@ -0,0 +1,90 @@
+import re
+import time
+
+# Default flush policy: at most one frame per interval unless a lot of text has piled up
+FLUSH_INTERVAL_SECONDS = 0.075
+FLUSH_MAX_PENDING_CHARS = 2000
+
+FENCE = re.compile(r"^\s*(```|~~~)", re.MULTILINE)
+
+
+# Index just past the last blank line that ends a finished markdown block, or 0 if there is none.
+# A blank line inside an open code fence doesn't end a block.
+def stable_boundary(text):
+    boundary = 0
+    position = 0
+    while True:
+        index = text.find("\n\n", position)
+        if index == -1:
+            return boundary
+        end = index + 2
+        if len(FENCE.findall(text[:end])) % 2 == 0:
+            boundary = end
+        position = end
+
+
+# Renders a streamed markdown response into a container.
+# Deltas are batched by time and size; finished blocks are written once into their own element
+# and only the unfinished last block is re-rendered on each frame.
+# With a separate `tail` element, finished blocks are appended to the container instead and the tail
+# only ever holds the unfinished block; `committed` resumes after text an earlier renderer already
+# wrote into the container (e.g. on the previous rerun of a polling fragment).
+class StreamRenderer:
+    def __init__(self, container, flush_interval=FLUSH_INTERVAL_SECONDS, max_pending_chars=FLUSH_MAX_PENDING_CHARS,
+                 tail=None, committed=0):
+        self.container = container
+        self.flush_interval = flush_interval
+        self.max_pending_chars = max_pending_chars
+        self.text = ""
+        # Characters of self.text already written into fixed elements
+        self.committed = committed
+        self.rendered = committed
+        self.last_flush = 0.0
+        self.separate_tail = tail is not None
+        self.tail = tail if self.separate_tail else container.empty()
+        self.stats = {"frames": 0, "bytes_sent": 0, "render_seconds": 0.0, "chars": 0}
+
+    def add(self, delta):
+        self.text += delta
+        pending = len(self.text) - self.rendered
+        if pending >= self.max_pending_chars or time.perf_counter() - self.last_flush >= self.flush_interval:
+            self.flush()
+
+    def render(self, element, text):
+        element.markdown(text)
+        self.stats["frames"] += 1
+        self.stats["bytes_sent"] += len(text.encode("utf-8"))
+
+    def flush(self, final=False):
+        if len(self.text) == self.rendered and not final:
+            return
+        started = time.perf_counter()
+
+        # Freeze every block that is now complete in its own element, leaving only the rest in the tail
+        boundary = len(self.text) if final else self.committed + stable_boundary(self.text[self.committed:])
+        if boundary > self.committed:
+            if self.separate_tail:
+                self.render(self.container.empty(), self.text[self.committed:boundary])
+            else:
+                self.render(self.tail, self.text[self.committed:boundary])
+                if not final:
+                    self.tail = self.container.empty()
+            self.committed = boundary
+
+        tail_text = self.text[self.committed:]
+        if tail_text:
+            self.render(self.tail, tail_text)
+
+        self.rendered = len(self.text)
+        self.last_flush = time.perf_counter()
+        self.stats["render_seconds"] += self.last_flush - started
+        self.stats["chars"] = len(self.text)
+
+    def finish(self):
+        self.flush(final=True)
+        return self.stats
+
+
+def format_render_stats(stats):
+    return (f"Rendered {stats['chars']:,} chars in {stats['frames']} frames, "
+            f"{stats['bytes_sent'] / 1024:.1f} KB sent, {stats['render_seconds'] * 1000:.0f} ms rendering")
@@ -0,0 +1,155 @@
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+# Appended to a response the teacher stopped part-way
+TRUNCATION_MARKER = "\n\n_[Response stopped]_"
+
+
+class StreamCancelled(Exception):
+    pass
+
+
+# One assistant response being generated in the background. The worker appends deltas;
+# the UI reads `text` whenever it redraws, so the response survives reruns of the page.
+class StreamJob:
+    def __init__(self, session_id, model):
+        self.job_id = uuid.uuid4().hex
+        self.session_id = session_id
+        self.model = model
+        # Routing decision for this turn in routing mode; model follows it through any fallback
+        self.route = None
+        # queued -> waiting (rate limited) -> streaming -> done | stopped | error
+        self.status = "queued"
+        self.usage = {}
+        self.error = None
+        # (queue position, estimated seconds) while held back by the rate-limit scheduler
+        self.wait = None
+        self.created = time.time()
+        self.finished = None
+        self._chunks = []
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        # Closes the open HTTP stream; set by the worker while it is streaming
+        self._close_stream = None
+
+    @property
+    def text(self):
+        with self._lock:
+            return "".join(self._chunks)
+
+    @property
+    def done(self):
+        return self.status in ("done", "stopped", "error")
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    # Called from the UI: stop waiting or close the HTTP stream right away, so the worker is freed
+    # and no more output tokens are generated
+    def cancel(self):
+        self._cancelled.set()
+        with self._lock:
+            close_stream = self._close_stream
+        if close_stream is not None:
+            try:
+                close_stream()
+            except Exception:
+                logger.debug("Closing a cancelled stream failed", exc_info=True)
+
+    def attach_stream(self, close_stream):
+        with self._lock:
+            self._close_stream = close_stream
+        if self.cancelled:
+            self.cancel()
+
+    def detach_stream(self):
+        with self._lock:
+            self._close_stream = None
+
+    def append(self, delta):
+        with self._lock:
+            self._chunks.append(delta)
+            self.status = "streaming"
+            self.wait = None
+
+    def set_wait(self, position, seconds):
+        if self.cancelled:
+            raise StreamCancelled()
+        self.status = "waiting"
+        self.wait = (position, seconds)
+
+    # Wait for the rate-limit scheduler to admit `ticket`. A job cancelled while it waits, or just as it is
+    # admitted, gives its reservation back and raises StreamCancelled before any request is sent.
+    def admit(self, scheduler, ticket):
+        scheduler.acquire(ticket, on_wait=self.set_wait)
+        if self.cancelled:
+            scheduler.release(ticket)
+            raise StreamCancelled()
+
+    def finish(self, error=None):
+        self.error = error
+        self.finished = time.time()
+        self.status = "error" if error else "stopped" if self.cancelled else "done"
+
+
+# Per-session conversation state and response jobs for the whole server process.
+# Sessions are keyed by an id kept in the page URL, so a refreshed page picks up its conversation
+# and any response still being generated.
+class StreamWorkers:
+    def __init__(self, max_workers=32, session_ttl=4 * 3600):
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="stream")
+        self.session_ttl = session_ttl
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    # The session's persistent state: {"messages": [...], "job": StreamJob or None, ...}
+    def session(self, session_id):
+        now = time.time()
+        with self._lock:
+            for stale in [key for key, state in self._sessions.items()
+                          if now - state["touched"] > self.session_ttl and not self.is_active(state.get("job"))]:
+                del self._sessions[stale]
+            state = self._sessions.setdefault(session_id, {"messages": [], "job": None})
+            state["touched"] = now
+            return state
+
+    def has_session(self, session_id):
+        with self._lock:
+            return session_id in self._sessions
+
+    @staticmethod
+    def is_active(job):
+        return job is not None and not job.done
+
+    def active_job(self, session_id):
+        job = self.session(session_id)["job"]
+        return job if self.is_active(job) else None
+
+    # Run generate(job) on a worker thread; it must not touch Streamlit APIs
+    def submit(self, session_id, model, generate):
+        job = StreamJob(session_id, model)
+        self.session(session_id)["job"] = job
+
+        def run():
+            try:
+                generate(job)
+            except Exception as e:
+                logger.exception("Response generation failed")
+                job.finish(error=str(e))
+            else:
+                if not job.done:
+                    job.finish()
+
+        self.executor.submit(run)
+        return job
+
+    def stats(self):
+        with self._lock:
+            jobs = [state["job"] for state in self._sessions.values()]
+        return {"sessions": len(jobs), "active": sum(1 for job in jobs if self.is_active(job))}
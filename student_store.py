@@ -0,0 +1,293 @@
+import hashlib
+import json
+import os
+import re
+import sqlite3
+from datetime import date, datetime
+
+from prompt_builder import SYSTEM_PROMPT_PATH, is_data_section, load_system_prompt, split_sections
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".wittly")
+STUDENT_DB_PATH = os.path.join(DATA_DIR, "student_data.db")
+
+# Bump when the schema or the parsing below changes so existing stores are rebuilt
+SCHEMA_VERSION = "1"
+
+SUBJECTS = {1: "reading", 2: "mathematics"}
+SEASONS = {1: "fall", 2: "winter", 3: "spring"}
+PM_STATUSES = {3: "Assigned", 5: "Skipped", 6: "Completed"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+CREATE TABLE IF NOT EXISTS students (
+    student_id INTEGER PRIMARY KEY,
+    first_name TEXT, last_name TEXT, full_name TEXT,
+    grade TEXT, birthdate TEXT, gender TEXT,
+    special_education INTEGER, english_language_learner INTEGER, economically_disadvantaged INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_students_name ON students (full_name);
+CREATE TABLE IF NOT EXISTS screener_results (
+    student_id INTEGER, subject TEXT, season TEXT,
+    name TEXT, test_date TEXT, overall_score INTEGER, percentile_rank INTEGER, gle TEXT, suggested_tier INTEGER,
+    PRIMARY KEY (student_id, subject, season)
+);
+CREATE TABLE IF NOT EXISTS screener_domains (
+    student_id INTEGER, subject TEXT, season TEXT, position INTEGER,
+    domain TEXT, scaled_score INTEGER, gle TEXT,
+    PRIMARY KEY (student_id, subject, season, domain)
+);
+CREATE TABLE IF NOT EXISTS pm_summaries (
+    student_id INTEGER, subject TEXT, domain TEXT, level INTEGER, date_range TEXT,
+    current_roi REAL, moderate_roi REAL, aggressive_roi REAL, roi_target TEXT, roi_result TEXT,
+    PRIMARY KEY (student_id, subject)
+);
+CREATE TABLE IF NOT EXISTS pm_periods (
+    student_id INTEGER, subject TEXT, week INTEGER,
+    week_range TEXT, week_start TEXT, date_completed TEXT, scaled_score INTEGER, status TEXT,
+    PRIMARY KEY (student_id, subject, week)
+);
+CREATE TABLE IF NOT EXISTS phase_changes (
+    student_id INTEGER, subject TEXT, week INTEGER, phase_change_id INTEGER,
+    status TEXT, date TEXT, score INTEGER,
+    PRIMARY KEY (student_id, subject, week, phase_change_id)
+);
+CREATE TABLE IF NOT EXISTS assessments (
+    student_id INTEGER, date TEXT, name TEXT, overall_score INTEGER, overall_placement TEXT, domain_results TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_assessments_student ON assessments (student_id, date);
+CREATE TABLE IF NOT EXISTS prompt_sections (
+    student_id INTEGER, position INTEGER, header TEXT, description TEXT, payload TEXT,
+    PRIMARY KEY (student_id, position)
+);
+"""
+
+
+# The JSON pasted into the prompt is not always valid (the screener blob is wrapped in a stray "{"),
+# so fall back to dropping one level of wrapping braces
+def parse_json_blob(text):
+    text = text.strip()
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return json.loads(text[1:].strip())
+
+
+# Split a data section into its prose description and its JSON payload
+def split_data_section(body):
+    match = re.search(r"^\{", body, re.MULTILINE)
+    if match is None:
+        return body.strip(), None
+    return body[:match.start()].strip(), parse_json_blob(body[match.start():])
+
+
+def us_date_to_iso(value):
+    if not value:
+        return None
+    return datetime.strptime(value, "%m/%d/%Y").date().isoformat()
+
+
+def prompt_fingerprint(prompt):
+    return hashlib.sha256((SCHEMA_VERSION + prompt).encode("utf-8")).hexdigest()
+
+
+def insert_profile(conn, profile):
+    detail = profile.get("studentDetail", {})
+    demographics = detail.get("demographics", {})
+    conn.execute(
+        "INSERT OR REPLACE INTO students VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (profile["userID"], profile.get("firstName"), profile.get("lastName"),
+         f"{profile.get('firstName', '')} {profile.get('lastName', '')}".strip(),
+         detail.get("grade", {}).get("shortName"), profile.get("birthdate"), demographics.get("gender"),
+         int(bool(demographics.get("specialEducation"))),
+         int(bool(demographics.get("englishLanguageLearner"))),
+         int(bool(demographics.get("economicallyDisadvantaged")))))
+    return profile["userID"]
+
+
+def insert_screener(conn, student_id, screener):
+    for subject in ("reading", "mathematics"):
+        for season, result in screener.get(subject, {}).items():
+            if season not in SEASONS.values() or not result:
+                continue
+            conn.execute(
+                "INSERT OR REPLACE INTO screener_results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (student_id, subject, season, result.get("name"), result.get("testdate"),
+                 result.get("overallScore"), result.get("percentileRank"), result.get("gle"),
+                 result.get("suggestedTier")))
+            conn.executemany(
+                "INSERT OR REPLACE INTO screener_domains VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(student_id, subject, season, position, domain["name"], domain.get("scaledScore"), domain.get("gle"))
+                 for position, domain in enumerate(result.get("domains", []))])
+
+
+def insert_progress(conn, student_id, progress):
+    subject = SUBJECTS.get(progress.get("subjectId"), str(progress.get("subjectId")))
+    conn.execute(
+        "INSERT OR REPLACE INTO pm_summaries VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (student_id, subject, progress.get("domainName"), progress.get("levelId"), progress.get("dateRangeValue"),
+         progress.get("currentROI"), progress.get("moderateROI"), progress.get("aggressiveROI"),
+         progress.get("roi"), progress.get("roiResult")))
+    conn.executemany(
+        "INSERT OR REPLACE INTO pm_periods VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+        [(student_id, subject, period["week"], period.get("weekRangeValue"),
+          us_date_to_iso(period.get("weekRangeValue", "").split(" - ")[0]),
+          us_date_to_iso(period.get("formattedDateCompleted")),
+          period.get("scaledScore"), PM_STATUSES.get(period.get("statusId"), str(period.get("statusId"))))
+         for period in progress.get("pmPeriods", [])])
+    conn.executemany(
+        "INSERT OR REPLACE INTO phase_changes VALUES (?, ?, ?, ?, ?, ?, ?)",
+        [(student_id, subject, int(change["week"]), change.get("phaseChangeId"), change.get("status"),
+          change.get("date"), change.get("score"))
+         for change in progress.get("phaseChanges", [])])
+
+
+def insert_assessments(conn, student_id, records):
+    conn.executemany(
+        "INSERT INTO assessments VALUES (?, ?, ?, ?, ?, ?)",
+        [(student_id, us_date_to_iso(record.get("date")), record.get("name"),
+          record.get("overall_score", record.get("overall_scale_score")), record.get("overall_placement"),
+          json.dumps(record.get("domain_results")) if record.get("domain_results") else None)
+         for record in records.get("assessments", [])])
+
+
+# Parse every data section of the prompt into the store, replacing whatever was there
+def load_prompt_data(conn, prompt):
+    for table in ("students", "screener_results", "screener_domains", "pm_summaries", "pm_periods",
+                  "phase_changes", "assessments", "prompt_sections"):
+        conn.execute(f"DELETE FROM {table}")
+
+    student_id = None
+    pending = []
+    for position, (header, body) in enumerate(split_sections(prompt)):
+        if not is_data_section(header):
+            continue
+        description, payload = split_data_section(body)
+        if payload is None:
+            continue
+        lowered = header.lower()
+        if "demographic" in lowered:
+            student_id = insert_profile(conn, payload)
+        elif "universal" in lowered:
+            insert_screener(conn, payload.get("userID", student_id), payload)
+        elif "progress monitoring" in lowered:
+            pending.append(("progress", payload))
+        else:
+            pending.append(("assessments", payload))
+        pending.append(("section", (position, header, description, payload)))
+
+    # Progress and assessment blobs don't carry a student id; they belong to the profile above them
+    for kind, payload in pending:
+        if kind == "progress":
+            insert_progress(conn, student_id, payload)
+        elif kind == "assessments":
+            insert_assessments(conn, student_id, payload)
+        else:
+            position, header, description, data = payload
+            conn.execute("INSERT OR REPLACE INTO prompt_sections VALUES (?, ?, ?, ?, ?)",
+                         (student_id, position, header, description, json.dumps(data, separators=(",", ":"))))
+
+
+class StudentStore:
+    def __init__(self, db_path=STUDENT_DB_PATH):
+        self.db_path = db_path
+
+    # Short-lived connections keep the store safe to use from any Streamlit script thread
+    def connect(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    # Rebuild the store only when the prompt file (or the schema) has changed since the last build
+    def sync(self, prompt):
+        os.makedirs(os.path.dirname(self.db_path), exist_ok=True)
+        fingerprint = prompt_fingerprint(prompt)
+        with self.connect() as conn:
+            conn.executescript(SCHEMA)
+            row = conn.execute("SELECT value FROM meta WHERE key = 'fingerprint'").fetchone()
+            if row is not None and row["value"] == fingerprint:
+                return False
+            load_prompt_data(conn, prompt)
+            conn.execute("INSERT OR REPLACE INTO meta VALUES ('fingerprint', ?)", (fingerprint,))
+        return True
+
+    # Fingerprint of the data currently in the store, for keying caches built from it
+    def version(self):
+        rows = self.query("SELECT value FROM meta WHERE key = 'fingerprint'")
+        return rows[0]["value"] if rows else None
+
+    def query(self, sql, params=()):
+        with self.connect() as conn:
+            return [dict(row) for row in conn.execute(sql, params).fetchall()]
+
+    def find_student(self, full_name):
+        rows = self.query("SELECT * FROM students WHERE full_name = ?", (full_name,))
+        return rows[0] if rows else None
+
+    def screener_results(self, student_id, subject=None, season=None):
+        sql = "SELECT * FROM screener_results WHERE student_id = ?"
+        params = [student_id]
+        if subject:
+            sql += " AND subject = ?"
+            params.append(subject)
+        if season:
+            sql += " AND season = ?"
+            params.append(season)
+        return self.query(sql + " ORDER BY subject DESC, test_date", params)
+
+    def screener_domains(self, student_id, subject, season):
+        return self.query(
+            "SELECT domain, scaled_score, gle FROM screener_domains "
+            "WHERE student_id = ? AND subject = ? AND season = ? ORDER BY position",
+            (student_id, subject, season))
+
+    def progress_summary(self, student_id, subject=None):
+        sql = "SELECT * FROM pm_summaries WHERE student_id = ?"
+        params = [student_id]
+        if subject:
+            sql += " AND subject = ?"
+            params.append(subject)
+        rows = self.query(sql, params)
+        return rows[0] if rows else None
+
+    def progress_periods(self, student_id, subject, first_week=None, last_week=None):
+        return self.query(
+            "SELECT * FROM pm_periods WHERE student_id = ? AND subject = ? AND week BETWEEN ? AND ? ORDER BY week",
+            (student_id, subject, first_week or 0, last_week or 10 ** 6))
+
+    def phase_changes(self, student_id, subject):
+        return self.query(
+            "SELECT * FROM phase_changes WHERE student_id = ? AND subject = ? ORDER BY week, phase_change_id",
+            (student_id, subject))
+
+    def assessments(self, student_id):
+        rows = self.query("SELECT * FROM assessments WHERE student_id = ? ORDER BY date DESC", (student_id,))
+        for row in rows:
+            row["domain_results"] = json.loads(row["domain_results"]) if row["domain_results"] else None
+        return rows
+
+    def student_ids(self):
+        return [row["student_id"] for row in self.query("SELECT student_id FROM students ORDER BY student_id")]
+
+    def prompt_section_rows(self, student_id):
+        return self.query("SELECT position, header, description, payload FROM prompt_sections "
+                          "WHERE student_id = ? ORDER BY position", (student_id,))
+
+    # Data sections for the system prompt, rebuilt from the store with compact JSON
+    def prompt_sections(self, student_id):
+        return [(row["header"], f"{row['description']}\n\n{row['payload']}")
+                for row in self.prompt_section_rows(student_id)]
+
+
+def age_on(birthdate, today=None):
+    if not birthdate:
+        return None
+    born = date.fromisoformat(birthdate)
+    today = today or date.today()
+    return today.year - born.year - ((today.month, today.day) < (born.month, born.day))
+
+
+# Build (or reuse) the store for the prompt file on disk
+def open_student_store(prompt_path=SYSTEM_PROMPT_PATH, db_path=STUDENT_DB_PATH):
+    store = StudentStore(db_path)
+    store.sync(load_system_prompt(prompt_path))
+    return store
@@ -0,0 +1,140 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from student_store import DATA_DIR
+
+logger = logging.getLogger(__name__)
+
+REQUEST_LOG_PATH = os.path.join(DATA_DIR, "requests.jsonl")
+
+PERCENTILES = [0.5, 0.9, 0.99]
+
+# Latency columns summarized in the admin view, with their labels
+LATENCY_COLUMNS = {"queue_wait_s": "queue wait s", "ttft_s": "TTFT s", "duration_s": "duration s",
+                   "output_tokens_per_s": "output tok/s"}
+
+
+def utc_now():
+    return datetime.now(timezone.utc).isoformat(timespec="milliseconds")
+
+
+# Appends JSON records to a log file from a background thread, so callers never wait on disk.
+# The file is rotated to .1, .2, ... once it passes max_bytes.
+class RequestLogWriter:
+    def __init__(self, path=REQUEST_LOG_PATH, max_bytes=10 * 1024 * 1024, backups=5,
+                 flush_interval=1.0, max_pending=10000):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.backups = backups
+        self.flush_interval = flush_interval
+        self.dropped = 0
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._flushed = threading.Condition()
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._thread = threading.Thread(target=self.run, name="request-log", daemon=True)
+        self._thread.start()
+        atexit.register(self.flush)
+
+    def write(self, record):
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            # Better to lose a telemetry record than to block a response
+            self.dropped += 1
+
+    def run(self):
+        while True:
+            batch = [self._queue.get()]
+            try:
+                while True:
+                    batch.append(self._queue.get(timeout=self.flush_interval if len(batch) < 100 else 0))
+            except queue.Empty:
+                pass
+            try:
+                self.rotate_if_needed()
+                with open(self.path, "a") as f:
+                    f.writelines(json.dumps(record, default=str) + "\n" for record in batch)
+            except Exception:
+                logger.exception("Writing %d request log records failed", len(batch))
+            for _ in batch:
+                self._queue.task_done()
+            with self._flushed:
+                self._flushed.notify_all()
+
+    def rotate_if_needed(self):
+        try:
+            if os.path.getsize(self.path) < self.max_bytes:
+                return
+        except OSError:
+            return
+        for index in range(self.backups - 1, 0, -1):
+            if os.path.exists(f"{self.path}.{index}"):
+                os.replace(f"{self.path}.{index}", f"{self.path}.{index + 1}")
+        os.replace(self.path, f"{self.path}.1")
+
+    # Wait (up to timeout) for everything queued so far to reach the file
+    def flush(self, timeout=5.0):
+        deadline = time.monotonic() + timeout
+        with self._flushed:
+            while self._queue.unfinished_tasks and time.monotonic() < deadline:
+                self._flushed.wait(0.1)
+
+
+def read_records(path=REQUEST_LOG_PATH, backups=5):
+    records = []
+    for candidate in [f"{path}.{index}" for index in range(backups, 0, -1)] + [path]:
+        try:
+            with open(candidate) as f:
+                for line in f:
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue
+        except OSError:
+            continue
+    return records
+
+
+def records_frame(records):
+    frame = pd.DataFrame(records)
+    if frame.empty:
+        return frame
+    frame["ts"] = pd.to_datetime(frame["ts"], utc=True)
+    frame["hour"] = frame["ts"].dt.floor("h")
+    for column in list(LATENCY_COLUMNS) + ["input_tokens", "output_tokens", "cache_read_input_tokens",
+                                     "cache_creation_input_tokens", "tokens_saved"]:
+        if column not in frame:
+            frame[column] = float("nan")
+    frame["error"] = frame["error_class"].notna() if "error_class" in frame else False
+    frame["stopped"] = frame["stopped"].fillna(False).astype(bool) if "stopped" in frame else False
+    return frame
+
+
+# Request count, error rate, stopped turns (and output tokens they saved), cache-hit rate and latency
+# percentiles per group (e.g. model, or model and hour)
+def percentile_summary(frame, by):
+    if frame.empty:
+        return frame
+    grouped = frame.groupby(by)
+    summary = pd.DataFrame({
+        "requests": grouped.size(),
+        "error_rate": grouped["error"].mean(),
+        "stopped": grouped["stopped"].sum(),
+        "tokens_saved": grouped["tokens_saved"].sum(),
+        "cache_hit_rate": grouped["cache_read_input_tokens"].sum()
+        / (grouped["cache_read_input_tokens"].sum() + grouped["cache_creation_input_tokens"].sum()
+           + grouped["input_tokens"].sum()).where(lambda total: total > 0),
+    })
+    for column, label in LATENCY_COLUMNS.items():
+        quantiles = grouped[column].quantile(PERCENTILES).unstack()
+        for percentile in PERCENTILES:
+            summary[f"{label} p{int(percentile * 100)}"] = quantiles[percentile]
+    return summary.reset_index()
@@ -0,0 +1,51 @@
+import os
+from unittest import mock
+
+import pytest
+from streamlit.testing.v1 import AppTest
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+ADMIN = {"is_logged_in": True, "email": "admin@example.com"}
+
+
+@pytest.fixture(autouse=True)
+def no_background_requests(monkeypatch):
+    monkeypatch.setenv("PREWARM", "false")
+    monkeypatch.delenv("ADMIN_VIEW", raising=False)
+    monkeypatch.delenv("ADMIN_USERS", raising=False)
+
+
+def admin_page(**secrets):
+    app = AppTest.from_file(APP_PATH, default_timeout=30)
+    # No API key: the regular page stops at the key prompt, so nothing is sent anywhere
+    app.secrets.update(secrets)
+    app.query_params["view"] = "admin"
+    return app
+
+
+def shows_admin_view(app):
+    return any(title.value == "Request telemetry" for title in app.title)
+
+
+def test_query_parameter_alone_does_not_open_admin_view():
+    app = admin_page().run()
+    assert not shows_admin_view(app)
+
+
+def test_admin_setting_without_sign_in_does_not_open_admin_view():
+    app = admin_page(ADMIN_VIEW=True, ADMIN_USERS="admin@example.com").run()
+    assert not shows_admin_view(app)
+
+
+def test_signed_in_user_must_be_on_the_allowlist():
+    with mock.patch("streamlit.user", dict(ADMIN, email="someone@example.com")):
+        app = admin_page(ADMIN_VIEW=True, ADMIN_USERS="admin@example.com").run()
+    assert not shows_admin_view(app)
+
+
+def test_allowlisted_admin_sees_admin_view():
+    with mock.patch("streamlit.user", ADMIN):
+        app = admin_page(ADMIN_VIEW=True, ADMIN_USERS="Admin@example.com").run()
+    assert not app.exception
+    assert shows_admin_view(app)
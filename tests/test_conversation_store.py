@@ -0,0 +1,45 @@
+from conversation_store import ConversationStore, open_conversation
+
+
+def long_conversation(tmp_path, turns=100, chars=2000):
+    store = ConversationStore(db_path=str(tmp_path / "conversations.db"), blob_dir=str(tmp_path / "blobs"))
+    for turn in range(turns):
+        store.append("c1", {"role": "user", "content": f"question {turn} " + "x" * chars}, owner="o1")
+        store.append("c1", {"role": "assistant", "content": f"answer {turn} " + "y" * chars}, owner="o1")
+    return store
+
+
+def test_reopening_loads_only_what_fits_the_budget(tmp_path):
+    store = long_conversation(tmp_path)
+    messages = open_conversation(store, "c1", owner="o1", token_budget=10000)
+    assert 0 < len(messages) < 40
+    assert messages.earlier + len(messages) == 200
+    assert messages[0]["role"] == "user"
+    assert messages[-1]["content"].startswith("answer 99 ")
+
+
+def test_earlier_pages_come_back_in_order(tmp_path):
+    store = long_conversation(tmp_path)
+    messages = open_conversation(store, "c1", owner="o1", token_budget=10000)
+    page = messages.earlier_page(0, 10)
+    assert [message["content"].split()[:2] for message in page][-1] == \
+        store.messages("c1", limit=1, before=messages.earlier)[0]["content"].split()[:2]
+    everything = messages.earlier_page(0, 1000)
+    assert len(everything) == messages.earlier
+    assert everything[0]["content"].startswith("question 0 ")
+    assert messages.earlier_page(messages.earlier, 10) == []
+
+
+def test_short_conversation_is_loaded_whole(tmp_path):
+    store = long_conversation(tmp_path, turns=3, chars=10)
+    messages = open_conversation(store, "c1", owner="o1")
+    assert messages.earlier == 0
+    assert len(messages) == 6
+
+
+def test_appends_after_reopening_continue_the_conversation(tmp_path):
+    store = long_conversation(tmp_path)
+    messages = open_conversation(store, "c1", owner="o1", token_budget=10000)
+    messages.append({"role": "user", "content": "one more"})
+    assert store.message_count("c1") == 201
+    assert store.messages("c1", limit=1)[0]["content"] == "one more"
@@ -0,0 +1,32 @@
+import sqlite3
+
+from growth import scores_version
+from student_store import SCHEMA, StudentStore
+
+
+def scores_store(tmp_path, scores):
+    store = StudentStore(db_path=str(tmp_path / "student_data.db"))
+    with sqlite3.connect(store.db_path) as conn:
+        conn.executescript(SCHEMA)
+        conn.executemany("INSERT INTO pm_periods (student_id, subject, week, scaled_score, status) "
+                         "VALUES (1, 'reading', ?, ?, 'Completed')", list(enumerate(scores, start=1)))
+    return store
+
+
+def set_score(store, week, score):
+    with sqlite3.connect(store.db_path) as conn:
+        conn.execute("UPDATE pm_periods SET scaled_score = ? WHERE week = ?", (score, week))
+
+
+def test_version_is_stable_while_nothing_changes(tmp_path):
+    store = scores_store(tmp_path, [400, 410, 420])
+    assert scores_version(store) == scores_version(store)
+
+
+def test_corrections_that_keep_the_sums_still_change_the_version(tmp_path):
+    store = scores_store(tmp_path, [400, 410, 420, 430])
+    before = scores_version(store)
+    # Week 1 up by 2 and week 2 down by 1 leaves the week-weighted score total where it was
+    set_score(store, 1, 402)
+    set_score(store, 2, 409)
+    assert scores_version(store) != before
@@ -0,0 +1,16 @@
+from history import HistoryManager
+
+
+def test_unloaded_earlier_messages_are_noted_as_omitted():
+    messages = [{"role": "user", "content": "Next question"}]
+    manager = HistoryManager(token_budget=10000, summary_model=None)
+    api_messages = manager.build_messages(messages, earlier=40)
+    assert "omitted" in api_messages[0]["content"]
+    assert manager.last_usage["dropped"] == 40
+
+
+def test_fully_loaded_history_has_no_note():
+    messages = [{"role": "user", "content": "Hi"}, {"role": "assistant", "content": "Hello"},
+                {"role": "user", "content": "Next question"}]
+    api_messages = HistoryManager(token_budget=10000, summary_model=None).build_messages(messages)
+    assert api_messages[0]["content"] == "Hi"
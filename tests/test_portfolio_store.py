@@ -0,0 +1,30 @@
+import io
+import sqlite3
+
+from portfolio_store import PortfolioStore
+
+
+def portfolio(tmp_path):
+    return PortfolioStore(db_path=str(tmp_path / "portfolio.db"), files_dir=str(tmp_path / "portfolio"))
+
+
+def test_students_who_share_a_name_keep_separate_samples(tmp_path):
+    store = portfolio(tmp_path)
+    store.add_sample("o1", 1, "Emma Chen", "Writing", "essay.txt", io.BytesIO(b"first essay"))
+    store.add_sample("o1", 2, "Emma Chen", "Math", "worksheet.txt", io.BytesIO(b"second worksheet"))
+    assert [sample["filename"] for sample in store.samples("o1", 1)] == ["essay.txt"]
+    assert [sample["filename"] for sample in store.samples("o1", 2)] == ["worksheet.txt"]
+    # The same file can be filed under both
+    store.add_sample("o1", 2, "Emma Chen", "Writing", "essay.txt", io.BytesIO(b"first essay"))
+    assert len(store.samples("o1", 2)) == 2
+    assert store.samples("o1", None) == []
+
+
+def test_samples_filed_by_name_are_adopted_by_their_student(tmp_path):
+    store = portfolio(tmp_path)
+    store.add_sample("o1", 1, "Emma Chen", "Writing", "essay.txt", io.BytesIO(b"an essay"))
+    with sqlite3.connect(store.db_path) as conn:
+        conn.execute("UPDATE samples SET roster_id = NULL")
+    assert store.samples("o1", 1) == []
+    assert store.adopt_named_samples({"Emma Chen": 7}) == 1
+    assert [sample["filename"] for sample in store.samples("o1", 7)] == ["essay.txt"]
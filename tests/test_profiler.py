@@ -0,0 +1,35 @@
+import os
+import tracemalloc
+
+import pytest
+from streamlit.testing.v1 import AppTest
+
+APP_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "app.py")
+
+
+@pytest.fixture(autouse=True)
+def no_background_requests(monkeypatch):
+    monkeypatch.setenv("PREWARM", "false")
+    monkeypatch.delenv("PROFILE", raising=False)
+
+
+def test_opting_out_stops_memory_tracing():
+    assert not tracemalloc.is_tracing()
+    # No API key: the page stops at the key prompt, after the profiler is set up
+    app = AppTest.from_file(APP_PATH, default_timeout=30)
+    app.secrets["PROFILE_URL_OPT_IN"] = True
+    app.query_params["profile"] = "1"
+    app.run()
+    assert app.session_state["profiler"].enabled
+    assert tracemalloc.is_tracing()
+
+    del app.query_params["profile"]
+    app.run()
+    assert not app.session_state["profiler"].enabled
+    assert not tracemalloc.is_tracing()
+
+    app.query_params["profile"] = "1"
+    app.run()
+    assert app.session_state["profiler"].enabled
+    assert tracemalloc.is_tracing()
+    app.session_state["profiler"].stop()
@@ -0,0 +1,21 @@
+from prompt_builder import build_system_blocks, load_system_prompt, no_data_system_blocks
+
+
+def test_prompt_file_data_belongs_to_one_student():
+    blocks = build_system_blocks(load_system_prompt())
+    assert any("Faraday" in block["text"] for block in blocks)
+
+
+def test_student_without_data_gets_no_other_students_data():
+    blocks = no_data_system_blocks(load_system_prompt(), student_name="Aiden Patel")
+    text = "\n".join(block["text"] for block in blocks)
+    assert "Faraday" not in text
+    assert "Michael" not in text
+    assert "No demographic, assessment or progress-monitoring data is on file for Aiden Patel" in text
+    assert blocks[-1]["text"].endswith("Aiden Patel")
+
+
+def test_no_student_selected_sends_no_data():
+    blocks = no_data_system_blocks(load_system_prompt())
+    assert len(blocks) == 2
+    assert "Faraday" not in "\n".join(block["text"] for block in blocks)
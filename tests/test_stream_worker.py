@@ -0,0 +1,63 @@
+import threading
+import time
+
+import pytest
+
+from rate_limiter import RateLimitScheduler
+from stream_worker import StreamCancelled, StreamJob
+
+MODEL = "claude-3-7-sonnet-20250219"
+
+
+# One request a minute: once a request holds the slot, the next one queues
+def busy_scheduler():
+    scheduler = RateLimitScheduler(limits={"requests": 1})
+    scheduler.acquire(scheduler.ticket("other-session", MODEL, input_tokens=100, output_tokens=100))
+    return scheduler
+
+
+def test_cancelling_a_queued_job_stops_it_before_admission():
+    scheduler = busy_scheduler()
+    job = StreamJob("session", MODEL)
+    ticket = scheduler.ticket(job.session_id, MODEL, input_tokens=100, output_tokens=100)
+    outcome = []
+
+    def run():
+        try:
+            job.admit(scheduler, ticket)
+            outcome.append("admitted")
+        except StreamCancelled:
+            outcome.append("cancelled")
+
+    worker = threading.Thread(target=run)
+    worker.start()
+    deadline = time.monotonic() + 5
+    while job.status != "waiting" and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert job.status == "waiting"
+    job.cancel()
+    worker.join(timeout=5)
+    assert outcome == ["cancelled"]
+    assert not ticket.admitted
+    assert scheduler.queue(MODEL) == []
+
+
+def test_job_cancelled_as_it_is_admitted_gives_the_reservation_back():
+    scheduler = RateLimitScheduler()
+    job = StreamJob("session", MODEL)
+    ticket = scheduler.ticket(job.session_id, MODEL, input_tokens=1000, output_tokens=500)
+    job.cancel()
+    with pytest.raises(StreamCancelled):
+        job.admit(scheduler, ticket)
+    assert not ticket.admitted
+    buckets = scheduler.buckets(MODEL)
+    assert buckets["input_tokens"].tokens == pytest.approx(buckets["input_tokens"].capacity)
+    assert buckets["output_tokens"].tokens == pytest.approx(buckets["output_tokens"].capacity)
+
+
+def test_job_not_cancelled_is_admitted():
+    scheduler = RateLimitScheduler()
+    job = StreamJob("session", MODEL)
+    ticket = scheduler.ticket(job.session_id, MODEL, input_tokens=100, output_tokens=100)
+    job.admit(scheduler, ticket)
+    assert ticket.admitted
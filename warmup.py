@@ -0,0 +1,90 @@
+import importlib
+import logging
+import statistics
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+# Imported when this module is first imported, i.e. on the first script run of the server process
+PROCESS_STARTED = time.time()
+
+
+def import_modules(names):
+    for name in names:
+        importlib.import_module(name)
+
+
+# Process-level warm-up: named steps (imports, derived data, connections) run once per process on a
+# background thread, so the first sessions don't pay for them one interaction at a time. Also tells
+# cold-start from steady-state latency: the first page run and the first API request of the process,
+# and anything started while the warm-up is still running, are reported apart from the rest.
+class WarmUp:
+    def __init__(self, keep_page_runs=200):
+        self.started = None
+        self.finished = None
+        self.steps = []
+        self.first_page_seconds = None
+        self.page_runs = deque(maxlen=keep_page_runs)
+        self.requests = 0
+        self._thread = None
+        self._lock = threading.Lock()
+
+    @property
+    def done(self):
+        return self.finished is not None
+
+    # Start the steps ([(name, function), ...]) unless this process already has
+    def start(self, steps):
+        with self._lock:
+            if self._thread is not None:
+                return False
+            self.started = time.time()
+            self._thread = threading.Thread(target=self.run, args=(steps,), name="warm-up", daemon=True)
+        self._thread.start()
+        return True
+
+    def run(self, steps):
+        for name, function in steps:
+            started = time.perf_counter()
+            error = None
+            try:
+                function()
+            except Exception as e:
+                # A failed step only means that work happens lazily later, as it would without a warm-up
+                logger.warning("Warm-up step %s failed: %s", name, e)
+                error = type(e).__name__
+            self.steps.append({"step": name, "seconds": time.perf_counter() - started, "error": error})
+        self.finished = time.time()
+        logger.info("Warm-up finished in %.2fs: %s", self.finished - self.started,
+                    ", ".join(f"{step['step']} {step['seconds']:.2f}s" for step in self.steps))
+
+    def wait(self, timeout=None):
+        if self._thread is not None:
+            self._thread.join(timeout)
+        return self.done
+
+    def record_page_run(self, seconds):
+        if self.first_page_seconds is None:
+            self.first_page_seconds = seconds
+        else:
+            self.page_runs.append(seconds)
+
+    # "first" for the process's first API request, "warming" while the warm-up runs, then "steady"
+    def request_phase(self):
+        with self._lock:
+            self.requests += 1
+            if self.requests == 1:
+                return "first"
+        return "steady" if self.done else "warming"
+
+    def report(self):
+        return {
+            "process_started": PROCESS_STARTED,
+            "warm_up_seconds": self.finished - self.started if self.done else None,
+            "steps": list(self.steps),
+            "first_page_seconds": self.first_page_seconds,
+            "steady_page_seconds": statistics.median(self.page_runs) if self.page_runs else None,
+            "requests": self.requests,
+        }